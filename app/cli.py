@@ -0,0 +1,256 @@
+"""
+Offline bulk calculator: evaluate large CSV or NDJSON files without the HTTP API.
+
+Input records have the same fields as ``POST /calculations``: ``type``,
+``a``, ``b``, ``operands`` and ``user_id``. In CSV, the header names the
+columns, empty cells are missing values, and ``operands`` is separated by
+semicolons (``1;2;3``). Each output row repeats the input with its
+``result``, or with an ``error`` when the record is invalid or can't be
+computed. Output rows carry the 1-based input ``line`` and keep input order.
+The exit status is 1 when any record failed.
+
+The input is read as a stream and cut into chunks of CLI_CHUNK_SIZE records.
+Chunks are validated and computed in a process pool, with a bounded number
+in flight, so memory use doesn't grow with the file size. Validation and
+computation reuse ``schemas.validate_calculations`` and ``compute_result``,
+so results match the API.
+
+With ``--db``, valid results are also inserted in bulk: one transaction per
+chunk through ``create_calculations`` (COPY on Postgres), routed to shards
+when sharding is enabled. Results aren't recomputed for the insert.
+
+    python -m app.cli backfill.ndjson -o results.ndjson
+    python -m app.cli backfill.csv --db --workers 8
+    cat backfill.ndjson | python -m app.cli - --format ndjson > results.ndjson
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app import models, schemas, sharding
+from app.db import SessionLocal, init_db
+from app.operations import calculations as calc_ops
+
+CLI_CHUNK_SIZE = int(os.getenv("CLI_CHUNK_SIZE", "5000"))
+
+FORMATS = ("csv", "ndjson")
+CSV_FIELDS = ["line", "type", "a", "b", "operands", "result", "user_id", "error"]
+OPERAND_SEPARATOR = ";"
+
+# (input line number, raw record): an NDJSON line or a CSV row dict
+Record = Tuple[int, object]
+
+
+def _detect_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def read_records(stream: IO[str], fmt: str) -> Iterator[Record]:
+    """Yield raw records lazily; parsing JSON and numbers is left to the workers."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(stream, start=1):
+        if line.strip():
+            yield line_no, line
+
+
+def _from_csv(row: dict) -> dict:
+    record = {key: value for key, value in row.items() if key and value not in ("", None)}
+    if "operands" in record:
+        record["operands"] = record["operands"].split(OPERAND_SEPARATOR)
+    return record
+
+
+def _parse(raw) -> dict:
+    return json.loads(raw) if isinstance(raw, str) else _from_csv(raw)
+
+
+def _error_message(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(f"{err['loc'][-1] if err['loc'] else 'input'}: {err['msg']}" for err in exc.errors())
+    return str(exc)
+
+
+def _result_row(line: int, calc_in: schemas.CalculationCreate) -> dict:
+    row = {"line": line, "type": calc_in.type.value, "a": calc_in.a, "b": calc_in.b,
+           "operands": calc_in.operands, "user_id": calc_in.user_id}
+    try:
+        row["result"] = calc_ops.compute_result(calc_in)
+    except (ValueError, ArithmeticError) as e:
+        row["error"] = str(e)
+    return row
+
+
+def _evaluate_one(line: int, raw) -> dict:
+    try:
+        calc_in = schemas.CalculationCreate.model_validate(_parse(raw))
+    except ValueError as e:  # also JSON decoding and validation errors
+        return {"line": line, "error": _error_message(e)}
+    return _result_row(line, calc_in)
+
+
+def evaluate_chunk(chunk: List[Record]) -> List[dict]:
+    """Validate and compute one chunk; runs in a worker process."""
+    try:
+        if all(isinstance(raw, str) for _, raw in chunk):
+            # NDJSON lines joined into one array are parsed and validated in a single pydantic-core pass
+            items = schemas.validate_calculations("[" + ",".join(raw for _, raw in chunk) + "]")
+        else:
+            items = schemas.validate_calculations([_parse(raw) for _, raw in chunk])
+    except ValueError:
+        items = None
+    if items is None or len(items) != len(chunk):  # a line holding no object, or several, shifts the array
+        # Redo the chunk one record at a time so each error is reported on its own line
+        return [_evaluate_one(line, raw) for line, raw in chunk]
+    return [_result_row(line, calc_in) for (line, _), calc_in in zip(chunk, items)]
+
+
+def _chunks(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def evaluate(records: Iterable[Record], workers: int = 0, chunk_size: int = CLI_CHUNK_SIZE) -> Iterator[List[dict]]:
+    """
+    Evaluated chunks in input order.
+
+    With `workers` > 1, chunks run in a process pool with at most two per
+    worker in flight, so a slow consumer (or a huge input) doesn't buffer
+    the whole file.
+    """
+    chunks = _chunks(records, chunk_size)
+    if workers <= 1:
+        yield from map(evaluate_chunk, chunks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(evaluate_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Writer:
+    """Output rows as NDJSON or CSV."""
+
+    def __init__(self, stream: IO[str], fmt: str):
+        self.stream = stream
+        self.csv = csv.DictWriter(stream, fieldnames=CSV_FIELDS, extrasaction="ignore") if fmt == "csv" else None
+        if self.csv is not None:
+            self.csv.writeheader()
+
+    def write(self, rows: List[dict]) -> None:
+        if self.csv is None:
+            self.stream.write("".join(json.dumps(row) + "\n" for row in rows))
+            return
+        for row in rows:
+            if row.get("operands") is not None:
+                row = {**row, "operands": OPERAND_SEPARATOR.join(map(str, row["operands"]))}
+            self.csv.writerow(row)
+
+
+def push(rows: List[dict]) -> int:
+    """Insert the valid rows of one evaluated chunk with their computed results. Returns the number inserted."""
+    valid = [row for row in rows if "error" not in row]
+    if not valid:
+        return 0
+    items = [
+        schemas.CalculationCreate.model_construct(type=models.CalculationType(row["type"]), a=row["a"], b=row["b"],
+                                                  operands=row["operands"], user_id=row["user_id"])
+        for row in valid
+    ]
+    results = [row["result"] for row in valid]
+    if sharding.SHARDED:
+        groups = [(sharding.shards.session(shard), group)
+                  for shard, group in sharding.group_by_shard(items, lambda item: item.user_id).items()]
+    else:
+        groups = [(SessionLocal(), list(enumerate(items)))]
+    inserted = 0
+    for db, group in groups:
+        try:
+            inserted += calc_ops.create_calculations(
+                db, [item for _, item in group], returning=False, results=[results[pos] for pos, _ in group])
+        finally:
+            db.close()
+    return inserted
+
+
+def run(source: IO[str], fmt: str, output: Optional[IO[str]] = None, output_format: Optional[str] = None,
+        workers: int = 0, chunk_size: int = CLI_CHUNK_SIZE, to_db: bool = False) -> dict:
+    """Evaluate every record from `source`; returns counts of rows, errors and database inserts."""
+    writer = Writer(output, output_format or fmt) if output is not None else None
+    totals = {"rows": 0, "errors": 0, "inserted": 0}
+    for rows in evaluate(read_records(source, fmt), workers, chunk_size):
+        totals["rows"] += len(rows)
+        totals["errors"] += sum("error" in row for row in rows)
+        if writer is not None:
+            writer.write(rows)
+        if to_db:
+            totals["inserted"] += push(rows)
+    return totals
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate CSV or NDJSON calculation files offline.")
+    parser.add_argument("input", help="input file, or - for stdin")
+    parser.add_argument("-o", "--output", default=None,
+                        help="output file, or - for stdout (default: stdout, or no output with --db)")
+    parser.add_argument("--format", choices=FORMATS, default=None,
+                        help="input format (default: from the file extension, else ndjson)")
+    parser.add_argument("--output-format", choices=FORMATS, default=None, help="default: the input format")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes; 0 or 1 computes in this process")
+    parser.add_argument("--chunk-size", type=int, default=CLI_CHUNK_SIZE)
+    parser.add_argument("--db", action="store_true", help="insert valid results into the database")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or _detect_format(args.input)
+    output_path = args.output if args.output is not None else (None if args.db else "-")
+    if args.db:
+        init_db()
+
+    started = time.perf_counter()
+    source = _open(args.input, "r")
+    output = _open(output_path, "w") if output_path else None
+    try:
+        totals = run(source, fmt, output, args.output_format, args.workers, args.chunk_size, args.db)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not None and output is not sys.stdout:
+            output.close()
+        if sharding.lease is not None:
+            sharding.lease.release()
+    elapsed = time.perf_counter() - started
+    print(f"{totals['rows']} rows, {totals['errors']} errors, {totals['inserted']} inserted "
+          f"in {elapsed:.1f}s ({totals['rows'] / elapsed if elapsed else 0:,.0f} rows/s)", file=sys.stderr)
+    return 1 if totals["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
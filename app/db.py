@@ -1,18 +1,293 @@
+import collections
+import itertools
+import logging
+import math
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.cookies import CookieError, SimpleCookie
+from typing import Iterator, List, Optional
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test_db.sqlite")
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+
+from app.pg import engine_options
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test_db.sqlite")
+# Optional comma-separated read replicas; reads fall back to the primary when unset
+DATABASE_READ_URLS = [u.strip() for u in os.getenv("DATABASE_READ_URLS", "").split(",") if u.strip()]
+# After a client's commit, its reads stay on the primary this long so it sees its own writes
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+# Carries the client's last write time between requests (see ReadYourWritesMiddleware)
+LAST_WRITE_COOKIE = os.getenv("LAST_WRITE_COOKIE", "last_write")
+# Range-partition `calculations` by month of created_at (Postgres only)
+CALCULATIONS_PARTITIONED = (
+    os.getenv("CALCULATIONS_PARTITIONED", "0") == "1" and DATABASE_URL.startswith("postgresql")
 )
+# Tuned embedded mode for file-backed SQLite: WAL plus the pragmas below on every
+# connection, and one in-process writer at a time (see WriteQueue)
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "0") == "1"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # fsync at checkpoints only; still durable against app crashes in WAL
+    "mmap_size": int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024))),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_KB", "65536")),  # negative means KiB
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "temp_store": "MEMORY",
+}
+# Longest a session waits for its turn to write before falling back to busy_timeout
+SQLITE_WRITE_WAIT_SECONDS = float(os.getenv("SQLITE_WRITE_WAIT_SECONDS", "10"))
+
+
+def _apply_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def make_engine(url: str, tuned: Optional[bool] = None) -> Engine:
+    sqlite = url.startswith("sqlite")
+    options = engine_options(url)
+    connect_args = {"check_same_thread": False} if sqlite else {}
+    connect_args.update(options.pop("connect_args", {}))
+    engine = create_engine(url, connect_args=connect_args, **options)
+    if sqlite and (SQLITE_TUNED if tuned is None else tuned):
+        event.listen(engine, "connect", _apply_pragmas)
+    return engine
+
+
+class WriteQueue:
+    """
+    FIFO single-writer lock for SQLite sessions.
+
+    SQLite allows one writer at a time. Without this, concurrent writers
+    contend inside SQLite's busy handler, which sleeps and retries, and fail
+    with "database is locked" once busy_timeout runs out. Sessions take a
+    turn here at their first write and hand it on, in arrival order, when
+    their transaction ends. Reads never wait: WAL lets them run alongside
+    the writer.
+    """
+
+    def __init__(self, wait_seconds: float = SQLITE_WRITE_WAIT_SECONDS):
+        self.wait_seconds = wait_seconds
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+        self._held = False
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if not self._held:
+                self._held = True
+                return True
+            turn = threading.Event()
+            self._waiters.append(turn)
+        if turn.wait(self.wait_seconds):
+            return True
+        with self._lock:
+            if turn.is_set():  # handed over just as the wait timed out
+                return True
+            self._waiters.remove(turn)
+        return False
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                # Ownership passes straight to the next writer; _held stays True
+                self._waiters.popleft().set()
+            else:
+                self._held = False
+
+
+# The current client's {"last_write": epoch seconds or None}; a dict so writes made in
+# threadpool copies of the request context are visible to the middleware afterwards
+_client_writes: ContextVar[Optional[dict]] = ContextVar("client_writes", default=None)
+
+
+@contextmanager
+def client_writes(last_write: Optional[float] = None) -> Iterator[dict]:
+    """Scope read-your-writes tracking to one client, starting from its previous last write."""
+    client = {"last_write": last_write}
+    token = _client_writes.set(client)
+    try:
+        yield client
+    finally:
+        _client_writes.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Round-robin over read replicas, with a per-client read-your-writes window after commits.
+
+    The window is tracked per client (see ``client_writes``), so one client's
+    writes don't pull everyone else's reads onto the primary. Outside a client
+    scope only the session's own writes pin it to the primary.
+    """
+
+    def __init__(self, replicas: List[Engine], sticky_seconds: float = REPLICA_STICKY_SECONDS):
+        self.replicas = list(replicas)
+        self.sticky_seconds = sticky_seconds
+        self._cycle = itertools.cycle(self.replicas)
+        self._lock = threading.Lock()
+
+    def pick(self) -> Engine:
+        with self._lock:
+            return next(self._cycle)
+
+    def mark_write(self) -> None:
+        client = _client_writes.get()
+        if client is not None:
+            client["last_write"] = time.time()
+
+    def sticky(self) -> bool:
+        client = _client_writes.get()
+        if client is None or client["last_write"] is None:
+            return False
+        return time.time() - client["last_write"] < self.sticky_seconds
+
+
+def _cookie_last_write(scope) -> Optional[float]:
+    for name, value in scope.get("headers") or []:
+        if name != b"cookie":
+            continue
+        try:
+            morsel = SimpleCookie(value.decode("latin-1")).get(LAST_WRITE_COOKIE)
+            last_write = float(morsel.value) if morsel is not None else None
+        except (CookieError, ValueError):
+            return None
+        # A client can only make its own reads stickier, and never past the window from now
+        return min(last_write, time.time()) if last_write is not None and math.isfinite(last_write) else None
+    return None
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware giving each client its own read-your-writes window.
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    The client's last write time travels in the LAST_WRITE_COOKIE cookie: a
+    request that commits sets it, and later requests that send it back read
+    from the primary until REPLICA_STICKY_SECONDS have passed.
+    """
+
+    def __init__(self, app, router: Optional[ReplicaRouter] = None):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        active = self.router or router
+        if scope["type"] != "http" or not active.replicas:
+            await self.app(scope, receive, send)
+            return
+        seen = _cookie_last_write(scope)
+
+        with client_writes(seen) as client:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start" and client["last_write"] != seen:
+                    cookie = (f"{LAST_WRITE_COOKIE}={client['last_write']:.3f}; "
+                              f"Max-Age={math.ceil(active.sticky_seconds)}; Path=/; HttpOnly; SameSite=Lax")
+                    message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+class RoutingSession(Session):
+    """
+    Session that sends plain SELECTs to a read replica and everything else to the primary.
+
+    Once a session has written (or was pinned with ``use_primary``) it keeps reading
+    from the primary, and so does every session within the router's sticky window.
+    """
+
+    def __init__(self, *args, router: Optional[ReplicaRouter] = None,
+                 write_queue: Optional[WriteQueue] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+        self.write_queue = write_queue
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        primary = super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        router = self.router
+        if router is None or not router.replicas:
+            return primary
+        if self._flushing or (clause is not None and not clause.is_select):
+            self.info["wrote"] = True
+            return primary
+        if self.info.get("wrote") or self.info.get("primary") or router.sticky():
+            return primary
+        return router.pick()
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _mark_replica_write(session):
+    if session.router is not None and session.router.replicas and session.info.get("wrote"):
+        session.router.mark_write()
+
+
+def _take_write_turn(session) -> None:
+    if session.write_queue is None or "write_turn" in session.info:
+        return
+    session.info["write_turn"] = session.write_queue.acquire()
+    if not session.info["write_turn"]:
+        logger.warning("Waited %.1fs for the SQLite write queue; relying on busy_timeout",
+                       session.write_queue.wait_seconds)
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _queue_flush(session, flush_context, instances):
+    _take_write_turn(session)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _queue_write_statement(orm_execute_state):
+    if not orm_execute_state.is_select:
+        _take_write_turn(orm_execute_state.session)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _end_write_turn(session, transaction):
+    if transaction.parent is None and session.info.pop("write_turn", False):
+        session.write_queue.release()
+
+
+def use_primary(db: Session) -> Session:
+    """Pin a session to the primary, e.g. for read-modify-write paths."""
+    db.info["primary"] = True
+    return db
+
+
+engine = make_engine(DATABASE_URL)
+read_engines = [make_engine(url) for url in DATABASE_READ_URLS]
+router = ReplicaRouter(read_engines)
+write_queue = WriteQueue() if SQLITE_TUNED and DATABASE_URL.startswith("sqlite") else None
+
+# expire_on_commit=False: committed objects keep their state, so handlers can return them
+# without a refresh() round trip after every commit
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, class_=RoutingSession, router=router,
+    write_queue=write_queue,
+)
 Base = declarative_base()
 
 def init_db():
     from app import models  # noqa: F401
 
     Base.metadata.create_all(bind=engine)
+    from app.migrations import upgrade
+
+    upgrade(engine)
+    from app.sharding import SHARDED, shards
+
+    if SHARDED:
+        shards.create_all()
+    if CALCULATIONS_PARTITIONED:
+        from app.partitions import ensure_partitions
+
+        ensure_partitions(engine)
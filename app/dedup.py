@@ -0,0 +1,214 @@
+"""
+Optional deduplicated storage for calculations.
+
+Many stored calculations repeat the same ``(type, a, b)`` with the same
+deterministic result. With CALCULATIONS_DEDUP=1, each distinct input tuple
+is stored once in ``calculation_operands``, keyed by a hash of its canonical
+encoding. A ``calculations`` row then holds only its id, type, owner,
+timestamp and ``operand_id``. Known tuples reuse the stored result, so
+``compute_result`` is skipped for them.
+
+Readers go through ``calculation_select()``, which resolves a, b, result and
+operands from either layout. Rows written before dedup was enabled keep
+working. Existing rows can be converted in place:
+
+    python -m app.dedup [--chunk-size 1000]
+
+Canonical rows are never updated. ``prune`` removes the ones no calculation
+references any more; run it while writes are paused.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
+
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import models
+from app.shared_state import get_backend
+from app.user_cache import TTLCache
+
+DEDUP_STORAGE = os.getenv("CALCULATIONS_DEDUP", "0") == "1"
+# Known tuples per worker: key hash -> (operand_id, result)
+KNOWN_TUPLES_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "10000"))
+
+GENERATION_KEY = "dedup:generation"
+
+C = models.Calculation
+O = models.CalculationOperands
+
+known = TTLCache(maxsize=KNOWN_TUPLES_SIZE, ttl=float("inf"))
+_generation = 0
+
+
+def operand_key(calc_type, a, b, operands=None) -> str:
+    """Stable 128-bit hex digest of the calculation inputs."""
+    calc_type = models.CalculationType(calc_type).value
+    canonical = json.dumps([calc_type, a, b, operands], separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _resolved(column, canonical_column, name: str):
+    return func.coalesce(column, canonical_column).label(name)
+
+
+def calculation_columns(dedup: Optional[bool] = None) -> Tuple:
+    """Calculation columns with inputs and result resolved from either storage layout."""
+    if not (DEDUP_STORAGE if dedup is None else dedup):
+        return (C.id, C.a, C.b, C.type, C.operands, C.result, C.user_id, C.created_at, C.revision)
+    return (
+        C.id,
+        _resolved(C.a, O.a, "a"),
+        _resolved(C.b, O.b, "b"),
+        C.type,
+        _resolved(C.operands, O.operands, "operands"),
+        _resolved(C.result, O.result, "result"),
+        C.user_id,
+        C.created_at,
+        C.revision,
+    )
+
+
+def result_column(dedup: Optional[bool] = None):
+    return calculation_columns(dedup)[5]
+
+
+def with_operands(stmt, dedup: Optional[bool] = None):
+    """Add the join that `calculation_columns` needs, when deduplicated storage is enabled."""
+    if DEDUP_STORAGE if dedup is None else dedup:
+        return stmt.outerjoin(O, C.operand_id == O.id)
+    return stmt
+
+
+def calculation_select(*columns, dedup: Optional[bool] = None):
+    """select() over calculations, with a, b, result and operands resolved."""
+    return with_operands(select(*(columns or calculation_columns(dedup))).select_from(C), dedup)
+
+
+def _sync_generation() -> None:
+    global _generation
+    generation = get_backend().get_int(GENERATION_KEY)
+    if generation != _generation:
+        known.clear()
+        _generation = generation
+
+
+def canonical_operands(db: Session, calc_type, a, b, operands, compute) -> Tuple[int, Optional[float]]:
+    """
+    Return (operand_id, result) for the inputs, inserting the canonical row if it is new.
+
+    `compute` runs only for tuples not seen before. The caller commits. If
+    another worker inserts the same tuple concurrently, the unique key_hash
+    raises IntegrityError; the caller rolls back and retries.
+    """
+    _sync_generation()
+    key = operand_key(calc_type, a, b, operands)
+    # Canonical ids are per database, so cached ones are too when calculations are sharded
+    shard = db.info.get("shard")
+    cache_key = key if shard is None else f"{shard}:{key}"
+    hit = known.get(cache_key)
+    if hit is not None:
+        return hit
+    row = db.execute(select(O.id, O.result).where(O.key_hash == key)).first()
+    if row is None:
+        canonical = O(key_hash=key, type=calc_type, a=a, b=b, operands=operands, result=compute())
+        db.add(canonical)
+        db.flush()
+        # Not cached until a later lookup sees it committed; this transaction may still roll back
+        return canonical.id, canonical.result
+    known.set(cache_key, tuple(row))
+    return tuple(row)
+
+
+def hydrate(calc: Optional[models.Calculation], canonical=None) -> Optional[models.Calculation]:
+    """Fill a deduplicated calculation's a/b/result/operands from its canonical row, without dirtying it."""
+    if calc is None or calc.operand_id is None:
+        return calc
+    if canonical is None:
+        canonical = calc.canonical
+    for name in ("a", "b", "result", "operands"):
+        set_committed_value(calc, name, getattr(canonical, name))
+    return calc
+
+
+def hot_tuples(db: Session, limit: int = 10, calc_type=None) -> List[dict]:
+    """Exact top-N (type, a, b) tuples by number of stored calculations."""
+    _, a, b, type_, _, result, _, _, _ = calculation_columns()
+    n = func.count().label("count")
+    stmt = calculation_select(type_, a, b, func.max(result).label("result"), n).where(a.isnot(None))
+    if calc_type is not None:
+        stmt = stmt.where(C.type == calc_type)
+    stmt = stmt.group_by(type_, a, b).order_by(n.desc()).limit(limit)
+    return [
+        {"type": row.type, "a": row.a, "b": row.b, "result": row.result, "count": row.count}
+        for row in db.execute(stmt)
+    ]
+
+
+def convert_existing(db: Session, chunk_size: int = 1000) -> int:
+    """Move inline calculations with a stored result into the deduplicated layout. Returns rows converted."""
+    converted = 0
+    table = C.__table__
+    # Core UPDATE so a list of parameters runs as one executemany
+    move = (
+        update(table)
+        .where(table.c.id == bindparam("cid"))
+        .values(operand_id=bindparam("oid"), a=None, b=None, result=None, operands=None)
+    )
+    while True:
+        rows = db.execute(
+            select(C.id, C.type, C.a, C.b, C.operands, C.result)
+            .where(C.operand_id.is_(None), C.result.isnot(None))
+            .order_by(C.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return converted
+        params = []
+        for calc_id, calc_type, a, b, operands, result in rows:
+            operand_id, _ = canonical_operands(db, calc_type, a, b, operands, lambda: result)
+            params.append({"cid": calc_id, "oid": operand_id})
+        db.execute(move, params)
+        db.commit()
+        converted += len(rows)
+
+
+def prune(db: Session) -> int:
+    """Delete canonical rows no calculation references. Returns the number removed."""
+    referenced = select(C.operand_id).where(C.operand_id.isnot(None))
+    removed = db.execute(
+        delete(O).where(O.id.not_in(referenced)),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    db.commit()
+    if removed:
+        # Cached ids may point at pruned rows
+        get_backend().incr(GENERATION_KEY)
+        known.clear()
+    return removed
+
+
+def main(argv=None) -> None:
+    from app.db import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Convert calculations to deduplicated storage.")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--prune", action="store_true", help="also delete unreferenced canonical rows")
+    args = parser.parse_args(argv)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        print(f"converted {convert_existing(db, args.chunk_size)} calculations")
+        if args.prune:
+            print(f"pruned {prune(db)} canonical rows")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import atexit
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, NamedTuple, Optional
+
+from app.shared_state import incr_metric
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Default policy for route logging plus per-route overrides, e.g.
+# ROUTE_LOG_CONFIG="/add=WARNING:0.1,/divide=ERROR:1"
+ROUTE_LOG_LEVEL = os.getenv("ROUTE_LOG_LEVEL", "INFO")
+ROUTE_LOG_SAMPLE_RATE = float(os.getenv("ROUTE_LOG_SAMPLE_RATE", "1.0"))
+ROUTE_LOG_CONFIG = os.getenv("ROUTE_LOG_CONFIG", "")
+
+
+class StructuredFormatter(logging.Formatter):
+    """Append structured fields passed via ``extra={"fields": {...}}`` as key=value pairs."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hand records to the listener thread without formatting them first.
+
+    The stock ``prepare`` formats the message in the caller's thread; records here
+    stay in-process, so formatting is deferred to the listener. When the queue is
+    full the record is dropped and counted instead of blocking the request.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            incr_metric("log_records_dropped")
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def configure_logging(level: str = LOG_LEVEL) -> NonBlockingQueueHandler:
+    """
+    Route root logging through a bounded queue drained by a background listener.
+
+    Idempotent: a second call only restarts the listener if it was stopped.
+    """
+    global _listener, _queue_handler
+    if _queue_handler is None:
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_queue_handler)
+        atexit.register(stop_logging)
+
+    if _listener is None:
+        stream = logging.StreamHandler()
+        stream.setFormatter(StructuredFormatter("%(levelname)s:%(name)s:%(message)s"))
+        _listener = QueueListener(_queue_handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+    return _queue_handler
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RoutePolicy(NamedTuple):
+    level: int
+    sample_rate: float
+
+
+def parse_route_config(spec: str) -> Dict[str, RoutePolicy]:
+    """Parse ``"/path=LEVEL[:rate],..."`` into per-route policies."""
+    policies = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        path, _, setting = entry.partition("=")
+        level_name, _, rate = setting.partition(":")
+        level = logging.getLevelName(level_name.strip().upper() or ROUTE_LOG_LEVEL)
+        if not isinstance(level, int):
+            raise ValueError(f"Invalid log level for route {path}: {level_name}")
+        policies[path.strip()] = RoutePolicy(level, float(rate) if rate else 1.0)
+    return policies
+
+
+class RouteLogger:
+    """
+    Per-route levelled and sampled logging.
+
+    Messages use %-style arguments so nothing is formatted unless the record
+    passes the level check and the sampler.
+    """
+
+    def __init__(self, logger: logging.Logger, default: RoutePolicy, overrides: Dict[str, RoutePolicy] = None):
+        self.logger = logger
+        self.default = default
+        self.overrides = overrides or {}
+
+    def policy(self, route: str) -> RoutePolicy:
+        return self.overrides.get(route, self.default)
+
+    def log(self, route: str, level: int, msg: str, *args, **fields) -> bool:
+        """Log if the route's policy allows it. Returns True when a record was emitted."""
+        policy = self.policy(route)
+        if level < policy.level or not self.logger.isEnabledFor(level):
+            return False
+        if policy.sample_rate < 1.0 and random.random() >= policy.sample_rate:
+            return False
+        fields["route"] = route
+        self.logger.log(level, msg, *args, extra={"fields": fields})
+        return True
+
+
+def route_logger(name: str) -> RouteLogger:
+    """Build a RouteLogger from the ROUTE_LOG_* environment settings."""
+    default = RoutePolicy(logging.getLevelName(ROUTE_LOG_LEVEL.upper()), ROUTE_LOG_SAMPLE_RATE)
+    return RouteLogger(logging.getLogger(name), default, parse_route_config(ROUTE_LOG_CONFIG))
@@ -0,0 +1,150 @@
+"""
+In-place upgrades for databases created by earlier versions of the app.
+
+``Base.metadata.create_all`` creates missing tables but never changes a table
+that already exists. ``upgrade`` runs right after it in ``init_db`` and
+brings older tables up to the current models. Each step inspects the live
+schema and only changes what is missing, so upgrading is safe on every start
+and on a fresh database it does nothing.
+
+SQLite can't alter an existing column or add one with a non-constant
+default, so there a table is rebuilt from the model and its rows copied over.
+"""
+
+import logging
+from typing import Callable, List
+
+from sqlalchemy import BigInteger, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+
+from app import models
+
+logger = logging.getLogger(__name__)
+
+CALCULATIONS = models.Calculation.__table__
+
+# Applied in order, each in its own transaction
+STEPS: List[Callable[[Connection], None]] = []
+
+
+def step(func: Callable[[Connection], None]) -> Callable[[Connection], None]:
+    STEPS.append(func)
+    return func
+
+
+def live_columns(conn: Connection, table: Table) -> dict:
+    """Columns of the table as it exists in the database, by name; empty if it doesn't exist."""
+    if not inspect(conn).has_table(table.name):
+        return {}
+    return {column["name"]: column for column in inspect(conn).get_columns(table.name)}
+
+
+def add_column(conn: Connection, table: Table, name: str) -> None:
+    """ALTER TABLE ... ADD COLUMN as the model declares it, with its foreign key and index."""
+    column = table.c[name]
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}"
+    for fk in column.foreign_keys:
+        ddl += f" REFERENCES {fk.column.table.name} ({fk.column.name})"
+    conn.execute(text(ddl))
+    for index in table.indexes:
+        if name in index.columns:
+            index.create(conn, checkfirst=True)
+    logger.info("Added column %s.%s", table.name, name)
+
+
+def rebuild_sqlite(conn: Connection, table: Table) -> None:
+    """Recreate `table` from the model and copy the rows of the columns both versions share."""
+    old = f"{table.name}_old"
+    shared = [name for name in live_columns(conn, table) if name in table.c]
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old}"))
+    # Index names are global in SQLite and the new table reuses them
+    for index in inspect(conn).get_indexes(old):
+        conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+    table.create(conn)
+    columns = ", ".join(shared)
+    conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old}"))
+    conn.execute(text(f"DROP TABLE {old}"))
+    logger.info("Rebuilt table %s", table.name)
+
+
+@step
+def calculations_created_at(conn: Connection) -> None:
+    """created_at, the partition and retention key; existing rows get the upgrade time."""
+    live = live_columns(conn, CALCULATIONS)
+    if not live or "created_at" in live:
+        return
+    if conn.dialect.name == "sqlite":
+        # CURRENT_TIMESTAMP isn't a constant default
+        rebuild_sqlite(conn, CALCULATIONS)
+    else:
+        add_column(conn, CALCULATIONS, "created_at")
+
+
+@step
+def calculations_aggregates(conn: Connection) -> None:
+    """Aggregate and unary types: a and b become optional and the operands list is added."""
+    live = live_columns(conn, CALCULATIONS)
+    if not live:
+        return
+    required = [name for name in ("a", "b") if not live[name]["nullable"]]
+    if conn.dialect.name == "sqlite":
+        if required:
+            rebuild_sqlite(conn, CALCULATIONS)
+            return
+    for name in required:
+        conn.execute(text(f"ALTER TABLE {CALCULATIONS.name} ALTER COLUMN {name} DROP NOT NULL"))
+    if "operands" not in live:
+        add_column(conn, CALCULATIONS, "operands")
+
+
+@step
+def calculation_type_values(conn: Connection) -> None:
+    """New names in the Postgres calculation_type enum; elsewhere the column is a plain string."""
+    if conn.dialect.name != "postgresql":
+        return
+    enum = CALCULATIONS.c.type.type
+    labels = set(conn.execute(text("SELECT enumlabel FROM pg_enum WHERE enumtypid = to_regtype(:name)"),
+                              {"name": enum.name}).scalars())
+    if not labels:
+        return
+    for label in enum.enums:
+        if label not in labels:
+            conn.execute(text(f"ALTER TYPE {enum.name} ADD VALUE IF NOT EXISTS '{label}'"))
+            logger.info("Added %s to enum %s", label, enum.name)
+
+
+@step
+def calculations_operand_id(conn: Connection) -> None:
+    """Reference to the shared inputs of deduplicated storage; create_all adds calculation_operands itself."""
+    live = live_columns(conn, CALCULATIONS)
+    if live and "operand_id" not in live:
+        add_column(conn, CALCULATIONS, "operand_id")
+
+
+@step
+def calculations_bigint_id(conn: Connection) -> None:
+    """64-bit ids, needed for snowflake ids when sharded; SQLite's INTEGER key already is."""
+    live = live_columns(conn, CALCULATIONS)
+    if conn.dialect.name != "postgresql" or not live or isinstance(live["id"]["type"], BigInteger):
+        return
+    conn.execute(text(f"ALTER TABLE {CALCULATIONS.name} ALTER COLUMN id TYPE BIGINT"))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                            {"table": CALCULATIONS.name}).scalar()
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} AS BIGINT"))
+    logger.info("Widened %s.id to BIGINT", CALCULATIONS.name)
+
+
+@step
+def calculations_revision(conn: Connection) -> None:
+    """Current revision number; existing rows start at 1. create_all adds calculation_revisions itself."""
+    live = live_columns(conn, CALCULATIONS)
+    if live and "revision" not in live:
+        add_column(conn, CALCULATIONS, "revision")
+
+
+def upgrade(bind: Engine) -> None:
+    for func in STEPS:
+        with bind.begin() as conn:
+            func(conn)
@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, func, UniqueConstraint, Float, Enum as SQLEnum, ForeignKey
+from sqlalchemy import JSON, BigInteger, Boolean, Column, Integer, LargeBinary, String, Text, DateTime, func, UniqueConstraint, Float, Enum as SQLEnum, ForeignKey
 from sqlalchemy.orm import relationship
 from enum import Enum
-from app.db import Base
+from app.db import Base, CALCULATIONS_PARTITIONED
 
 
 class User(Base):
@@ -16,6 +16,19 @@ class User(Base):
         UniqueConstraint("username", name="uq_users_username"),
         UniqueConstraint("email", name="uq_users_email"),
     )
+    # Fetch created_at during the INSERT (RETURNING where supported) instead of a later refresh
+    __mapper_args__ = {"eager_defaults": True}
+
+
+class RefreshSession(Base):
+    """One login's chain of refresh tokens; only the newest token (current_jti) can be exchanged."""
+    __tablename__ = "refresh_sessions"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    current_jti = Column(String(32), nullable=False)
+    # When the password was checked; the session can't be refreshed past auth_time + SESSION_MAX_DAYS
+    auth_time = Column(DateTime(timezone=True), nullable=False, index=True)
+    revoked = Column(Boolean, nullable=False, default=False)
 
 
 # Calculation type enumeration
@@ -24,15 +37,134 @@ class CalculationType(str, Enum):
     SUBTRACT = "Sub"
     MULTIPLY = "Multiply"
     DIVIDE = "Divide"
+    POWER = "Power"
+    MODULUS = "Modulus"
+    SQRT = "Sqrt"
+    LOG = "Log"
+    # Aggregates over the `operands` list
+    SUM = "Sum"
+    MEAN = "Mean"
+    STDDEV = "StdDev"
+    PERCENTILE = "Percentile"
+
+
+# Calculation types whose input is a list of operands rather than a and b
+AGGREGATE_TYPES = frozenset({
+    CalculationType.SUM, CalculationType.MEAN, CalculationType.STDDEV, CalculationType.PERCENTILE,
+})
+# Types that use only `a` (Log takes an optional base in `b`)
+UNARY_TYPES = frozenset({CalculationType.SQRT, CalculationType.LOG})
+
+
+class CalculationOperands(Base):
+    """Canonical (type, a, b, operands) tuple and its result, shared by duplicate calculations."""
+    __tablename__ = "calculation_operands"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # blake2b-128 of the canonical JSON encoding of the inputs (see app.dedup.operand_key)
+    key_hash = Column(String(32), nullable=False, unique=True)
+    type = Column(SQLEnum(CalculationType, name="calculation_type"), nullable=False)
+    a = Column(Float, nullable=True)
+    b = Column(Float, nullable=True)
+    operands = Column(JSON(none_as_null=True), nullable=True)
+    result = Column(Float, nullable=True)
 
 
 class Calculation(Base):
     __tablename__ = "calculations"
-    id = Column(Integer, primary_key=True, index=True)
-    a = Column(Float, nullable=False)
-    b = Column(Float, nullable=False)
+    # 64-bit for snowflake ids when sharded (app.sharding); SQLite's INTEGER key is already 64-bit
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True, autoincrement=True)
+    # a/b are NULL for aggregates; b is also NULL for Sqrt and for Log without a base
+    a = Column(Float, nullable=True)
+    b = Column(Float, nullable=True)
     type = Column(SQLEnum(CalculationType, name="calculation_type"), nullable=False)
     result = Column(Float, nullable=True)
+    # List operand for aggregate types
+    operands = Column(JSON(none_as_null=True), nullable=True)
+    # Deduplicated layout: inputs and result live in calculation_operands; a/b/result/operands are NULL here
+    operand_id = Column(Integer, ForeignKey("calculation_operands.id"), nullable=True, index=True)
+    canonical = relationship("CalculationOperands")
     # optional reference to users table if available
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     user = relationship("User", backref="calculations")
+    # Number of the current state; bumped by every edit (see app.operations.revisions)
+    revision = Column(Integer, nullable=False, default=1, server_default="1")
+    # Partition key when partitioned; Postgres requires it in the table's primary key
+    created_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+        index=True,
+        primary_key=CALCULATIONS_PARTITIONED,
+    )
+
+    # The ORM identity stays `id` alone even when the table key is (id, created_at)
+    __mapper_args__ = {"primary_key": [id], "eager_defaults": True}
+    __table_args__ = (
+        {"postgresql_partition_by": "RANGE (created_at)"} if CALCULATIONS_PARTITIONED else {}
+    )
+
+
+class CalculationRevision(Base):
+    """
+    Reverse delta for one edit of a calculation: the fields it changed, with their values before it.
+
+    Row `revision` records the edit that produced state `revision` of the
+    calculation. The (calculation_id, revision) key makes the latest entry a
+    single index lookup and a calculation's history a range scan.
+    """
+    __tablename__ = "calculation_revisions"
+    # No foreign key: calculations may be partitioned or live on another shard's database
+    calculation_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=False)
+    revision = Column(Integer, primary_key=True, autoincrement=False)
+    delta = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(Base):
+    """A background calculation workload processed by `app.worker`."""
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    kind = Column(String(20), nullable=False)  # "items" or "expressions"
+    status = Column(SQLEnum(JobStatus, name="job_status"), nullable=False, default=JobStatus.QUEUED, index=True)
+    payload = Column(Text, nullable=False)  # JSON list of inputs
+    total = Column(Integer, nullable=False)
+    completed = Column(Integer, nullable=False, default=0)
+    error = Column(String(255), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __mapper_args__ = {"eager_defaults": True}
+
+
+class JobResult(Base):
+    """One chunk of a job's output, stored as NDJSON lines in input order."""
+    __tablename__ = "job_results"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(Integer, ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False, index=True)
+    seq = Column(Integer, nullable=False)
+    data = Column(Text, nullable=False)
+
+    __table_args__ = (UniqueConstraint("job_id", "seq", name="uq_job_results_job_seq"),)
+
+
+class SnowflakeLease(Base):
+    """The process currently generating snowflake ids with `worker_id` (see `app.sharding`)."""
+    __tablename__ = "snowflake_leases"
+    worker_id = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String(100), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class AnalyticsSketch(Base):
+    """One worker's serialized analytics sketches (see `app.sketches`)."""
+    __tablename__ = "analytics_sketches"
+    shard = Column(String(100), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -12,13 +12,18 @@ Functions:
 - subtract(a: Union[int, float], b: Union[int, float]) -> Union[int, float]: Returns the difference when b is subtracted from a.
 - multiply(a: Union[int, float], b: Union[int, float]) -> Union[int, float]: Returns the product of a and b.
 - divide(a: Union[int, float], b: Union[int, float]) -> float: Returns the quotient when a is divided by b. Raises ValueError if b is zero.
+- power, modulus, sqrt and log: scientific operations; each raises ValueError outside its domain.
+
+Aggregates over lists of operands (sum, mean, stddev, percentile) live in
+`app.operations.statistics`.
 
 Usage:
 These functions can be imported and used in other modules or integrated into APIs
 to perform arithmetic operations based on user input.
 """
 
-from typing import Union  # Import Union for type hinting multiple possible types
+import math
+from typing import Optional, Union  # Import Union for type hinting multiple possible types
 
 # Define a type alias for numbers that can be either int or float
 Number = Union[int, float]
@@ -118,3 +123,121 @@ def divide(a: Number, b: Number) -> float:
     # Perform division of a by b and return the result as a float
     result = a / b
     return result
+
+def power(a: Number, b: Number) -> float:
+    """
+    Raise the first number to the power of the second.
+
+    Parameters:
+    - a (int or float): The base.
+    - b (int or float): The exponent.
+
+    Returns:
+    - float: a raised to the power b.
+
+    Raises:
+    - ValueError: If the result is complex or too large to represent.
+
+    Example:
+    >>> power(2, 10)
+    1024.0
+    """
+    # Float arithmetic keeps huge integer exponents from allocating without bound
+    try:
+        result = math.pow(a, b)
+    except (OverflowError, ValueError) as e:
+        raise ValueError(f"Cannot raise {a} to the power {b}") from e
+    return result
+
+def modulus(a: Number, b: Number) -> Number:
+    """
+    Return the remainder of a divided by b (same sign as b, like Python's %).
+
+    Raises:
+    - ValueError: If b is zero.
+
+    Example:
+    >>> modulus(7, 3)
+    1
+    """
+    if b == 0:
+        raise ValueError("Cannot take modulus by zero!")
+    result = a % b
+    return result
+
+def sqrt(a: Number) -> float:
+    """
+    Return the square root of a.
+
+    Raises:
+    - ValueError: If a is negative.
+
+    Example:
+    >>> sqrt(9)
+    3.0
+    """
+    if a < 0:
+        raise ValueError("Cannot take the square root of a negative number!")
+    result = math.sqrt(a)
+    return result
+
+def log(a: Number, base: Optional[Number] = None) -> float:
+    """
+    Return the logarithm of a, natural unless a base is given.
+
+    Raises:
+    - ValueError: If a is not positive, or the base is not positive or equals 1.
+
+    Example:
+    >>> log(8, 2)
+    3.0
+    """
+    if a <= 0:
+        raise ValueError("Logarithm is only defined for positive numbers!")
+    if base is None:
+        return math.log(a)
+    if base <= 0 or base == 1:
+        raise ValueError("Logarithm base must be positive and not 1!")
+    result = math.log(a, base)
+    return result
+
+# Dispatch table keyed by operation name, shared by the single-operation
+# routes and the batch `/compute` endpoint.
+OPERATIONS = {
+    "add": add,
+    "subtract": subtract,
+    "multiply": multiply,
+    "divide": divide,
+    "power": power,
+    "modulus": modulus,
+    "log": log,
+}
+
+
+def evaluate(op: str, a: Number, b: Number) -> Number:
+    """
+    Apply the operation named `op` to a and b.
+
+    Raises:
+    - ValueError: If the operation is unknown, the operation itself rejects the input,
+      or the result is not a finite number.
+    """
+    func = OPERATIONS.get(op)
+    if func is None:
+        raise ValueError(f"Unsupported operation: {op}")
+    return finite(func(a, b))
+
+
+def finite(result: Number) -> Number:
+    """
+    Return `result` unchanged if it is a finite number.
+
+    Overflow (e.g. multiply(1e308, 10)) yields inf, and inf - inf yields NaN;
+    neither can be stored meaningfully or encoded as JSON.
+
+    Raises:
+    - ValueError: If the result is infinite or NaN.
+    """
+    if not math.isfinite(result):
+        raise ValueError("Result is not a finite number!")
+    return result
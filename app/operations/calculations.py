@@ -1,81 +1,398 @@
-from sqlalchemy.orm import Session
+import os
+from functools import partial
+from sqlalchemy import JSON, cast, delete, func, insert, select, true, update
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import IntegrityError
-from app import models, schemas
-from app.operations import add, subtract, multiply, divide
-from typing import List, Optional
+from app import columnar, dedup, models, pg, schemas, sharding, sketches, tracing
+from app.db import use_primary
+from app.operations import add, subtract, multiply, divide, power, modulus, sqrt, log, finite, revisions, statistics
+from typing import Iterator, List, Optional, Union
+from datetime import datetime
 
 
+# Binary and unary operations by calculation type
+_SCALAR = {
+    models.CalculationType.ADD: add,
+    models.CalculationType.SUBTRACT: subtract,
+    models.CalculationType.MULTIPLY: multiply,
+    models.CalculationType.DIVIDE: divide,
+    models.CalculationType.POWER: power,
+    models.CalculationType.MODULUS: modulus,
+    models.CalculationType.LOG: log,
+}
+# Aggregates over the operands list
+_AGGREGATE = {
+    models.CalculationType.SUM: statistics.total,
+    models.CalculationType.MEAN: statistics.mean,
+    models.CalculationType.STDDEV: statistics.stddev,
+}
+
+
+@tracing.traced("calculation.compute")
 def compute_result(calc_in: schemas.CalculationCreate) -> float:
+    """Result of `calc_in`. Raises ValueError outside an operation's domain or when it isn't finite."""
+    return finite(_compute(calc_in))
+
+
+def _compute(calc_in: schemas.CalculationCreate) -> float:
     t = calc_in.type
-    if t == models.CalculationType.ADD:
-        return add(calc_in.a, calc_in.b)
-    if t == models.CalculationType.SUBTRACT:
-        return subtract(calc_in.a, calc_in.b)
-    if t == models.CalculationType.MULTIPLY:
-        return multiply(calc_in.a, calc_in.b)
-    if t == models.CalculationType.DIVIDE:
-        return divide(calc_in.a, calc_in.b)
+    if t in _SCALAR:
+        return _SCALAR[t](calc_in.a, calc_in.b)
+    if t == models.CalculationType.SQRT:
+        return sqrt(calc_in.a)
+    if t in _AGGREGATE:
+        return _AGGREGATE[t](calc_in.operands)
+    if t == models.CalculationType.PERCENTILE:
+        return statistics.percentile(calc_in.operands, calc_in.b)
     raise ValueError("Unsupported calculation type")
 
 
 def create_calculation(db: Session, calc_in: schemas.CalculationCreate, store_result: bool = True) -> models.Calculation:
+    if dedup.DEDUP_STORAGE and store_result:
+        return _create_deduplicated(db, calc_in)
+
     result = None
     if store_result:
         result = compute_result(calc_in)
 
     calc = models.Calculation(
+        id=sharding.new_id(db),
         a=calc_in.a,
         b=calc_in.b,
         type=calc_in.type,
+        operands=calc_in.operands,
         result=result,
+        user_id=calc_in.user_id,
     )
     db.add(calc)
     try:
         db.commit()
-        db.refresh(calc)
     except IntegrityError as e:
         db.rollback()
         raise
+    _after_upsert(calc)
+    return calc
+
+
+def create_calculations(db: Session, items: List[schemas.CalculationCreate], returning: bool = True,
+                        results: Optional[List[float]] = None) -> Union[List[models.Calculation], int]:
+    """
+    Insert many calculations in one transaction.
+
+    With `returning`, rows are inserted by batched INSERT ... RETURNING and
+    come back as (detached) Calculation objects with their ids. Without it,
+    they are COPYed on Postgres and only the count is returned. `results`
+    supplies already computed results (e.g. from the offline CLI) in item
+    order, so compute_result isn't run again.
+    """
+    table = models.Calculation.__table__
+    calcs, rows = [], []
+    try:
+        for position, calc_in in enumerate(items):
+            compute = partial(compute_result, calc_in) if results is None else partial(results.__getitem__, position)
+            if dedup.DEDUP_STORAGE:
+                operand_id, result = dedup.canonical_operands(db, calc_in.type, calc_in.a, calc_in.b,
+                                                              calc_in.operands, compute)
+                row = {"type": calc_in.type, "operand_id": operand_id}
+            else:
+                result = compute()
+                row = {"a": calc_in.a, "b": calc_in.b, "type": calc_in.type,
+                       "operands": calc_in.operands, "result": result}
+            row["user_id"] = calc_in.user_id
+            calc_id = sharding.new_id(db)
+            if calc_id is not None:
+                row["id"] = calc_id
+            rows.append(row)
+            calcs.append(models.Calculation(a=calc_in.a, b=calc_in.b, type=calc_in.type,
+                                            operands=calc_in.operands, result=result, user_id=calc_in.user_id))
+        if returning:
+            keys = pg.insert_returning(db, table, rows, table.c.id, table.c.created_at)
+        else:
+            pg.copy_rows(db, table, rows)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise
+    for calc in calcs:
+        sketches.on_insert(calc)
+    if not returning:
+        columnar.invalidate()
+        return len(calcs)
+    for calc, (calc_id, created_at) in zip(calcs, keys):
+        calc.id, calc.created_at = calc_id, created_at
+        columnar.on_upsert(calc)
+    return calcs
+
+
+def _canonical_inputs(db: Session, calc_in: schemas.CalculationCreate):
+    return dedup.canonical_operands(db, calc_in.type, calc_in.a, calc_in.b, calc_in.operands,
+                                    lambda: compute_result(calc_in))
+
+
+def _create_deduplicated(db: Session, calc_in: schemas.CalculationCreate, attempts: int = 2) -> models.Calculation:
+    """Store a reference to the canonical inputs; known tuples skip compute_result entirely."""
+    for attempt in range(attempts):
+        try:
+            operand_id, result = _canonical_inputs(db, calc_in)
+            calc = models.Calculation(id=sharding.new_id(db), type=calc_in.type, operand_id=operand_id,
+                                      user_id=calc_in.user_id)
+            db.add(calc)
+            db.commit()
+            break
+        except IntegrityError:
+            # Another worker inserted the same canonical tuple first; its row is visible now
+            db.rollback()
+            if attempt == attempts - 1:
+                raise
+    set_committed_value(calc, "a", calc_in.a)
+    set_committed_value(calc, "b", calc_in.b)
+    set_committed_value(calc, "operands", calc_in.operands)
+    set_committed_value(calc, "result", result)
+    _after_upsert(calc)
     return calc
 
 
-def get_all_calculations(db: Session, skip: int = 0, limit: int = 100) -> List[models.Calculation]:
-    """Browse all calculations with pagination."""
-    return db.query(models.Calculation).offset(skip).limit(limit).all()
+def _after_upsert(calc: models.Calculation) -> None:
+    columnar.on_upsert(calc)
+    sketches.on_insert(calc)
+
+
+# Largest page a browse request may ask for; bigger result sets go through export
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+CHUNK_SIZE = int(os.getenv("BROWSE_CHUNK_SIZE", "500"))
+
+def _window(stmt, since: Optional[datetime], until: Optional[datetime]):
+    # Bounding created_at lets Postgres prune partitions outside the window
+    if since is not None:
+        stmt = stmt.where(models.Calculation.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(models.Calculation.created_at < until)
+    return stmt
+
+
+def get_all_calculations(db: Session, skip: int = 0, limit: int = 100,
+                         since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[models.Calculation]:
+    """Browse all calculations with pagination, optionally within a created_at window."""
+    stmt = _window(select(models.Calculation), since, until)
+    if dedup.DEDUP_STORAGE:
+        stmt = stmt.options(joinedload(models.Calculation.canonical))
+    return [dedup.hydrate(calc) for calc in db.scalars(stmt.offset(skip).limit(limit))]
+
+
+def iter_calculations(db: Session, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      chunk_size: int = CHUNK_SIZE) -> Iterator[models.Calculation]:
+    """Yield ORM calculations fetched `chunk_size` rows at a time."""
+    stmt = _window(select(models.Calculation), since, until).order_by(models.Calculation.id)
+    if dedup.DEDUP_STORAGE:
+        # Many-to-one joined load is compatible with yield_per
+        stmt = stmt.options(joinedload(models.Calculation.canonical))
+    for calc in db.scalars(stmt.execution_options(yield_per=chunk_size)):
+        yield dedup.hydrate(calc)
+
+
+def iter_calculation_rows(db: Session, skip: int = 0, limit: Optional[int] = None,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None,
+                          chunk_size: int = CHUNK_SIZE, after_id: Optional[int] = None) -> Iterator[Row]:
+    """Yield plain row tuples `chunk_size` at a time, keeping memory flat for any result size."""
+    # Plain columns (inputs resolved from either storage layout); no ORM identity map or instrumentation
+    stmt = _window(dedup.calculation_select(), since, until).order_by(models.Calculation.id).offset(skip)
+    if after_id is not None:
+        # Keyset paging: an index range scan instead of counting past `skip` rows
+        stmt = stmt.where(models.Calculation.id > after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    yield from db.execute(stmt.execution_options(yield_per=chunk_size))
+
+
+def calculation_row_to_dict(row: Row) -> dict:
+    """JSON-ready dict for a row from iter_calculation_rows, matching CalculationRead."""
+    return {
+        "id": row.id,
+        "a": row.a,
+        "b": row.b,
+        "type": row.type.value,
+        "operands": row.operands,
+        "result": row.result,
+        "user_id": row.user_id,
+        "created_at": row.created_at.isoformat() if row.created_at is not None else None,
+        "revision": row.revision,
+    }
 
 
 def get_calculation_by_id(db: Session, calc_id: int) -> Optional[models.Calculation]:
     """Read a specific calculation by ID."""
-    return db.query(models.Calculation).filter(models.Calculation.id == calc_id).first()
+    query = db.query(models.Calculation).filter(models.Calculation.id == calc_id)
+    if dedup.DEDUP_STORAGE:
+        query = query.options(joinedload(models.Calculation.canonical))
+    return dedup.hydrate(query.first())
 
 
 def update_calculation(db: Session, calc_id: int, calc_in: schemas.CalculationCreate) -> Optional[models.Calculation]:
-    """Edit an existing calculation."""
+    """Edit an existing calculation, appending the fields it changes to the revision history."""
+    use_primary(db)
+    if pg.is_postgres(db):
+        return _revise_in_one_statement(db, calc_id, calc_in)
     calc = get_calculation_by_id(db, calc_id)
-    if not calc:
+    if calc is None:
         return None
-    
-    # Update fields
-    calc.a = calc_in.a
-    calc.b = calc_in.b
-    calc.type = calc_in.type
-    calc.result = compute_result(calc_in)
-    
+    return _revise(db, calc, calc_in)
+
+
+def revert_calculation(db: Session, calc_id: int, revision: int) -> Optional[models.Calculation]:
+    """Restore the inputs of an earlier revision as a new revision. Raises RevisionNotFound."""
+    calc = get_calculation_by_id(use_primary(db), calc_id)
+    if calc is None:
+        return None
+    calc_in = revisions.as_create(revisions.state_at(db, calc, revision), calc.user_id)
+    if pg.is_postgres(db):
+        return _revise_in_one_statement(db, calc_id, calc_in, expected_revision=calc.revision)
+    return _revise(db, calc, calc_in)
+
+
+def _new_values(db: Session, calc_in: schemas.CalculationCreate):
+    """Column values for the edited row, and its result."""
+    if dedup.DEDUP_STORAGE:
+        operand_id, result = _canonical_inputs(db, calc_in)
+        return dict(type=calc_in.type, operand_id=operand_id, a=None, b=None, operands=None, result=None), result
+    result = compute_result(calc_in)
+    return dict(a=calc_in.a, b=calc_in.b, type=calc_in.type, operands=calc_in.operands,
+                result=result, operand_id=None), result
+
+
+def _revise_in_one_statement(db: Session, calc_id: int, calc_in: schemas.CalculationCreate,
+                             expected_revision: Optional[int] = None) -> Optional[models.Calculation]:
+    """
+    Postgres: lock the row, compare it with the new inputs, update it and
+    append the revision in a single query. Returns None if the row doesn't
+    exist; with `expected_revision`, raises RevisionConflict if it moved on.
+    """
+    c, R = models.Calculation, models.CalculationRevision
     try:
+        values, result = _new_values(db, calc_in)
+        old = dedup.calculation_select().where(c.id == calc_id).with_for_update(of=c)
+        if expected_revision is not None:
+            old = old.where(c.revision == expected_revision)
+        old = old.cte("old")
+        delta = revisions.delta_sql(old, revisions.snapshot(calc_in, result))
+        changed = select(old.c.id, (old.c.revision + 1).label("revision"), delta.label("delta")).cte("changed")
+        edited = (update(c).where(c.id == changed.c.id, changed.c.delta.isnot(None))
+                  .values(**values, revision=changed.c.revision)
+                  .returning(c.revision).cte("edited"))
+        recorded = insert(R).from_select(
+            ["calculation_id", "revision", "delta"],
+            select(changed.c.id, changed.c.revision, cast(changed.c.delta, JSON)).where(changed.c.delta.isnot(None)),
+        ).cte("recorded")
+        stmt = (select(old.c.user_id, old.c.created_at, old.c.revision, edited.c.revision.label("edited"))
+                .select_from(old.outerjoin(edited, true())).add_cte(recorded))
+        row = db.execute(stmt).first()
         db.commit()
-        db.refresh(calc)
-    except IntegrityError as e:
+    except IntegrityError:
         db.rollback()
         raise
+    if row is None:
+        if expected_revision is not None:
+            raise revisions.RevisionConflict(f"Calculation {calc_id} was modified concurrently")
+        return None
+    calc = models.Calculation(id=calc_id, user_id=row.user_id, created_at=row.created_at,
+                              revision=row.edited or row.revision, **values)
+    for name in ("a", "b", "operands"):
+        set_committed_value(calc, name, getattr(calc_in, name))
+    set_committed_value(calc, "result", result)
+    if row.edited is not None:
+        columnar.on_update(calc)
+    return calc
+
+
+def _revise(db: Session, calc: models.Calculation, calc_in: schemas.CalculationCreate) -> models.Calculation:
+    c = models.Calculation
+    try:
+        values, result = _new_values(db, calc_in)
+        delta = revisions.reverse_delta(revisions.snapshot(calc, calc.result), revisions.snapshot(calc_in, result))
+        if not delta:
+            db.commit()
+            return calc
+        values["revision"] = calc.revision + 1
+        # Matching on the revision read above makes concurrent edits fail instead of interleaving
+        stmt = update(c).where(c.id == calc.id, c.revision == calc.revision).values(**values)
+        if db.execute(stmt, execution_options={"synchronize_session": False}).rowcount != 1:
+            raise revisions.RevisionConflict(f"Calculation {calc.id} was modified concurrently")
+        revisions.record(db, calc.id, values["revision"], delta)
+        db.commit()
+    except (IntegrityError, revisions.RevisionConflict):
+        db.rollback()
+        raise
+    for name, value in values.items():
+        set_committed_value(calc, name, value)
+    for name in ("a", "b", "operands"):
+        set_committed_value(calc, name, getattr(calc_in, name))
+    set_committed_value(calc, "result", result)
+    columnar.on_update(calc)
     return calc
 
 
 def delete_calculation(db: Session, calc_id: int) -> bool:
     """Delete a calculation by ID. Returns True if deleted, False if not found."""
-    calc = get_calculation_by_id(db, calc_id)
-    if not calc:
-        return False
-    
-    db.delete(calc)
+    return delete_calculations(db, ids=[calc_id]) > 0
+
+
+def delete_calculations(db: Session, ids: Optional[List[int]] = None,
+                        calc_type: Optional[models.CalculationType] = None,
+                        since: Optional[datetime] = None, until: Optional[datetime] = None) -> int:
+    """Delete every calculation matching the filters, and their revision history. Returns the number removed."""
+    c = models.Calculation
+    conditions = []
+    if ids is not None:
+        conditions.append(c.id.in_(ids))
+    if calc_type is not None:
+        conditions.append(c.type == calc_type)
+    if since is not None:
+        conditions.append(c.created_at >= since)
+    if until is not None:
+        conditions.append(c.created_at < until)
+    only_ids = calc_type is None and since is None and until is None
+    # History goes first, while the filters can still find the rows it belongs to
+    doomed = ids if only_ids and ids is not None else select(c.id).where(*conditions)
+    history = delete(models.CalculationRevision).where(models.CalculationRevision.calculation_id.in_(doomed))
+    db.execute(history, execution_options={"synchronize_session": False})
+    # rowcount is reliable for DELETE on every dialect, so RETURNING isn't needed
+    deleted = db.execute(delete(c).where(*conditions), execution_options={"synchronize_session": False}).rowcount
     db.commit()
-    return True
+    if deleted:
+        columnar.on_delete(ids if only_ids else None)
+    return deleted
+
+
+def get_calculation_stats(db: Session, calc_type: Optional[models.CalculationType] = None,
+                          user_id: Optional[int] = None, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None) -> dict:
+    """Aggregate calculation results in the database."""
+    c = models.Calculation
+    result = dedup.result_column()
+    stmt = dedup.calculation_select(func.count(), func.sum(result), func.avg(result), func.min(result),
+                                    func.max(result))
+    if calc_type is not None:
+        stmt = stmt.where(c.type == calc_type)
+    if user_id is not None:
+        stmt = stmt.where(c.user_id == user_id)
+    if since is not None:
+        stmt = stmt.where(c.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(c.created_at < until)
+    count, total, mean, low, high = db.execute(stmt).one()
+    return {"count": count, "sum": total or 0.0, "mean": mean, "min": low, "max": high}
+
+
+def merge_stats(parts: List[dict]) -> dict:
+    """Combine get_calculation_stats results from disjoint sets of rows (e.g. shards)."""
+    parts = [p for p in parts if p["count"]]
+    count = sum(p["count"] for p in parts)
+    total = sum(p["sum"] for p in parts)
+    return {
+        "count": count,
+        "sum": total,
+        "mean": total / count if count else None,
+        "min": min((p["min"] for p in parts), default=None),
+        "max": max((p["max"] for p in parts), default=None),
+    }
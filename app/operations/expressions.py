@@ -0,0 +1,57 @@
+import ast
+from typing import Union
+
+from app.operations import add, subtract, multiply, divide, finite
+
+Number = Union[int, float]
+
+MAX_EXPRESSION_LENGTH = 1000
+# Nesting limit for parentheses and unary signs, well below Python's recursion limit
+MAX_EXPRESSION_DEPTH = 100
+
+# Only arithmetic is allowed; everything else in the AST is rejected
+_BINARY = {
+    ast.Add: add,
+    ast.Sub: subtract,
+    ast.Mult: multiply,
+    ast.Div: divide,
+}
+
+
+def _eval(node, depth: int = 0) -> Number:
+    if depth > MAX_EXPRESSION_DEPTH:
+        raise ValueError("Expression nested too deeply")
+    if isinstance(node, ast.Expression):
+        return _eval(node.body, depth + 1)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        return _BINARY[type(node.op)](_eval(node.left, depth + 1), _eval(node.right, depth + 1))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _eval(node.operand, depth + 1)
+        return -value if isinstance(node.op, ast.USub) else value
+    raise ValueError("Unsupported expression element")
+
+
+def evaluate_expression(expression: str) -> Number:
+    """
+    Evaluate an arithmetic expression such as "2 * (3 + 4) / 7".
+
+    Supports numbers, parentheses, unary +/- and + - * /. Nothing is executed:
+    the expression is parsed to an AST and only whitelisted nodes are evaluated.
+
+    Raises:
+    - ValueError: On syntax errors, unsupported elements, nesting deeper than
+      MAX_EXPRESSION_DEPTH, division by zero or a result that isn't finite.
+    """
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ValueError("Expression too long")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except (SyntaxError, RecursionError) as e:
+        raise ValueError(f"Invalid expression: {expression}") from e
+    try:
+        return finite(_eval(tree))
+    except OverflowError as e:
+        # Integer arithmetic is exact, so only converting a huge integer to float overflows
+        raise ValueError("Result is not a finite number!") from e
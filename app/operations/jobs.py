@@ -0,0 +1,136 @@
+"""
+Persistent job queue for calculation workloads too large for one request.
+
+A job row holds the JSON payload and progress counters; its output is written
+as NDJSON chunks in `job_results`. Each chunk is committed together with the
+job's `completed` counter, so a job interrupted by a restart resumes from the
+last committed chunk instead of starting over.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.operations import evaluate
+from app.operations.expressions import evaluate_expression
+
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "1000"))
+# A running job whose row hasn't been touched for this long is assumed orphaned
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+
+KIND_ITEMS = "items"
+KIND_EXPRESSIONS = "expressions"
+
+
+def create_job(db: Session, job_in: schemas.JobCreate) -> models.Job:
+    """Queue a workload. Inputs are stored as-is; nothing is computed here."""
+    if job_in.items is not None:
+        kind = KIND_ITEMS
+        inputs = [[item.op, item.a, item.b] for item in job_in.items]
+    else:
+        kind = KIND_EXPRESSIONS
+        inputs = job_in.expressions
+    job = models.Job(kind=kind, payload=json.dumps(inputs), total=len(inputs), completed=0,
+                     status=models.JobStatus.QUEUED)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def get_job(db: Session, job_id: int) -> Optional[models.Job]:
+    return db.get(models.Job, job_id)
+
+
+def claim_next_job(db: Session) -> Optional[int]:
+    """
+    Atomically move the oldest queued job to running and return its id.
+
+    The conditional UPDATE means two workers racing for the same row cannot
+    both claim it; the loser sees rowcount 0 and tries the next one.
+    """
+    while True:
+        job_id = db.scalar(
+            select(models.Job.id)
+            .where(models.Job.status == models.JobStatus.QUEUED)
+            .order_by(models.Job.id)
+            .limit(1)
+        )
+        if job_id is None:
+            db.rollback()
+            return None
+        claimed = db.execute(
+            update(models.Job)
+            .where(models.Job.id == job_id, models.Job.status == models.JobStatus.QUEUED)
+            .values(status=models.JobStatus.RUNNING),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        db.commit()
+        if claimed:
+            return job_id
+
+
+def requeue_stale_jobs(db: Session, stale_seconds: float = JOB_STALE_SECONDS) -> int:
+    """Return running jobs abandoned by a dead worker to the queue. Returns the number requeued."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+    requeued = db.execute(
+        update(models.Job)
+        .where(models.Job.status == models.JobStatus.RUNNING, models.Job.updated_at < cutoff)
+        .values(status=models.JobStatus.QUEUED),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    db.commit()
+    return requeued
+
+
+def _evaluate_input(kind: str, value) -> dict:
+    try:
+        if kind == KIND_ITEMS:
+            op, a, b = value
+            return {"result": evaluate(op, a, b)}
+        return {"result": evaluate_expression(value)}
+    except ValueError as e:
+        return {"result": None, "error": str(e)}
+
+
+def evaluate_chunk(kind: str, inputs: List) -> str:
+    """Evaluate a slice of job inputs into NDJSON; per-input errors don't fail the job."""
+    # allow_nan=False: Infinity and NaN aren't JSON, so a non-finite result must fail loudly here
+    return "".join(json.dumps(_evaluate_input(kind, value), allow_nan=False) + "\n" for value in inputs)
+
+
+def run_job(db: Session, job_id: int, chunk_size: int = JOB_CHUNK_SIZE) -> models.Job:
+    """Process a claimed job from its last committed position to the end."""
+    job = db.get(models.Job, job_id)
+    try:
+        inputs = json.loads(job.payload)
+        for start in range(job.completed, job.total, chunk_size):
+            chunk = inputs[start:start + chunk_size]
+            # seq is the chunk's first input index, so resuming with another chunk size stays ordered
+            db.add(models.JobResult(job_id=job.id, seq=start, data=evaluate_chunk(job.kind, chunk)))
+            job.completed = start + len(chunk)
+            db.commit()
+        job.status = models.JobStatus.DONE
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        job.status = models.JobStatus.FAILED
+        job.error = str(e)[:255]
+        db.commit()
+        raise
+    return job
+
+
+def iter_job_results(db: Session, job_id: int) -> Iterator[str]:
+    """Yield a job's NDJSON output chunk by chunk, in input order."""
+    stmt = (
+        select(models.JobResult.data)
+        .where(models.JobResult.job_id == job_id)
+        .order_by(models.JobResult.seq)
+        .execution_options(yield_per=10)
+    )
+    yield from db.scalars(stmt)
@@ -0,0 +1,113 @@
+"""
+Revision history for calculations, stored as reverse deltas.
+
+Every edit bumps ``Calculation.revision`` and appends one
+``calculation_revisions`` row. The row holds only the fields the edit changed,
+with their values from before the edit. The calculation row is always the
+latest state, so reading it never touches the history. Earlier states are
+rebuilt by applying the deltas newest first, starting from the current row.
+
+Revision 1 is the calculation as created. Reverting to an earlier revision
+writes that state as a new revision, so history is never rewritten and a
+revert can itself be undone.
+
+On Postgres an edit is one statement: the delta is computed in SQL by
+``delta_sql`` from the row as it is locked, and the UPDATE and the history
+INSERT run as CTEs of the same query.
+"""
+
+from typing import List, Optional
+
+from sqlalchemy import String, case, cast, func, literal, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+
+# Fields tracked by the history; user_id and created_at never change after creation
+FIELDS = ("type", "a", "b", "operands", "result")
+
+R = models.CalculationRevision
+
+
+class RevisionConflict(Exception):
+    """The calculation was edited or deleted by someone else between reading and writing it."""
+
+
+class RevisionNotFound(LookupError):
+    """The requested revision is outside the calculation's history."""
+
+
+def snapshot(source, result: Optional[float]) -> dict:
+    """JSON-ready tracked fields of a calculation (or a CalculationCreate and its result)."""
+    return {
+        "type": models.CalculationType(source.type).value,
+        "a": source.a,
+        "b": source.b,
+        "operands": source.operands,
+        "result": result,
+    }
+
+
+def reverse_delta(old: dict, new: dict) -> dict:
+    """Fields that differ between two snapshots, with their values in `old`."""
+    return {name: old[name] for name in FIELDS if old[name] != new[name]}
+
+
+def delta_sql(old, new: dict):
+    """
+    Postgres twin of reverse_delta: jsonb of the fields whose value in `old`
+    (a CTE with the tracked columns) differs from the snapshot `new`, or NULL
+    when none does.
+    """
+    type_value = case({member.name: member.value for member in models.CalculationType},
+                      value=cast(old.c.type, String))
+    before = func.jsonb_build_object("type", type_value, "a", old.c.a, "b", old.c.b,
+                                     "operands", cast(old.c.operands, JSONB), "result", old.c.result)
+    fields = func.jsonb_each(before).table_valued("key", "value")
+    # jsonb compares numbers by value, so 5 and 5.0 are the same field value
+    return (select(func.jsonb_object_agg(fields.c.key, fields.c.value))
+            .where(fields.c.value.is_distinct_from(literal(new, JSONB).op("->")(fields.c.key)))
+            .scalar_subquery())
+
+
+def record(db: Session, calc_id: int, revision: int, delta: dict) -> None:
+    """Append the delta for the edit that produced `revision`; the caller commits."""
+    db.add(R(calculation_id=calc_id, revision=revision, delta=delta))
+
+
+def history(db: Session, calc: models.Calculation, limit: Optional[int] = None) -> List[dict]:
+    """States of `calc`, newest first, each with its revision number and when it was written."""
+    stmt = (select(R.revision, R.delta, R.created_at)
+            .where(R.calculation_id == calc.id, R.revision <= calc.revision)
+            .order_by(R.revision.desc()))
+    if limit is not None:
+        # State r was written with row r, so the newest `limit` states need the newest `limit` rows
+        stmt = stmt.where(R.revision > calc.revision - limit)
+    state = snapshot(calc, calc.result)
+    states = []
+    for row in db.execute(stmt):
+        states.append({"revision": row.revision, **state, "created_at": row.created_at})
+        state = {**state, **row.delta}
+    if calc.revision - len(states) == 1 and (limit is None or len(states) < limit):
+        states.append({"revision": 1, **state, "created_at": calc.created_at})
+    return states
+
+
+def state_at(db: Session, calc: models.Calculation, revision: int) -> dict:
+    """Tracked fields of `calc` as of `revision`."""
+    if not 1 <= revision <= calc.revision:
+        raise RevisionNotFound(f"Revision {revision} not found")
+    state = snapshot(calc, calc.result)
+    stmt = (select(R.delta)
+            .where(R.calculation_id == calc.id, R.revision > revision, R.revision <= calc.revision)
+            .order_by(R.revision.desc()))
+    for delta in db.scalars(stmt):
+        state.update(delta)
+    return state
+
+
+def as_create(state: dict, user_id: Optional[int] = None) -> schemas.CalculationCreate:
+    """Input that recreates a historical state; its result is recomputed on write."""
+    return schemas.CalculationCreate(type=state["type"], a=state["a"], b=state["b"],
+                                     operands=state["operands"], user_id=user_id)
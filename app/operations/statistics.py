@@ -0,0 +1,283 @@
+"""
+Aggregates over lists (or any iterable) of operands.
+
+Inputs are consumed in fixed-size chunks, so memory stays constant however
+long the stream is:
+
+- ``RunningStats`` tracks count, sum, mean and variance with Welford's online
+  algorithm. Per-chunk results are combined with Chan's parallel update.
+- ``TDigest`` is a merging t-digest quantile sketch that holds at most about
+  `compression` centroids.
+
+With NumPy installed, each chunk is reduced by vectorised kernels. Without it
+the same algorithms run element by element. Lists and arrays, already in
+memory and capped at MAX_OPERANDS by the API, get an exact percentile;
+iterators use the sketch.
+"""
+
+import math
+import os
+from itertools import islice
+from typing import Iterable, Iterator, List, Sequence, Union
+
+try:  # optional vectorised kernels
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+STATS_CHUNK_SIZE = int(os.getenv("STATS_CHUNK_SIZE", "65536"))
+TDIGEST_COMPRESSION = int(os.getenv("TDIGEST_COMPRESSION", "200"))
+
+Values = Union[Sequence[float], Iterable[float]]
+
+
+def _chunks(values: Values, size: int = STATS_CHUNK_SIZE) -> Iterator:
+    """Yield successive chunks; arrays with NumPy, lists without."""
+    if isinstance(values, (list, tuple)) or (np is not None and isinstance(values, np.ndarray)):
+        for start in range(0, len(values), size):
+            chunk = values[start:start + size]
+            yield np.asarray(chunk, dtype=np.float64) if np is not None else chunk
+        return
+    it = iter(values)
+    while True:
+        if np is not None:
+            chunk = np.fromiter(islice(it, size), dtype=np.float64)
+            if not chunk.size:
+                return
+        else:
+            chunk = [float(x) for x in islice(it, size)]
+            if not chunk:
+                return
+        yield chunk
+
+
+class RunningStats:
+    """Constant-memory count, sum, mean, variance, min and max."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def push(self, x: float) -> None:
+        """Welford's update for a single value."""
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.total += x
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def _combine(self, n: int, mean: float, m2: float, total: float, low: float, high: float) -> None:
+        """Chan et al.'s pairwise update: merge another partition's moments into this one."""
+        if n == 0:
+            return
+        combined = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / combined
+        self.m2 += m2 + delta * delta * self.n * n / combined
+        self.n = combined
+        self.total += total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def update(self, values: Values) -> "RunningStats":
+        for chunk in _chunks(values):
+            if np is not None:
+                chunk_mean = float(chunk.mean())
+                m2 = float(np.square(chunk - chunk_mean).sum())
+                self._combine(chunk.size, chunk_mean, m2, float(chunk.sum()),
+                              float(chunk.min()), float(chunk.max()))
+            else:
+                part = RunningStats()
+                for x in chunk:
+                    part.push(x)
+                part.total = math.fsum(chunk)
+                self._combine(part.n, part.mean, part.m2, part.total, part.min, part.max)
+        return self
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        self._combine(other.n, other.mean, other.m2, other.total, other.min, other.max)
+        return self
+
+    def variance(self, sample: bool = True) -> float:
+        ddof = 1 if sample else 0
+        if self.n - ddof <= 0:
+            raise ValueError("Standard deviation requires at least two operands")
+        return self.m2 / (self.n - ddof)
+
+    def stddev(self, sample: bool = True) -> float:
+        return math.sqrt(self.variance(sample))
+
+
+class TDigest:
+    """
+    Merging t-digest: a mergeable quantile sketch using O(compression) memory.
+
+    Values are buffered and periodically folded into centroids. Each centroid
+    covers at most one unit of the k1 scale function
+    ``k(q) = compression / (2*pi) * asin(2q - 1)``, so centroids near the tails
+    stay small. That keeps extreme percentiles accurate.
+    """
+
+    def __init__(self, compression: int = TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means: List[float] = []
+        self.weights: List[float] = []
+        self.buffer: List[float] = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _bucket(self, q: float) -> int:
+        q = min(max(q, 0.0), 1.0)
+        return int(self.compression / (2 * math.pi) * math.asin(2 * q - 1) + self.compression / 4)
+
+    def add(self, x: float) -> None:
+        self.buffer.append(x)
+        self.count += 1
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        if len(self.buffer) >= 5 * self.compression:
+            self._compress()
+
+    def update(self, values: Values) -> "TDigest":
+        for chunk in _chunks(values):
+            if np is not None:
+                if not chunk.size:
+                    continue
+                self.count += int(chunk.size)
+                self.min = min(self.min, float(chunk.min()))
+                self.max = max(self.max, float(chunk.max()))
+                self._compress(chunk)
+            else:
+                for x in chunk:
+                    self.add(x)
+        return self
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        other._compress()
+        self.means.extend(other.means)
+        self.weights.extend(other.weights)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self, extra=None) -> None:
+        if np is not None:
+            values = np.concatenate([np.asarray(self.means, dtype=np.float64),
+                                     np.asarray(self.buffer, dtype=np.float64),
+                                     extra if extra is not None else np.empty(0)])
+            if not values.size:
+                return
+            weights = np.concatenate([np.asarray(self.weights, dtype=np.float64),
+                                      np.ones(values.size - len(self.weights))])
+            order = np.argsort(values, kind="stable")
+            values, weights = values[order], weights[order]
+            total = weights.sum()
+            q_mid = (np.cumsum(weights) - weights / 2) / total
+            buckets = np.floor(self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q_mid - 1, -1, 1))
+                               + self.compression / 4).astype(np.int64)
+            buckets -= buckets.min()
+            bucket_weights = np.bincount(buckets, weights=weights)
+            bucket_sums = np.bincount(buckets, weights=weights * values)
+            used = bucket_weights > 0
+            self.means = (bucket_sums[used] / bucket_weights[used]).tolist()
+            self.weights = bucket_weights[used].tolist()
+        else:
+            points = sorted(zip(self.means + self.buffer + list(extra or ()),
+                                self.weights + [1.0] * (len(self.buffer) + len(extra or ()))))
+            if not points:
+                return
+            total = sum(w for _, w in points)
+            means, weights = [], []
+            cumulative, current = 0.0, None
+            for value, weight in points:
+                bucket = self._bucket((cumulative + weight / 2) / total)
+                cumulative += weight
+                if bucket == current:
+                    weights[-1] += weight
+                    means[-1] += (value - means[-1]) * weight / weights[-1]
+                else:
+                    means.append(value)
+                    weights.append(weight)
+                    current = bucket
+            self.means, self.weights = means, weights
+        self.buffer = []
+
+    def quantile(self, q: float) -> float:
+        """Estimated value at quantile q in [0, 1], interpolating between centroid centres."""
+        self._compress()
+        if not self.count:
+            raise ValueError("Percentile requires at least one operand")
+        means, weights = self.means, self.weights
+        if len(means) == 1:
+            return means[0]
+        target = q * self.count
+        if target < weights[0] / 2:
+            return self.min + (means[0] - self.min) * target / (weights[0] / 2)
+        if target > self.count - weights[-1] / 2:
+            tail = self.count - target
+            return self.max - (self.max - means[-1]) * tail / (weights[-1] / 2)
+        cumulative = weights[0] / 2
+        for i in range(len(means) - 1):
+            nxt = cumulative + (weights[i] + weights[i + 1]) / 2
+            if target <= nxt:
+                fraction = (target - cumulative) / (nxt - cumulative)
+                return means[i] + fraction * (means[i + 1] - means[i])
+            cumulative = nxt
+        return means[-1]
+
+
+def _require(stats: RunningStats, name: str) -> RunningStats:
+    if stats.n == 0:
+        raise ValueError(f"{name} requires at least one operand")
+    return stats
+
+
+def total(values: Values) -> float:
+    """Sum of the operands."""
+    return _require(RunningStats().update(values), "Sum").total
+
+
+def mean(values: Values) -> float:
+    """Arithmetic mean of the operands."""
+    return _require(RunningStats().update(values), "Mean").mean
+
+
+def stddev(values: Values) -> float:
+    """Sample standard deviation (n - 1 denominator) of the operands."""
+    return RunningStats().update(values).stddev(sample=True)
+
+
+def _exact_percentile(values: Sequence[float], q: float) -> float:
+    if np is not None:
+        return float(np.percentile(np.asarray(values, dtype=np.float64), q * 100))
+    ordered = sorted(values)
+    position = q * (len(ordered) - 1)
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def percentile(values: Values, p: float) -> float:
+    """
+    The p-th percentile (0-100) of the operands, linearly interpolated.
+
+    Exact for lists and arrays; estimated with a t-digest for iterators, in
+    constant memory.
+    """
+    if not 0 <= p <= 100:
+        raise ValueError("Percentile must be between 0 and 100")
+    q = p / 100
+    if isinstance(values, (list, tuple)) or (np is not None and isinstance(values, np.ndarray)):
+        if len(values) == 0:
+            raise ValueError("Percentile requires at least one operand")
+        return _exact_percentile(values, q)
+    return TDigest().update(values).quantile(q)
@@ -1,10 +1,22 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import delete, select, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app import models, schemas
-from app.security import hash_password, verify_password
+from app import models, schemas, user_cache
+from app.security import SESSION_MAX_DAYS, hash_password, verify_password
+
+
+def _taken(db: Session, username: str, email: str) -> bool:
+    stmt = select(models.User.id).where((models.User.username == username) | (models.User.email == email))
+    return db.scalar(stmt.limit(1)) is not None
 
 
 def create_user(db: Session, user_in: schemas.UserCreate) -> models.User:
+    # Only a possible duplicate pays for the exact lookup; real duplicates skip the password hash
+    if user_cache.might_exist(user_in.username, user_in.email) and _taken(db, user_in.username, user_in.email):
+        raise ValueError("username or email already exists")
     user = models.User(
         username=user_in.username,
         email=user_in.email,
@@ -13,17 +25,19 @@ def create_user(db: Session, user_in: schemas.UserCreate) -> models.User:
     db.add(user)
     try:
         db.commit()
-        db.refresh(user)
     except IntegrityError as e:
         db.rollback()
+        # Another worker registered it first; remember it for next time
+        user_cache.remember(user_in.username, user_in.email)
         # Raise a ValueError so tests/handlers can convert to HTTP 400
         raise ValueError("username or email already exists") from e
+    user_cache.remember(user.username, user.email)
     return user
 
 
 def authenticate_user(db: Session, username: str, password: str) -> models.User:
     """Authenticate a user by username and password. Returns user if valid, None otherwise."""
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = get_user_by_username(db, username)
     if not user:
         return None
     if not verify_password(password, user.password_hash):
@@ -32,5 +46,60 @@ def authenticate_user(db: Session, username: str, password: str) -> models.User:
 
 
 def get_user_by_username(db: Session, username: str) -> models.User:
-    """Get user by username."""
-    return db.query(models.User).filter(models.User.username == username).first()
+    """Get user by username, from the TTL cache when possible."""
+    user = user_cache.cached_user(username)
+    if user is not None:
+        return user
+    user = db.query(models.User).filter(models.User.username == username).first()
+    if user is not None:
+        user_cache.cache_user(user)
+    return user
+
+
+def start_session(db: Session, user_id: int) -> dict:
+    """Open a refresh session after a password check. Returns the claims for its first refresh token."""
+    auth_time = datetime.now(timezone.utc).replace(microsecond=0)
+    session = models.RefreshSession(id=uuid.uuid4().hex, user_id=user_id, current_jti=uuid.uuid4().hex,
+                                    auth_time=auth_time, revoked=False)
+    db.add(session)
+    db.commit()
+    return {"sid": session.id, "jti": session.current_jti, "auth_time": int(auth_time.timestamp())}
+
+
+def rotate_session(db: Session, sid: str, jti: str) -> Optional[str]:
+    """
+    Replace the session's current refresh token. Returns the new jti, or None if refused.
+
+    One conditional UPDATE checks that `jti` is the session's newest token,
+    that the session is neither revoked nor past SESSION_MAX_DAYS, and that
+    the user still exists. An older jti means the token was copied, so any
+    refusal revokes the whole session, the legitimate holder's chain
+    included.
+    """
+    s = models.RefreshSession
+    new_jti = uuid.uuid4().hex
+    oldest = datetime.now(timezone.utc) - timedelta(days=SESSION_MAX_DAYS)
+    user_exists = select(models.User.id).where(models.User.id == s.user_id).exists()
+    stmt = (update(s)
+            .where(s.id == sid, s.current_jti == jti, s.revoked.is_(False), s.auth_time > oldest, user_exists)
+            .values(current_jti=new_jti))
+    if db.execute(stmt, execution_options={"synchronize_session": False}).rowcount == 1:
+        db.commit()
+        return new_jti
+    revoke_session(db, sid)
+    return None
+
+
+def revoke_session(db: Session, sid: str) -> None:
+    s = models.RefreshSession
+    db.execute(update(s).where(s.id == sid).values(revoked=True), execution_options={"synchronize_session": False})
+    db.commit()
+
+
+def prune_sessions(db: Session) -> int:
+    """Delete sessions past SESSION_MAX_DAYS. Returns the number removed."""
+    s = models.RefreshSession
+    oldest = datetime.now(timezone.utc) - timedelta(days=SESSION_MAX_DAYS)
+    removed = db.execute(delete(s).where(s.auth_time <= oldest), execution_options={"synchronize_session": False}).rowcount
+    db.commit()
+    return removed
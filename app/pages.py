@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import os
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.templating import Jinja2Templates
+
+try:  # brotli is optional; pages fall back to gzip/identity without it
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+PAGE_CACHE_MAX_AGE = int(os.getenv("PAGE_CACHE_MAX_AGE", "300"))
+
+# Preferred order when the client accepts several encodings
+ENCODINGS = ("br", "gzip", "identity")
+
+
+class StaticPage:
+    """A template rendered once, held in memory with its compressed variants."""
+
+    def __init__(self, body: bytes, media_type: str = "text/html; charset=utf-8"):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants: Dict[str, bytes] = {"identity": body}
+        self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body)
+
+    def etag(self, encoding: str) -> str:
+        # Strong ETags must differ per representation, so the encoding is part of it
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    """Pick the best encoding from an Accept-Encoding header, honouring q=0."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    for encoding in ENCODINGS:
+        if encoding == "identity":
+            return encoding
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return "identity"
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class PageCache:
+    """Serve effectively static templates from memory instead of re-rendering per request."""
+
+    def __init__(self, templates: Jinja2Templates, max_age: int = PAGE_CACHE_MAX_AGE):
+        self.templates = templates
+        self.max_age = max_age
+        self._pages: Dict[str, StaticPage] = {}
+
+    def render(self, name: str) -> StaticPage:
+        body = self.templates.get_template(name).render().encode("utf-8")
+        page = StaticPage(body)
+        self._pages[name] = page
+        return page
+
+    def prerender(self, *names: str) -> None:
+        for name in names:
+            self.render(name)
+
+    def get(self, name: str) -> StaticPage:
+        page = self._pages.get(name)
+        if page is None:
+            # Lazily render if startup did not run (e.g. TestClient without a context)
+            page = self.render(name)
+        return page
+
+    def response(self, request: Request, name: str) -> Response:
+        page = self.get(name)
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), page.variants)
+        etag = page.etag(encoding)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={self.max_age}",
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match: Optional[str] = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=page.variants[encoding], media_type=page.media_type, headers=headers)
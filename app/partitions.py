@@ -0,0 +1,178 @@
+"""
+Monthly partition maintenance and retention for the `calculations` table.
+
+On Postgres with CALCULATIONS_PARTITIONED=1 the table is range-partitioned on
+`created_at`; this module creates upcoming monthly partitions and retires old
+ones by archiving and dropping them whole. A DEFAULT partition catches rows no
+monthly partition covers yet, so a missed maintenance run can't make inserts fail. On other setups retention falls back
+to a single bulk DELETE.
+
+Run periodically (e.g. daily from cron):
+    python -m app.partitions --retain-months 12 --archive-dir ./archive
+"""
+
+import argparse
+import csv
+import gzip
+import os
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import delete, inspect, select, text
+from sqlalchemy.engine import Engine
+
+from app import models
+from app.db import CALCULATIONS_PARTITIONED, engine as default_engine
+
+PARENT = models.Calculation.__tablename__
+PARTITION_PREFIX = f"{PARENT}_p"
+DEFAULT_PARTITION = f"{PARENT}_default"
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+
+def add_months(d: date, months: int) -> date:
+    """First day of the month `months` after the month containing `d`."""
+    years, month = divmod(d.month - 1 + months, 12)
+    return date(d.year + years, month + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    """Inverse of partition_name; None for tables that don't follow the convention."""
+    suffix = name[len(PARTITION_PREFIX):]
+    if not name.startswith(PARTITION_PREFIX) or len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def partition_ddl(month: date) -> str:
+    start, end = month, add_months(month, 1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def _create_partition(conn, month: date) -> None:
+    bounds = {"start": month, "end": add_months(month, 1)}
+    in_range = "created_at >= :start AND created_at < :end"
+    stranded = conn.execute(text(f"SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range} LIMIT 1"), bounds).first()
+    if stranded is None:
+        conn.execute(text(partition_ddl(month)))
+        return
+    # Postgres refuses a partition whose range overlaps rows in the default partition:
+    # detach it, create the partition, move the month's rows over, then reattach
+    conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}"))
+    conn.execute(text(partition_ddl(month)))
+    conn.execute(text(f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING *) "
+                      f"INSERT INTO {PARENT} SELECT * FROM moved"), bounds)
+    conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+
+def list_partitions(bind: Engine) -> List[str]:
+    return sorted(
+        name for name in inspect(bind).get_table_names() if partition_month(name) is not None
+    )
+
+
+def ensure_partitions(bind: Engine = default_engine, months_ahead: int = PARTITION_MONTHS_AHEAD,
+                      today: Optional[date] = None) -> List[str]:
+    """
+    Create the DEFAULT partition and partitions for the current month and `months_ahead`
+    following months. Rows the default partition caught for those months move to their own.
+    """
+    current = (today or datetime.now(timezone.utc).date()).replace(day=1)
+    months = [add_months(current, i) for i in range(months_ahead + 1)]
+    existing = set(list_partitions(bind))
+    with bind.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT"))
+        for month in months:
+            if partition_name(month) not in existing:
+                _create_partition(conn, month)
+    return [partition_name(m) for m in months]
+
+
+def _archive_rows(rows, columns, path: str) -> int:
+    count = 0
+    with gzip.open(path, "wt", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _archive_partition(bind: Engine, name: str, archive_dir: str) -> str:
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    raw = bind.raw_connection()
+    try:
+        with gzip.open(path, "wb") as fh, raw.cursor() as cur:
+            cur.copy_expert(f"COPY {name} TO STDOUT WITH CSV HEADER", fh)
+    finally:
+        raw.close()
+    return path
+
+
+def apply_retention(bind: Engine = default_engine, retain_months: int = 12,
+                    archive_dir: Optional[str] = None, today: Optional[date] = None,
+                    partitioned: bool = CALCULATIONS_PARTITIONED) -> List[str]:
+    """
+    Remove calculations older than `retain_months` whole months, archiving them first
+    when `archive_dir` is given. Returns the partitions dropped and archive files written.
+    """
+    cutoff = add_months((today or datetime.now(timezone.utc).date()).replace(day=1), -retain_months)
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+
+    retired = []
+    if partitioned:
+        for name in list_partitions(bind):
+            if add_months(partition_month(name), 1) > cutoff:
+                continue
+            if archive_dir:
+                _archive_partition(bind, name, archive_dir)
+            with bind.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+                conn.execute(text(f"DROP TABLE {name}"))
+            retired.append(name)
+
+    # Unpartitioned fallback: one bulk DELETE rather than row-by-row deletes. When partitioned,
+    # this only reaches old rows left in the default partition.
+    table = models.Calculation.__table__
+    cutoff_ts = datetime(cutoff.year, cutoff.month, 1, tzinfo=timezone.utc)
+    written = []
+    with bind.begin() as conn:
+        if archive_dir:
+            path = os.path.join(archive_dir, f"{PARENT}_before_{cutoff:%Y%m}.csv.gz")
+            rows = conn.execution_options(stream_results=True).execute(
+                select(table).where(table.c.created_at < cutoff_ts).order_by(table.c.id)
+            )
+            if _archive_rows(rows, list(rows.keys()), path):
+                written.append(path)
+            else:
+                os.remove(path)
+        conn.execute(delete(table).where(table.c.created_at < cutoff_ts))
+    return retired + written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain calculation partitions and retention.")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--retain-months", type=int, default=None,
+                        help="Drop data older than this many months (default: keep everything)")
+    parser.add_argument("--archive-dir", default=None, help="Write gzipped CSV archives here before dropping")
+    args = parser.parse_args()
+
+    if CALCULATIONS_PARTITIONED:
+        print("ensured:", ", ".join(ensure_partitions(months_ahead=args.months_ahead)))
+    if args.retain_months is not None:
+        retired = apply_retention(retain_months=args.retain_months, archive_dir=args.archive_dir)
+        print("retired:", ", ".join(retired) or "nothing")
+
+
+if __name__ == "__main__":
+    main()
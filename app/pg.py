@@ -0,0 +1,146 @@
+"""
+Postgres fast paths with portable fallbacks.
+
+Each helper checks the dialect of the session's bind and takes the native
+route on Postgres:
+
+- ``copy_rows``: ``COPY ... FROM STDIN`` in CSV format, for bulk inserts that
+  don't need generated keys back. Elsewhere it runs one executemany INSERT.
+- ``insert_returning``: multi-row ``INSERT ... VALUES (...), (...) RETURNING``
+  in pages of PG_INSERT_PAGE_SIZE rows (SQLAlchemy's "insertmanyvalues"). The
+  fallback is one INSERT per row on dialects without RETURNING.
+- ``engine_options``: driver-level settings for ``create_engine``. psycopg 3
+  gets server-side prepared statements after PG_PREPARE_THRESHOLD executions
+  of the same query. psycopg2 cannot prepare server-side, so it relies on
+  SQLAlchemy's compiled-statement cache (QUERY_CACHE_SIZE).
+
+Exports already stream with ``yield_per``. On Postgres that opens a named
+server-side cursor, so the server holds the result set and rows arrive
+`chunk_size` at a time.
+"""
+
+import io
+import os
+from typing import Iterable, List, Mapping, Sequence
+
+from sqlalchemy import LargeBinary, Table, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+PG_INSERT_PAGE_SIZE = int(os.getenv("PG_INSERT_PAGE_SIZE", "1000"))
+# psycopg 3 prepares a statement server-side after this many executions; 0 prepares immediately
+PG_PREPARE_THRESHOLD = int(os.getenv("PG_PREPARE_THRESHOLD", "5"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1200"))
+
+
+def is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def engine_options(url: str) -> dict:
+    """Extra create_engine() keyword arguments for Postgres URLs; empty for other databases."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "postgresql":
+        return {}
+    options = {"insertmanyvalues_page_size": PG_INSERT_PAGE_SIZE, "query_cache_size": QUERY_CACHE_SIZE}
+    if parsed.get_driver_name() == "psycopg":
+        options["connect_args"] = {"prepare_threshold": PG_PREPARE_THRESHOLD}
+    return options
+
+
+def _with_defaults(table: Table, rows: Sequence[Mapping]) -> List[str]:
+    """Columns to write: every key in the rows plus columns with a scalar Python-side default."""
+    names = {name for row in rows for name in row}
+    return [c.name for c in table.columns
+            if c.name in names or (c.default is not None and c.default.is_scalar)]
+
+
+def _csv_field(value) -> str:
+    # Unquoted empty is NULL in COPY's CSV format, so every other value is quoted
+    if value is None:
+        return ""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = "\\x" + bytes(value).hex()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_buffer(table: Table, columns: List[str], rows: Iterable[Mapping], dialect) -> io.StringIO:
+    processors = []
+    for name in columns:
+        column = table.c[name]
+        default = column.default.arg if column.default is not None and column.default.is_scalar else None
+        # The driver's binary processor builds an SQL literal; COPY wants the raw bytes (see _csv_field)
+        process = None if isinstance(column.type, LargeBinary) else column.type.bind_processor(dialect)
+        processors.append((name, default, process))
+    buffer = io.StringIO()
+    for row in rows:
+        fields = []
+        for name, default, process in processors:
+            value = row.get(name, default)
+            if process is not None and value is not None:
+                value = process(value)
+            fields.append(_csv_field(value))
+        buffer.write(",".join(fields))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def write_connection(db: Session, table: Table):
+    """The session's connection for writing `table`: the primary, never a read replica."""
+    # Without a clause, RoutingSession.get_bind treats the request as a read
+    return db.connection(bind_arguments={"clause": table.insert()})
+
+
+def copy_rows(db: Session, table: Table, rows: Sequence[Mapping]) -> int:
+    """
+    Bulk-insert `rows` into `table` in the session's transaction; the caller commits.
+
+    Returns the number of rows written. Generated keys are not returned;
+    use `insert_returning` when they are needed.
+    """
+    if not rows:
+        return 0
+    if not is_postgres(db):
+        db.execute(insert(table), list(rows))
+        return len(rows)
+    columns = _with_defaults(table, rows)
+    buffer = _copy_buffer(table, columns, rows, db.get_bind().dialect)
+    statement = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    cursor = write_connection(db, table).connection.driver_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            cursor.copy_expert(statement, buffer)
+        else:  # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+    return len(rows)
+
+
+def insert_returning(db: Session, table: Table, rows: Sequence[Mapping], *returning) -> list:
+    """
+    Insert `rows` and return the `returning` columns for each, in input order.
+
+    Batched into multi-row INSERT ... RETURNING statements where the dialect
+    supports it (Postgres, SQLite 3.35+). Otherwise one INSERT per row.
+    """
+    if not rows:
+        return []
+    dialect = db.get_bind().dialect
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        stmt = insert(table).returning(*returning, sort_by_parameter_order=True)
+        return db.execute(stmt, list(rows)).all()
+    stmt = insert(table).returning(*returning) if dialect.insert_returning else insert(table)
+    results = []
+    for row in rows:
+        result = db.execute(stmt, row)
+        if dialect.insert_returning:
+            results.append(result.one())
+        else:
+            results.append(db.execute(
+                table.select().with_only_columns(*returning)
+                .where(table.c.id == result.inserted_primary_key[0])
+            ).one())
+    return results
@@ -0,0 +1,302 @@
+"""
+On-demand sampling profiler and slow-request capture.
+
+- ``StackSampler`` samples thread stacks with ``sys._current_frames`` and emits
+  folded stacks (``frame;frame;frame count``), the input format of flamegraph.pl,
+  speedscope and similar tools.
+- ``ProfilingMiddleware`` records SQL statements and timings for every request and
+  logs a WARNING with statements and the handler's stack for requests slower than
+  SLOW_REQUEST_MS. An admin can also profile a single request by sending
+  ``X-Profile: 1``; the profile is kept in memory and its id returned in the
+  ``X-Profile-Id`` response header.
+
+Admin access requires ADMIN_TOKEN to be set and sent as the ``X-Admin-Token`` header.
+"""
+
+import asyncio
+import hmac
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import Header, HTTPException
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.shared_state import incr_metric
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))  # 0 disables capture
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+MAX_PROFILE_SECONDS = 60
+MAX_RECORDED_STATEMENTS = 50
+MAX_STORED_PROFILES = 20
+# Warn when one statement runs this many times in a single request (likely N+1); 0 disables
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """FastAPI dependency guarding admin-only endpoints."""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def folded_stack(frame) -> str:
+    """Render a frame's call stack root-first as ``file:function`` entries joined by ';'."""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def stack_contains(frame, code) -> bool:
+    while frame is not None:
+        if frame.f_code is code:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def format_folded(counts: Counter) -> str:
+    return "\n".join(f"{stack} {n}" for stack, n in counts.most_common())
+
+
+class StackSampler:
+    """Background thread sampling other threads' stacks at a fixed interval."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000,
+                 thread_filter: Optional[Callable[[int, object], bool]] = None):
+        self.interval = interval
+        self.thread_filter = thread_filter
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if self.thread_filter is not None and not self.thread_filter(ident, frame):
+                    continue
+                self.counts[folded_stack(frame)] += 1
+
+    def start(self) -> "StackSampler":
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.counts
+
+    def run_for(self, seconds: float) -> Counter:
+        self.start()
+        time.sleep(seconds)
+        return self.stop()
+
+
+# Recent per-request profiles, oldest evicted first
+_profiles: "OrderedDict[str, str]" = OrderedDict()
+_profile_ids = itertools.count(1)
+_profiles_lock = threading.Lock()
+
+
+def store_profile(folded: str) -> str:
+    with _profiles_lock:
+        profile_id = str(next(_profile_ids))
+        _profiles[profile_id] = folded
+        while len(_profiles) > MAX_STORED_PROFILES:
+            _profiles.popitem(last=False)
+    return profile_id
+
+
+def get_profile(profile_id: str) -> Optional[str]:
+    return _profiles.get(profile_id)
+
+
+class RequestRecord:
+    """Per-request data collected for slow-request capture."""
+
+    def __init__(self, method: str, path: str, scope: dict):
+        self.method = method
+        self.path = path
+        self.scope = scope
+        self.started = time.perf_counter()
+        self.statements: List[Tuple[str, float]] = []
+        self.statement_counts: Counter = Counter()
+        self.stacks: List[str] = []
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def handler_code(self):
+        endpoint = self.scope.get("endpoint")
+        return getattr(endpoint, "__code__", None)
+
+    def capture_stacks(self) -> None:
+        """Snapshot every thread currently executing this request's handler."""
+        code = self.handler_code()
+        if code is None:
+            return
+        for frame in sys._current_frames().values():
+            if stack_contains(frame, code):
+                self.stacks.append(folded_stack(frame))
+
+
+current_request: ContextVar[Optional[RequestRecord]] = ContextVar("current_request", default=None)
+_active: Dict[int, RequestRecord] = {}
+# Request threads add and remove records while the monitor thread reads them
+_active_lock = threading.Lock()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = current_request.get()
+    if record is None:
+        return
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = (time.perf_counter() - starts.pop()) * 1000
+    record.statement_counts[statement] += 1
+    if len(record.statements) < MAX_RECORDED_STATEMENTS:
+        record.statements.append((statement, elapsed))
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts and current_request.get() is not None:
+        starts.pop()
+
+
+class SlowRequestMonitor:
+    """Single background thread that snapshots handler stacks of requests running past the threshold."""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="slow-request-monitor", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            threshold_ms = SLOW_REQUEST_MS
+            time.sleep(max(threshold_ms / 2000, 0.001))
+            with _active_lock:
+                records = list(_active.values())
+            for record in records:
+                if not record.stacks and record.elapsed_ms >= threshold_ms:
+                    record.capture_stacks()
+
+
+monitor = SlowRequestMonitor()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware for slow-request capture and header-triggered per-request profiles."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        threshold_ms = SLOW_REQUEST_MS
+        if scope["type"] != "http" or (threshold_ms <= 0 and not ADMIN_TOKEN):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        record = RequestRecord(scope["method"], scope["path"], scope)
+        token = current_request.set(record)
+        with _active_lock:
+            _active[id(record)] = record
+        if threshold_ms > 0:
+            monitor.ensure_running()
+
+        sampler = None
+        if headers.get(b"x-profile") == b"1" and is_admin(headers.get(b"x-admin-token", b"").decode()):
+            sampler = StackSampler(thread_filter=self._request_filter(record)).start()
+
+        async def send_wrapper(message):
+            if sampler is not None and message["type"] == "http.response.start":
+                profile_id = store_profile(format_folded(sampler.stop()))
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if sampler is not None:
+                sampler.stop()
+            with _active_lock:
+                _active.pop(id(record), None)
+            current_request.reset(token)
+            if threshold_ms > 0 and record.elapsed_ms >= threshold_ms:
+                self._log_slow(record)
+            if N_PLUS_ONE_THRESHOLD > 0:
+                self._check_n_plus_one(record)
+
+    @staticmethod
+    def _request_filter(record: RequestRecord):
+        loop_thread = threading.get_ident()
+
+        def keep(ident, frame):
+            code = record.handler_code()
+            if code is not None and stack_contains(frame, code):
+                return True
+            # Coroutine handlers are suspended between awaits; attribute loop time to them
+            endpoint = record.scope.get("endpoint")
+            return ident == loop_thread and asyncio.iscoroutinefunction(endpoint)
+
+        return keep
+
+    @staticmethod
+    def _check_n_plus_one(record: RequestRecord) -> None:
+        for statement, count in record.statement_counts.items():
+            if count >= N_PLUS_ONE_THRESHOLD:
+                incr_metric("n_plus_one_warnings")
+                logger.warning("Possible N+1 in %s %s: statement ran %d times: %s",
+                               record.method, record.path, count, statement)
+
+    @staticmethod
+    def _log_slow(record: RequestRecord) -> None:
+        incr_metric("slow_requests")
+        sql_ms = sum(ms for _, ms in record.statements)
+        statements = "\n".join(f"  {ms:8.2f} ms  {sql}" for sql, ms in record.statements)
+        stacks = "\n".join(f"  {stack}" for stack in record.stacks) or "  (handler not on CPU when sampled)"
+        logger.warning(
+            "Slow request %s %s: %.1f ms total, %d statements, %.1f ms in SQL\n%s\nhandler stack:\n%s",
+            record.method, record.path, record.elapsed_ms, len(record.statements), sql_ms, statements, stacks,
+        )
@@ -0,0 +1,61 @@
+from collections import Counter
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter:
+    """
+    Count SQL statements executed on a set of engines while the context is active.
+
+    Usage:
+        with QueryCounter() as queries:
+            ...
+        assert queries.count <= 2, queries.report()
+    """
+
+    def __init__(self, *engines: Engine):
+        if not engines:
+            from app.db import engine, read_engines
+
+            engines = (engine, *read_engines)
+        self.engines = engines
+        self.statements: List[str] = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self) -> "QueryCounter":
+        for bind in self.engines:
+            event.listen(bind, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for bind in self.engines:
+            event.remove(bind, "before_cursor_execute", self._record)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def repeated(self, min_repeats: int = 2) -> Dict[str, int]:
+        """Statements executed at least `min_repeats` times; the usual N+1 signature."""
+        return repeated_statements(self.statements, min_repeats)
+
+    def report(self) -> str:
+        lines = [f"{self.count} statements:"]
+        lines += [f"  {i}. {sql}" for i, sql in enumerate(self.statements, 1)]
+        return "\n".join(lines)
+
+
+def repeated_statements(statements: List[str], min_repeats: int = 2) -> Dict[str, int]:
+    return {sql: n for sql, n in Counter(statements).items() if n >= min_repeats}
+
+
+def assert_max_queries(counter: QueryCounter, limit: int, n_plus_one: Optional[int] = None) -> None:
+    """Fail if more than `limit` statements ran, or any statement repeated `n_plus_one` times."""
+    assert counter.count <= limit, f"expected at most {limit} queries, got {counter.report()}"
+    if n_plus_one is not None:
+        repeated = counter.repeated(n_plus_one)
+        assert not repeated, f"possible N+1: {repeated}"
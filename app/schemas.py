@@ -1,7 +1,8 @@
-from pydantic import BaseModel, Field, EmailStr, field_validator, ValidationError, model_validator
+import os
+from pydantic import BaseModel, Field, EmailStr, TypeAdapter, model_validator
 from datetime import datetime
-from typing import Optional
-from app.models import CalculationType
+from typing import List, Optional, Union
+from app.models import AGGREGATE_TYPES, UNARY_TYPES, CalculationType
 
 
 class UserCreate(BaseModel):
@@ -27,53 +28,195 @@ class UserRead(BaseModel):
 
 class Token(BaseModel):
     access_token: str
+    refresh_token: Optional[str] = None
     token_type: str = "bearer"
 
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+# Longest operand list accepted inline; longer streams go through jobs or the CLI
+MAX_OPERANDS = int(os.getenv("MAX_OPERANDS", "100000"))
+
+
 class CalculationCreate(BaseModel):
-    a: float = Field(...)
-    b: float = Field(...)
+    a: Optional[float] = None
+    b: Optional[float] = None
+    # Enum coercion from "Add"/"Divide"/... happens in pydantic-core; no Python validator needed
     type: CalculationType = Field(...)
-
-    @field_validator("type")
-    def validate_type(cls, v):
-        if not isinstance(v, CalculationType):
-            # allow strings that match enum names/values
-            try:
-                return CalculationType(v)
-            except Exception as e:
-                raise ValidationError(f"Invalid calculation type: {v}") from e
-        return v
-
-    @field_validator("b")
-    def validate_divisor(cls, v, info):
-        # If type is Divide, b must not be zero. info is available in pydantic v2 via info
-        values = info.data if hasattr(info, "data") else {}
-        calc_type = values.get("type")
-        if calc_type == CalculationType.DIVIDE and v == 0:
-            raise ValueError("Division by zero is not allowed")
-        return v
+    operands: Optional[List[float]] = Field(None, max_length=MAX_OPERANDS)
+    # Owner; also picks the shard when calculations are sharded
+    user_id: Optional[int] = None
 
     @model_validator(mode="after")
-    def check_division(cls, model):
-        # cross-field validation after model is created
-        try:
-            calc_type = model.type
-            b = model.b
-        except Exception:
-            return model
-        if calc_type == CalculationType.DIVIDE and b == 0:
+    def check_operands(self):
+        # All cross-field rules in one pass after the fields are parsed
+        t = self.type
+        if t in AGGREGATE_TYPES:
+            if not self.operands:
+                raise ValueError(f"{t.value} requires a non-empty operands list")
+            if self.a is not None:
+                raise ValueError(f"{t.value} takes operands, not a")
+            if t is CalculationType.PERCENTILE:
+                if self.b is None or not 0 <= self.b <= 100:
+                    raise ValueError("Percentile requires b between 0 and 100")
+            elif self.b is not None:
+                raise ValueError(f"{t.value} takes operands, not b")
+            return self
+        if self.operands is not None:
+            raise ValueError(f"{t.value} does not take operands")
+        if self.a is None:
+            raise ValueError(f"{t.value} requires a")
+        if t in UNARY_TYPES:
+            if t is CalculationType.SQRT and self.b is not None:
+                raise ValueError("Sqrt takes only a")
+            return self
+        if self.b is None:
+            raise ValueError(f"{t.value} requires b")
+        if t is CalculationType.DIVIDE and self.b == 0:
             raise ValueError("Division by zero is not allowed")
-        return model
+        if t is CalculationType.MODULUS and self.b == 0:
+            raise ValueError("Modulus by zero is not allowed")
+        return self
 
 
 class CalculationRead(BaseModel):
     id: int
-    a: float
-    b: float
+    a: Optional[float] = None
+    b: Optional[float] = None
     type: CalculationType
+    operands: Optional[List[float]] = None
     result: Optional[float] = None
     user_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    # Current revision (see app.operations.revisions)
+    revision: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+class CalculationRevisionRead(BaseModel):
+    """One historical state of a calculation."""
+    revision: int
+    type: CalculationType
+    a: Optional[float] = None
+    b: Optional[float] = None
+    operands: Optional[List[float]] = None
+    result: Optional[float] = None
+    created_at: Optional[datetime] = None
+
+
+MAX_BULK_CALCULATIONS = int(os.getenv("MAX_BULK_CALCULATIONS", "10000"))
+
+
+class CalculationBulkCreate(BaseModel):
+    items: List[CalculationCreate] = Field(..., min_length=1, max_length=MAX_BULK_CALCULATIONS)
+
+
+class BulkInserted(BaseModel):
+    inserted: int
+
+
+class CalculationStats(BaseModel):
+    count: int
+    sum: float
+    mean: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    source: str = "database"
+
+
+class ComputeItem(BaseModel):
+    op: str = Field(..., description="Operation name: add, subtract, multiply, divide, power, modulus or log")
+    a: float = Field(..., description="The first number")
+    b: float = Field(..., description="The second number")
+
+
+class HotTuple(BaseModel):
+    type: CalculationType
+    a: float
+    b: Optional[float] = None
+    result: Optional[float] = None
+    count: int
+
+
+class ApproxDistinct(BaseModel):
+    type: Optional[CalculationType] = None
+    estimate: float
+    relative_error: float = Field(..., description="Standard error of the estimate, as a fraction")
+
+
+class HotPair(BaseModel):
+    type: CalculationType
+    a: float
+    b: Optional[float] = None
+    count_estimate: int
+
+
+class ApproxHotPairs(BaseModel):
+    items: List[HotPair]
+    total: int
+    error_bound: float = Field(..., description="Maximum overcount of any estimate")
+    confidence: float = Field(..., description="Probability that error_bound holds")
+
+
+class ApproxQuantile(BaseModel):
+    q: float
+    value: float
+    rank_error: float = Field(..., description="Approximate error in quantile rank")
+
+
+class ApproxQuantiles(BaseModel):
+    type: Optional[CalculationType] = None
+    count: int
+    quantiles: List[ApproxQuantile]
+
+
+# Bulk validators: one pydantic-core call per list instead of a model call per item
+CalculationCreateList = TypeAdapter(List[CalculationCreate])
+ComputeItemList = TypeAdapter(List[ComputeItem])
+
+
+def validate_calculations(data: Union[str, bytes, list]) -> List[CalculationCreate]:
+    """Validate many calculations at once from a JSON array (str/bytes) or a list of dicts."""
+    if isinstance(data, (str, bytes)):
+        return CalculationCreateList.validate_json(data)
+    return CalculationCreateList.validate_python(data)
+
+
+def validate_compute_items(data: Union[str, bytes, list]) -> List[ComputeItem]:
+    """Validate many compute items at once from a JSON array (str/bytes) or a list of dicts."""
+    if isinstance(data, (str, bytes)):
+        return ComputeItemList.validate_json(data)
+    return ComputeItemList.validate_python(data)
+
+
+JOB_MAX_ITEMS = 1_000_000
+
+
+class JobCreate(BaseModel):
+    """A background workload: either operation items or arithmetic expressions."""
+    items: Optional[List[ComputeItem]] = Field(None, max_length=JOB_MAX_ITEMS)
+    expressions: Optional[List[str]] = Field(None, max_length=JOB_MAX_ITEMS)
+
+    @model_validator(mode="after")
+    def check_one_workload(self):
+        if (self.items is None) == (self.expressions is None):
+            raise ValueError("Provide exactly one of items or expressions")
+        return self
+
+
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    status: str
+    total: int
+    completed: int
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
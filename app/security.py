@@ -1,23 +1,130 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional
+
+from app import tracing
 
 # Use pbkdf2_sha256 to avoid bcrypt's 72-byte limitation in tests/environments
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 # JWT Configuration
-SECRET_KEY = "your-secret-key-change-this-in-production"  # Should be in environment variable
+# Signs tokens only when no JWT_KEYS_FILE is configured (kid "default")
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+# Absolute session lifetime: refreshing never extends a login past this, counted from its auth_time
+SESSION_MAX_DAYS = int(os.getenv("SESSION_MAX_DAYS", "30"))
+# Expiries are spread by up to this fraction either way so renewals don't synchronise
+TOKEN_EXPIRY_JITTER = float(os.getenv("TOKEN_EXPIRY_JITTER", "0.1"))
+
+# Signing keys: JWT_KEYS_FILE holds {"kid": "secret", ...}; JWT_ACTIVE_KID picks the one used to sign.
+# Tokens signed with older kids stay valid while their key remains in the file. With a keys file,
+# SECRET_KEY is not trusted and tokens without a kid are rejected, so every key can be retired.
+JWT_KEYS_FILE = os.getenv("JWT_KEYS_FILE", "")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", "default")
+# An unknown kid triggers at most one key reload per this many seconds
+KEY_RELOAD_SECONDS = float(os.getenv("JWT_KEY_RELOAD_SECONDS", "30"))
+
+# Concurrent pbkdf2 hashes/verifications per process; further callers wait up to
+# PASSWORD_QUEUE_SECONDS, then get Overloaded so the API can shed load with 503
+MAX_PASSWORD_WORK = int(os.getenv("MAX_PASSWORD_WORK", "4"))
+PASSWORD_QUEUE_SECONDS = float(os.getenv("PASSWORD_QUEUE_SECONDS", "2"))
+
+
+class Overloaded(Exception):
+    """Raised when password hashing capacity is exhausted; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Authentication is temporarily overloaded")
+        self.retry_after = retry_after
+
+
+_password_slots = threading.BoundedSemaphore(MAX_PASSWORD_WORK)
+
+
+@contextmanager
+def password_work():
+    """Bound concurrent pbkdf2 work so login spikes queue briefly, then shed instead of piling up."""
+    if not _password_slots.acquire(timeout=PASSWORD_QUEUE_SECONDS):
+        # Jittered so shed clients don't all come back at the same moment
+        raise Overloaded(retry_after=random.randint(1, 5))
+    try:
+        yield
+    finally:
+        _password_slots.release()
 
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    with tracing.span("security.hash_password"), password_work():
+        return pwd_context.hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    with tracing.span("security.verify_password"), password_work():
+        return pwd_context.verify(plain_password, hashed_password)
+
+
+class KeyRing:
+    """Signing keys by kid, cached in memory and reloaded when an unknown kid shows up."""
+
+    def __init__(self, path: str = JWT_KEYS_FILE, active_kid: str = JWT_ACTIVE_KID):
+        self.path = path
+        self.active_kid = active_kid
+        self._keys: Dict[str, str] = {}
+        self._loaded_at = float("-inf")
+        self._lock = threading.Lock()
+        self.reload()
+
+    @property
+    def legacy_kid(self) -> Optional[str]:
+        """Kid assumed for tokens without one; only while signing with the built-in SECRET_KEY."""
+        return None if self.path else "default"
+
+    def reload(self) -> None:
+        if self.path:
+            with open(self.path) as f:
+                keys = json.load(f)
+        else:
+            keys = {"default": SECRET_KEY}
+        with self._lock:
+            self._keys = keys
+            self._loaded_at = time.monotonic()
+
+    def get(self, kid: str) -> Optional[str]:
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._loaded_at >= KEY_RELOAD_SECONDS:
+            self.reload()
+            key = self._keys.get(kid)
+        return key
+
+    def signing_key(self):
+        """(kid, secret) used for new tokens."""
+        return self.active_kid, self.get(self.active_kid)
+
+
+keyring = KeyRing()
+
+
+def jittered(lifetime: timedelta, jitter: Optional[float] = None) -> timedelta:
+    """Lifetime scaled by a random factor in [1 - jitter, 1 + jitter]."""
+    jitter = TOKEN_EXPIRY_JITTER if jitter is None else jitter
+    return lifetime * random.uniform(1 - jitter, 1 + jitter)
+
+
+def _encode(claims: dict) -> str:
+    kid, key = keyring.signing_key()
+    if key is None:
+        raise RuntimeError(f"No signing key for active kid {kid!r}")
+    return jwt.encode(claims, key, algorithm=ALGORITHM, headers={"kid": kid})
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -35,25 +142,53 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.utcnow() + jittered(timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    to_encode.update({"exp": expire, "type": "access"})
+    return _encode(to_encode)
+
+
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    """
+    Create a long-lived refresh token that can be exchanged for access tokens without a password.
 
+    Args:
+        data: Identity claims (sub, user_id, email) copied into issued access tokens, plus the
+            session claims sid, jti and auth_time (epoch seconds) from `users.start_session`
+        expires_delta: Optional expiration time delta
 
-def verify_token(token: str) -> Optional[dict]:
+    Returns:
+        Encoded JWT token string
+    """
+    to_encode = data.copy()
+    to_encode.setdefault("jti", uuid.uuid4().hex)
+    expire = datetime.utcnow() + (expires_delta or jittered(timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)))
+    if "auth_time" in to_encode:
+        expire = min(expire, datetime.utcfromtimestamp(to_encode["auth_time"]) + timedelta(days=SESSION_MAX_DAYS))
+    to_encode.update({"exp": expire, "type": "refresh"})
+    return _encode(to_encode)
+
+
+def verify_token(token: str, token_type: str = "access") -> Optional[dict]:
     """
     Verify and decode a JWT token.
     
     Args:
         token: JWT token string to verify
+        token_type: Expected "type" claim; tokens issued before refresh support count as access
         
     Returns:
         Decoded token payload if valid, None otherwise
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        kid = jwt.get_unverified_header(token).get("kid", keyring.legacy_kid)
+        # The header isn't verified yet, so kid may be any JSON value
+        key = keyring.get(kid) if isinstance(kid, str) else None
+        if key is None:
+            return None
+        payload = jwt.decode(token, key, algorithms=[ALGORITHM])
     except JWTError:
         return None
+    if payload.get("type", "access") != token_type:
+        return None
+    return payload
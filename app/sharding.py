@@ -0,0 +1,334 @@
+"""
+Optional horizontal sharding of calculations across several databases.
+
+Set CALCULATION_SHARD_URLS to a comma-separated list of database URLs, for
+example ``sqlite:///./shard0.sqlite,sqlite:///./shard1.sqlite``. The
+``calculations``, ``calculation_operands`` and ``calculation_revisions``
+tables then live in those databases. Everything else (users, jobs,
+sketches) stays on DATABASE_URL.
+
+- A calculation goes to the shard picked by a stable hash of its
+  ``user_id``. Rows without an owner are spread round-robin.
+- Ids are snowflake-style and globally unique. From the high bits down they
+  hold milliseconds since SNOWFLAKE_EPOCH_MS, the shard, the generating
+  worker and a per-millisecond sequence. ``shard_of(id)`` locates a row
+  without a lookup table, and ordering by id is (nearly) time ordering on
+  every shard.
+- Two processes must never share a worker id. Each process leases one from
+  the ``snowflake_leases`` table on DATABASE_URL (see ``WorkerLease``), or
+  SNOWFLAKE_WORKER_ID pins it for deployments that assign ids per process.
+- Browsing scatters one id-ordered query per shard and merges the streams by
+  id. Stats, bulk deletes and hot tuples are computed per shard and
+  combined.
+
+Adding a shard changes where new user_ids hash to. Existing rows stay
+findable by id, but per-user locality only holds for rows written after the
+change.
+"""
+
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from sqlalchemy import MetaData, delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.db import SQLITE_TUNED, RoutingSession, SessionLocal, WriteQueue, make_engine
+from app.migrations import upgrade
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+CALCULATION_SHARD_URLS = [u.strip() for u in os.getenv("CALCULATION_SHARD_URLS", "").split(",") if u.strip()]
+
+SNOWFLAKE_EPOCH_MS = int(os.getenv("SNOWFLAKE_EPOCH_MS", "1735689600000"))  # 2025-01-01T00:00:00Z
+SHARD_BITS = 6
+WORKER_BITS = 6
+SEQUENCE_BITS = 10
+MAX_SHARDS = 1 << SHARD_BITS
+MAX_WORKERS = 1 << WORKER_BITS
+# Fixed worker id for this process; it must differ from every other process's. Unset, one is leased.
+SNOWFLAKE_WORKER_ID = os.getenv("SNOWFLAKE_WORKER_ID")
+SNOWFLAKE_LEASE_SECONDS = float(os.getenv("SNOWFLAKE_LEASE_SECONDS", "60"))
+
+
+class Snowflake:
+    """Time-ordered 63-bit ids: timestamp | shard | worker | sequence."""
+
+    def __init__(self, worker_id: int, epoch_ms: int = SNOWFLAKE_EPOCH_MS):
+        if not 0 <= worker_id < MAX_WORKERS:
+            raise ValueError(f"worker_id must be below {MAX_WORKERS}")
+        self.worker_id = worker_id
+        self.epoch_ms = epoch_ms
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self, shard: int) -> int:
+        if not 0 <= shard < MAX_SHARDS:
+            raise ValueError(f"shard must be below {MAX_SHARDS}")
+        with self._lock:
+            # Never step backwards, even if the wall clock does
+            now = max(time.time_ns() // 1_000_000 - self.epoch_ms, self._last_ms)
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+                if self._sequence == 0:  # sequence exhausted for this millisecond
+                    now = self._last_ms + 1
+                    while time.time_ns() // 1_000_000 - self.epoch_ms < now:
+                        time.sleep(0.0001)
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (((now << SHARD_BITS | shard) << WORKER_BITS | self.worker_id) << SEQUENCE_BITS) | self._sequence
+
+
+class WorkerLease:
+    """
+    A snowflake worker id no other live process holds, leased in the main database.
+
+    The search starts at a hash of the host name and pid and takes the first
+    id whose row is missing or expired. A background thread renews the lease
+    every third of its lifetime. If a renewal finds the row taken over (this
+    process stalled past the expiry), a fresh id is leased.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal,
+                 ttl: float = SNOWFLAKE_LEASE_SECONDS, owner: Optional[str] = None):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._worker_id: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _claim(self, db: Session, worker_id: int) -> bool:
+        from app import models
+
+        L = models.SnowflakeLease
+        now = datetime.now(timezone.utc)
+        expires = now + timedelta(seconds=self.ttl)
+        taken = db.execute(
+            update(L).where(L.worker_id == worker_id, or_(L.expires_at < now, L.owner == self.owner))
+            .values(owner=self.owner, expires_at=expires),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        try:
+            if not taken:
+                db.add(L(worker_id=worker_id, owner=self.owner, expires_at=expires))
+            db.commit()
+        except IntegrityError:  # held by a live process
+            db.rollback()
+            return False
+        return True
+
+    def acquire(self) -> int:
+        host = f"{socket.gethostname()}:{os.getpid()}"
+        start = int.from_bytes(hashlib.blake2b(host.encode(), digest_size=8).digest(), "big") % MAX_WORKERS
+        db = self.session_factory()
+        try:
+            for offset in range(MAX_WORKERS):
+                worker_id = (start + offset) % MAX_WORKERS
+                if self._claim(db, worker_id):
+                    logger.info("Leased snowflake worker id %d", worker_id)
+                    return worker_id
+        finally:
+            db.close()
+        raise RuntimeError(f"All {MAX_WORKERS} snowflake worker ids are leased")
+
+    def worker_id(self) -> int:
+        """This process's worker id, leasing one (and starting renewals) on first use."""
+        if self._worker_id is None:
+            with self._lock:
+                if self._worker_id is None:
+                    self._worker_id = self.acquire()
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="snowflake-lease", daemon=True)
+                    self._thread.start()
+        return self._worker_id
+
+    def renew(self) -> None:
+        from app import models
+
+        L = models.SnowflakeLease
+        db = self.session_factory()
+        try:
+            renewed = db.execute(
+                update(L).where(L.worker_id == self._worker_id, L.owner == self.owner)
+                .values(expires_at=datetime.now(timezone.utc) + timedelta(seconds=self.ttl)),
+                execution_options={"synchronize_session": False},
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        if not renewed:
+            logger.warning("Snowflake worker id %d was taken over; leasing another", self._worker_id)
+            self._worker_id = self.acquire()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except Exception:
+                logger.exception("Snowflake lease renewal failed")
+
+    def release(self) -> None:
+        """Stop renewing and free the id for the next process."""
+        from app import models
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._worker_id is None:
+            return
+        L = models.SnowflakeLease
+        db = self.session_factory()
+        try:
+            db.execute(delete(L).where(L.worker_id == self._worker_id, L.owner == self.owner))
+            db.commit()
+        finally:
+            db.close()
+        self._worker_id = None
+
+
+lease = WorkerLease() if SNOWFLAKE_WORKER_ID is None else None
+snowflake = Snowflake(0 if SNOWFLAKE_WORKER_ID is None else int(SNOWFLAKE_WORKER_ID))
+
+
+def shard_of(calc_id: int) -> int:
+    """Shard encoded in a snowflake id."""
+    return (calc_id >> (WORKER_BITS + SEQUENCE_BITS)) & (MAX_SHARDS - 1)
+
+
+def _shard_metadata() -> MetaData:
+    """Calculation tables without their foreign key to users, which stay in the main database."""
+    from app import models
+
+    metadata = MetaData()
+    for table in (models.CalculationOperands.__table__, models.Calculation.__table__,
+                  models.CalculationRevision.__table__):
+        copy = table.to_metadata(metadata)
+        for fk in list(copy.foreign_key_constraints):
+            if any(element.target_fullname.startswith("users.") for element in fk.elements):
+                copy.constraints.discard(fk)
+                for element in fk.elements:
+                    copy.foreign_keys.discard(element)
+                    element.parent.foreign_keys.discard(element)
+    return metadata
+
+
+class ShardSet:
+    """Engines and session factories for each calculation shard."""
+
+    def __init__(self, urls: Sequence[str]):
+        if len(urls) > MAX_SHARDS:
+            raise ValueError(f"At most {MAX_SHARDS} shards are supported")
+        self.engines = [make_engine(url) for url in urls]
+        self.factories = [
+            sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine,
+                         class_=RoutingSession,
+                         write_queue=WriteQueue() if SQLITE_TUNED and url.startswith("sqlite") else None)
+            for url, engine in zip(urls, self.engines)
+        ]
+        self._round_robin = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def create_all(self) -> None:
+        metadata = _shard_metadata()
+        for engine in self.engines:
+            metadata.create_all(bind=engine)
+            # Shards created by an earlier version need the same column upgrades as the main database
+            upgrade(engine)
+
+    def dispose(self) -> None:
+        for engine in self.engines:
+            engine.dispose()
+
+    def session(self, shard: int) -> Session:
+        db = self.factories[shard]()
+        db.info["shard"] = shard
+        return db
+
+    def shard_for_user(self, user_id: Optional[int]) -> int:
+        if user_id is None:
+            return next(self._round_robin) % len(self)
+        digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % len(self)
+
+    def scatter(self, fn: Callable[[Session], T]) -> List[T]:
+        """Run `fn` with a session on every shard concurrently; results in shard order."""
+        def run(shard: int) -> T:
+            db = self.session(shard)
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        with ThreadPoolExecutor(max_workers=len(self), thread_name_prefix="shard") as pool:
+            return list(pool.map(run, range(len(self))))
+
+
+shards = ShardSet(CALCULATION_SHARD_URLS)
+SHARDED = len(shards) > 0
+
+
+def session_for_user(user_id: Optional[int]) -> Session:
+    """Session for the shard owning `user_id`'s new calculations, or the main database."""
+    return shards.session(shards.shard_for_user(user_id)) if SHARDED else SessionLocal()
+
+
+def session_for_id(calc_id: int) -> Session:
+    """Session for the shard holding calculation `calc_id`, or the main database."""
+    if not SHARDED:
+        return SessionLocal()
+    shard = shard_of(calc_id)
+    # Shard bits past the configured shards (e.g. ids from before sharding) fall back to shard 0
+    return shards.session(shard if shard < len(shards) else 0)
+
+
+def new_id(db: Session) -> Optional[int]:
+    """Snowflake id for a row inserted through a shard session; None lets the database assign one."""
+    shard = db.info.get("shard")
+    if shard is None:
+        return None
+    if lease is not None:
+        snowflake.worker_id = lease.worker_id()
+    return snowflake.next_id(shard)
+
+
+def group_by_shard(items: Iterable[T], user_id: Callable[[T], Optional[int]]) -> Dict[int, List[Tuple[int, T]]]:
+    """(input position, item) pairs per destination shard."""
+    groups: Dict[int, List[Tuple[int, T]]] = {}
+    for position, item in enumerate(items):
+        groups.setdefault(shards.shard_for_user(user_id(item)), []).append((position, item))
+    return groups
+
+
+def gather_rows(rows_factory: Callable[[Session], Iterator], skip: int = 0,
+                limit: Optional[int] = None) -> Iterator:
+    """
+    Merge the id-ordered row streams `rows_factory` yields on each shard.
+
+    Each shard's stream is consumed lazily, so memory stays flat. For
+    offset paging, each shard must return its first skip + limit rows; the
+    offset is applied here, after the merge.
+    """
+    with ExitStack() as stack:
+        streams = [rows_factory(stack.enter_context(shards.session(shard))) for shard in range(len(shards))]
+        merged = heapq.merge(*streams, key=lambda row: row.id)
+        yield from itertools.islice(merged, skip, None if limit is None else skip + limit)
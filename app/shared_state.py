@@ -0,0 +1,350 @@
+"""
+Key-value state shared by all uvicorn worker processes on one host.
+
+`uvicorn --workers N` runs N independent processes, so module-level caches and
+counters are split N ways. Code that needs a consistent view (counters, small
+cached values, timestamps) goes through `get_backend()` instead:
+
+- ``LocalBackend``: a dict guarded by a lock; correct for a single process.
+- ``SharedMemoryBackend``: a fixed-size open-addressing hash table in a
+  ``multiprocessing.shared_memory`` segment, serialised across processes with
+  ``fcntl.flock``. No server process is needed. The segment lives as long as
+  some process has it open, so a restart starts from empty state.
+
+SHARED_STATE_BACKEND selects the backend (``local`` or ``shm``). Anything that
+implements ``StateBackend`` (e.g. a Redis adapter) can be installed with
+``set_backend``.
+"""
+
+import fcntl
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Iterator, Optional, Tuple
+
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "local")
+SHARED_STATE_NAME = os.getenv("SHARED_STATE_NAME", "calculator_state")
+SHARED_STATE_SLOTS = int(os.getenv("SHARED_STATE_SLOTS", "4096"))
+SHARED_STATE_SLOT_SIZE = int(os.getenv("SHARED_STATE_SLOT_SIZE", "256"))
+
+
+class StateBackend(ABC):
+    """Interface for shared state. Values are bytes; counters are signed 64-bit ints."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1) -> int:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def items(self, prefix: str = "") -> Iterator[Tuple[str, bytes]]:
+        ...
+
+    def close(self) -> None:
+        """Release the backend's resources on shutdown."""
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        value = self.get(key)
+        return default if value is None else decode_int(value)
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        value = self.get(key)
+        return default if value is None else struct.unpack("<d", value)[0]
+
+    def set_float(self, key: str, value: float, ttl: Optional[float] = None) -> None:
+        self.set(key, struct.pack("<d", value), ttl)
+
+
+def encode_int(value: int) -> bytes:
+    return struct.pack("<q", value)
+
+
+def decode_int(value: bytes) -> int:
+    return struct.unpack("<q", value)[0]
+
+
+class LocalBackend(StateBackend):
+    """In-process backend; the default for single-worker runs and tests."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            current = self._live(key)
+            value = (decode_int(current) if current is not None else 0) + amount
+            self._data[key] = (encode_int(value), None)
+            return value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def items(self, prefix: str = "") -> Iterator[Tuple[str, bytes]]:
+        with self._lock:
+            keys = [k for k in self._data if k.startswith(prefix)]
+            pairs = [(k, self._live(k)) for k in keys]
+        return iter([(k, v) for k, v in pairs if v is not None])
+
+
+# Slot layout: state, key length, value length, expiry (0 = never), then key and value bytes
+_HEADER = struct.Struct("<BHHd")
+_EMPTY, _USED, _DELETED = 0, 1, 2
+
+
+class SharedMemoryBackend(StateBackend):
+    """
+    Fixed-capacity hash table in POSIX shared memory.
+
+    The first process to start creates the segment; the others attach to it.
+    Writes take an exclusive ``flock`` on a lock file (plus a thread lock, since
+    flock is per open file, not per thread); reads take a shared one.
+
+    Every attached process also holds a shared ``flock`` on a second, users
+    file for as long as it has the segment open. Whoever can take that lock
+    exclusively is the only user: on close it removes the segment, and on
+    start it treats an existing segment as left over (from a crash) and
+    clears it, so no state survives a restart.
+    """
+
+    def __init__(self, name: str = SHARED_STATE_NAME, slots: int = SHARED_STATE_SLOTS,
+                 slot_size: int = SHARED_STATE_SLOT_SIZE):
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_payload = slot_size - _HEADER.size
+        self._thread_lock = threading.Lock()
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a+b")
+        self._users_file = open(os.path.join(tempfile.gettempdir(), f"{name}.users"), "a+b")
+        size = slots * slot_size
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                self._shm = self._create(size)
+            except FileExistsError:
+                self._shm = shared_memory.SharedMemory(name=name)
+                if self._only_user():
+                    # No process has it open: left over from a crash, possibly with another layout
+                    self._shm.close()
+                    self._shm.unlink()
+                    self._shm = self._create(size)
+                elif self._shm.size < size:
+                    self._shm.close()
+                    raise ValueError(f"Shared state segment {name} is in use with a smaller size")
+            fcntl.flock(self._users_file, fcntl.LOCK_SH)
+        # Workers share the segment; the resource tracker would unlink it when the first one exits
+        try:
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        except Exception:  # pragma: no cover - tracker implementation detail
+            pass
+
+    @contextmanager
+    def _locked(self, mode: int):
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _create(self, size: int) -> shared_memory.SharedMemory:
+        shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        shm.buf[:size] = bytes(size)
+        return shm
+
+    def _only_user(self) -> bool:
+        """Whether no other process has the segment open; call with the exclusive lock held."""
+        try:
+            fcntl.flock(self._users_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def close(self) -> None:
+        """Detach from the segment; the last process to close removes it."""
+        with self._locked(fcntl.LOCK_EX):
+            last = self._only_user()
+            self._shm.close()
+            if last:
+                self.unlink()
+            fcntl.flock(self._users_file, fcntl.LOCK_UN)
+        self._users_file.close()
+        self._lock_file.close()
+
+    def unlink(self) -> None:
+        """Remove the segment even while other processes use it; they keep their mapping."""
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _read_slot(self, index: int):
+        offset = index * self.slot_size
+        state, key_len, value_len, expires = _HEADER.unpack_from(self._shm.buf, offset)
+        start = offset + _HEADER.size
+        key = bytes(self._shm.buf[start:start + key_len])
+        value = bytes(self._shm.buf[start + key_len:start + key_len + value_len])
+        return state, key, value, expires
+
+    def _write_slot(self, index: int, state: int, key: bytes = b"", value: bytes = b"",
+                    expires: float = 0.0) -> None:
+        offset = index * self.slot_size
+        _HEADER.pack_into(self._shm.buf, offset, state, len(key), len(value), expires)
+        start = offset + _HEADER.size
+        self._shm.buf[start:start + len(key) + len(value)] = key + value
+
+    def _probe(self, key: bytes):
+        """Return (index of key or None, first reusable index or None)."""
+        start = zlib.crc32(key) % self.slots
+        free = None
+        now = time.time()
+        for i in range(self.slots):
+            index = (start + i) % self.slots
+            state, slot_key, _, expires = self._read_slot(index)
+            if state == _EMPTY:
+                return None, free if free is not None else index
+            if state == _USED and slot_key == key:
+                if expires and expires <= now:
+                    self._write_slot(index, _DELETED)
+                    return None, free if free is not None else index
+                return index, None
+            if free is None and (state == _DELETED or (expires and expires <= now)):
+                free = index
+        return None, free
+
+    def _encode_key(self, key: str, value_len: int = 8) -> bytes:
+        raw = key.encode("utf-8")
+        if len(raw) + value_len > self.max_payload:
+            raise ValueError(f"Key and value exceed {self.max_payload} bytes: {key!r}")
+        return raw
+
+    def get(self, key: str) -> Optional[bytes]:
+        raw = key.encode("utf-8")
+        with self._locked(fcntl.LOCK_SH):
+            start = zlib.crc32(raw) % self.slots
+            now = time.time()
+            for i in range(self.slots):
+                state, slot_key, value, expires = self._read_slot((start + i) % self.slots)
+                if state == _EMPTY:
+                    return None
+                if state == _USED and slot_key == raw:
+                    return None if expires and expires <= now else value
+        return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        raw = self._encode_key(key, len(value))
+        with self._locked(fcntl.LOCK_EX):
+            index, free = self._probe(raw)
+            target = index if index is not None else free
+            if target is None:
+                raise MemoryError("Shared state table is full")
+            self._write_slot(target, _USED, raw, value, time.time() + ttl if ttl else 0.0)
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        raw = self._encode_key(key)
+        with self._locked(fcntl.LOCK_EX):
+            index, free = self._probe(raw)
+            current = 0
+            if index is not None:
+                current = decode_int(self._read_slot(index)[2])
+            target = index if index is not None else free
+            if target is None:
+                raise MemoryError("Shared state table is full")
+            value = current + amount
+            self._write_slot(target, _USED, raw, encode_int(value))
+            return value
+
+    def delete(self, key: str) -> None:
+        raw = key.encode("utf-8")
+        with self._locked(fcntl.LOCK_EX):
+            index, _ = self._probe(raw)
+            if index is not None:
+                self._write_slot(index, _DELETED)
+
+    def items(self, prefix: str = "") -> Iterator[Tuple[str, bytes]]:
+        raw_prefix = prefix.encode("utf-8")
+        now = time.time()
+        found = []
+        with self._locked(fcntl.LOCK_SH):
+            for index in range(self.slots):
+                state, key, value, expires = self._read_slot(index)
+                if state == _USED and key.startswith(raw_prefix) and not (expires and expires <= now):
+                    found.append((key.decode("utf-8"), value))
+        return iter(found)
+
+
+_backend: Optional[StateBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StateBackend:
+    """Return the process-wide backend, creating it from SHARED_STATE_BACKEND on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if SHARED_STATE_BACKEND == "shm":
+                    _backend = SharedMemoryBackend()
+                elif SHARED_STATE_BACKEND == "local":
+                    _backend = LocalBackend()
+                else:
+                    raise ValueError(f"Unknown SHARED_STATE_BACKEND: {SHARED_STATE_BACKEND}")
+    return _backend
+
+
+def close_backend() -> None:
+    """Close the process-wide backend on shutdown; the next get_backend() opens a new one."""
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+            _backend = None
+
+
+def set_backend(backend: StateBackend) -> None:
+    """Install a custom backend, e.g. one backed by an external store."""
+    global _backend
+    _backend = backend
+
+
+def incr_metric(name: str, amount: int = 1) -> int:
+    return get_backend().incr(f"metric:{name}", amount)
+
+
+def metrics() -> Dict[str, int]:
+    return {key[len("metric:"):]: decode_int(value) for key, value in get_backend().items("metric:")}
@@ -0,0 +1,400 @@
+"""
+Approximate analytics over calculations, backed by sketches maintained on writes.
+
+Exact aggregates over hundreds of millions of rows are too slow for
+dashboards. Each worker keeps fixed-size sketches updated on every insert:
+
+- ``HyperLogLog`` per calculation type: distinct users. Standard error is
+  1.04 / sqrt(2**precision).
+- ``CountMinSketch`` over (type, a, b) plus a bounded candidate set: hot
+  operand pairs. Estimates never undercount. With probability 1 - e**-depth
+  they overcount by at most e / width * N.
+- ``TDigest`` per type (from ``app.operations.statistics``): result quantiles.
+
+All three merge losslessly: max of registers, sum of counters, and union of
+centroids. A background flusher writes each worker's cumulative sketches to
+one ``analytics_sketches`` row per worker, and touches the row on every tick
+while the worker is alive. Rows that stop being touched for
+SKETCH_STALE_SECONDS belong to stopped workers: at start and on each tick
+they are merged into a single ``folded`` row and deleted, so the table holds
+one row per live worker plus one, however often workers restart. Readers merge
+every row with the live local state. Sketches see inserts only, so updates and
+deletes are not reflected. ``rebuild`` recomputes them from a full table scan.
+
+Enable with ANALYTICS_SKETCHES=1.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import uuid
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import dedup, models
+from app.operations.statistics import TDigest
+from app.shared_state import get_backend
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_SKETCHES = os.getenv("ANALYTICS_SKETCHES", "0") == "1"
+SKETCH_FLUSH_SECONDS = float(os.getenv("SKETCH_FLUSH_SECONDS", "10"))
+# A worker's row untouched for this long is folded; keep it well above SKETCH_FLUSH_SECONDS
+SKETCH_STALE_SECONDS = float(os.getenv("SKETCH_STALE_SECONDS", "300"))
+HLL_PRECISION = int(os.getenv("SKETCH_HLL_PRECISION", "12"))
+CMS_WIDTH = int(os.getenv("SKETCH_CMS_WIDTH", "2048"))
+CMS_DEPTH = int(os.getenv("SKETCH_CMS_DEPTH", "5"))
+HOT_CANDIDATES = int(os.getenv("SKETCH_HOT_CANDIDATES", "256"))
+
+GENERATION_KEY = "sketches:generation"
+
+
+def _hash64(value: str, seed: int = 0) -> int:
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8, salt=seed.to_bytes(8, "little")).digest()
+    return int.from_bytes(digest, "little")
+
+
+class HyperLogLog:
+    """Distinct-count sketch with 2**precision one-byte registers."""
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value: str) -> None:
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> float:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are empty
+            return m * math.log(m / zeros)
+        return estimate
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+
+class CountMinSketch:
+    """Frequency sketch: `depth` rows of `width` counters; estimates never undercount."""
+
+    def __init__(self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH, counts: Optional[array] = None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array("q", [0]) * (width * depth)
+        self.total = 0
+
+    def _cells(self, key: str) -> List[int]:
+        h = _hash64(key, seed=1)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key: str, n: int = 1) -> int:
+        """Count `key` and return its new estimate."""
+        cells = self._cells(key)
+        for cell in cells:
+            self.counts[cell] += n
+        self.total += n
+        return min(self.counts[cell] for cell in cells)
+
+    def estimate(self, key: str) -> int:
+        return min(self.counts[cell] for cell in self._cells(key))
+
+    @property
+    def error_bound(self) -> float:
+        """Maximum overcount, holding with probability `confidence`."""
+        return math.e / self.width * self.total
+
+    @property
+    def confidence(self) -> float:
+        return 1 - math.exp(-self.depth)
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge count-min sketches of different shape")
+        for i, value in enumerate(other.counts):
+            if value:
+                self.counts[i] += value
+        self.total += other.total
+        return self
+
+
+def _pair_key(calc_type: str, a, b) -> str:
+    return json.dumps([calc_type, a, b])
+
+
+class SketchSet:
+    """Every sketch one worker maintains, with (de)serialisation for the shard table."""
+
+    def __init__(self):
+        self.users: Dict[str, HyperLogLog] = {}
+        self.pairs = CountMinSketch()
+        # Candidate hot keys; bounded, so light keys are evicted as heavier ones arrive
+        self.candidates: Dict[str, int] = {}
+        self.results: Dict[str, TDigest] = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+
+    def observe(self, calc_type: str, a, b, result, user_id) -> None:
+        with self.lock:
+            if user_id is not None:
+                self.users.setdefault(calc_type, HyperLogLog()).add(str(user_id))
+            if a is not None:
+                key = _pair_key(calc_type, a, b)
+                self._offer(key, self.pairs.add(key))
+            if result is not None and math.isfinite(result):
+                self.results.setdefault(calc_type, TDigest()).add(result)
+            self.dirty = True
+
+    def _offer(self, key: str, estimate: int) -> None:
+        if key in self.candidates or len(self.candidates) < HOT_CANDIDATES:
+            self.candidates[key] = estimate
+            return
+        lightest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[lightest]:
+            del self.candidates[lightest]
+            self.candidates[key] = estimate
+
+    def merge(self, other: "SketchSet") -> "SketchSet":
+        for calc_type, hll in other.users.items():
+            self.users.setdefault(calc_type, HyperLogLog(hll.precision)).merge(hll)
+        self.pairs.merge(other.pairs)
+        for key in other.candidates:
+            self.candidates.setdefault(key, 0)
+        for calc_type, digest in other.results.items():
+            self.results.setdefault(calc_type, TDigest(digest.compression)).merge(digest)
+        return self
+
+    def hot_pairs(self, calc_type: Optional[str] = None, limit: int = 10) -> List[Tuple[list, int]]:
+        ranked = []
+        for key in self.candidates:
+            pair = json.loads(key)
+            if calc_type is None or pair[0] == calc_type:
+                ranked.append((pair, self.pairs.estimate(key)))
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+    def to_bytes(self) -> bytes:
+        with self.lock:
+            for digest in self.results.values():
+                digest._compress()
+            state = {
+                "hll": {t: [h.precision, base64.b64encode(bytes(h.registers)).decode()] for t, h in self.users.items()},
+                "cms": [self.pairs.width, self.pairs.depth, self.pairs.total,
+                        base64.b64encode(self.pairs.counts.tobytes()).decode()],
+                "candidates": list(self.candidates),
+                "tdigest": {t: [d.compression, d.means, d.weights, d.count, d.min, d.max]
+                            for t, d in self.results.items()},
+            }
+        return zlib.compress(json.dumps(state).encode())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SketchSet":
+        state = json.loads(zlib.decompress(data))
+        sketches = cls()
+        for calc_type, (precision, registers) in state["hll"].items():
+            sketches.users[calc_type] = HyperLogLog(precision, base64.b64decode(registers))
+        width, depth, total, counts = state["cms"]
+        sketches.pairs = CountMinSketch(width, depth, array("q", base64.b64decode(counts)))
+        sketches.pairs.total = total
+        sketches.candidates = {key: 0 for key in state["candidates"]}
+        for calc_type, (compression, means, weights, count, low, high) in state["tdigest"].items():
+            digest = TDigest(compression)
+            digest.means, digest.weights, digest.count, digest.min, digest.max = means, weights, count, low, high
+            sketches.results[calc_type] = digest
+        return sketches
+
+
+# Identifies this worker's row; unique per process start
+SHARD = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+# Merged sketches of every stopped worker
+FOLDED_SHARD = "folded"
+
+local = SketchSet()
+_generation = 0
+
+
+def _sync_generation() -> None:
+    """Drop local state superseded by a rebuild in any worker."""
+    global local, _generation
+    generation = get_backend().get_int(GENERATION_KEY)
+    if generation != _generation:
+        local = SketchSet()
+        _generation = generation
+
+
+def on_insert(calc: models.Calculation) -> None:
+    """Write-path hook for inserted rows."""
+    if not ANALYTICS_SKETCHES or calc is None:
+        return
+    local.observe(calc.type.value, calc.a, calc.b, calc.result, calc.user_id)
+
+
+def flush(db: Session, shard: str = SHARD) -> bool:
+    """Persist this worker's sketches if they changed since the last flush, else mark the row as alive."""
+    _sync_generation()
+    if not local.dirty:
+        S = models.AnalyticsSketch
+        db.execute(update(S).where(S.shard == shard).values(updated_at=func.now()),
+                   execution_options={"synchronize_session": False})
+        db.commit()
+        return False
+    local.dirty = False
+    data = local.to_bytes()
+    row = db.get(models.AnalyticsSketch, shard)
+    if row is None:
+        db.add(models.AnalyticsSketch(shard=shard, data=data))
+    else:
+        row.data = data
+    db.commit()
+    return True
+
+
+def fold_stale(db: Session, stale_seconds: float = SKETCH_STALE_SECONDS) -> int:
+    """Merge the rows of workers that stopped flushing into the folded row. Returns the number folded."""
+    S = models.AnalyticsSketch
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+    stale = db.execute(select(S.shard, S.data).where(S.updated_at < cutoff, S.shard != FOLDED_SHARD)).all()
+    if not stale:
+        return 0
+    try:
+        for row in stale:
+            # Zero rows means another worker folded it first, or its worker was alive after all
+            gone = db.execute(delete(S).where(S.shard == row.shard, S.updated_at < cutoff),
+                              execution_options={"synchronize_session": False}).rowcount
+            if gone != 1:
+                db.rollback()
+                return 0
+        # Locked, so concurrent folds of other rows queue up instead of overwriting each other
+        folded = db.get(S, FOLDED_SHARD, with_for_update=True, populate_existing=True)
+        combined = SketchSet.from_bytes(folded.data) if folded is not None else SketchSet()
+        for row in stale:
+            combined.merge(SketchSet.from_bytes(row.data))
+        if folded is None:
+            db.add(S(shard=FOLDED_SHARD, data=combined.to_bytes()))
+        else:
+            folded.data = combined.to_bytes()
+        db.commit()
+    except IntegrityError:  # another worker created the folded row first; retry on the next tick
+        db.rollback()
+        return 0
+    logger.info("Folded %d stale sketch rows", len(stale))
+    return len(stale)
+
+
+def merged(db: Session, shard: str = SHARD) -> SketchSet:
+    """Every worker's persisted sketches merged with this worker's live state."""
+    _sync_generation()
+    combined = SketchSet()
+    for row_shard, data in db.execute(select(models.AnalyticsSketch.shard, models.AnalyticsSketch.data)):
+        if row_shard != shard:
+            combined.merge(SketchSet.from_bytes(data))
+    current = local
+    with current.lock:
+        combined.merge(current)
+    return combined
+
+
+def rebuild(db: Session, chunk_size: int = 1000) -> int:
+    """
+    Replace every worker's sketches with ones built from a scan of the calculations table.
+
+    Other workers discard their local state at their next flush or read.
+    Anything they observed in between is lost, so the counts are approximate.
+    """
+    global local, _generation
+    _, a, b, type_, _, result, user_id, _, _ = dedup.calculation_columns()
+    rows = db.execute(
+        dedup.calculation_select(type_, a, b, result, user_id).execution_options(yield_per=chunk_size)
+    )
+    fresh = SketchSet()
+    n = 0
+    for calc_type, a, b, result, user_id in rows:
+        fresh.observe(calc_type.value, a, b, result, user_id)
+        n += 1
+    db.execute(delete(models.AnalyticsSketch))
+    db.commit()
+    _generation = get_backend().incr(GENERATION_KEY)
+    local = fresh
+    flush(db)
+    return n
+
+
+def quantile_rank_error(digest: TDigest, q: float) -> float:
+    """Approximate rank error at q: half a k1-scale centroid width."""
+    return math.pi / digest.compression * math.sqrt(q * (1 - q)) + 1 / max(digest.count, 1)
+
+
+class SketchFlusher:
+    """Background thread flushing the local sketches every SKETCH_FLUSH_SECONDS."""
+
+    def __init__(self, session_factory, interval: float = SKETCH_FLUSH_SECONDS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _flush_once(self) -> None:
+        db = self.session_factory()
+        try:
+            flush(db)
+        except Exception:
+            local.dirty = True
+            logger.exception("Sketch flush failed")
+        finally:
+            db.close()
+        self._fold_once()
+
+    def _fold_once(self) -> None:
+        db = self.session_factory()
+        try:
+            fold_stale(db)
+        except Exception:
+            logger.exception("Folding stale sketches failed")
+        finally:
+            db.close()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._flush_once()
+
+    def start(self) -> "SketchFlusher":
+        self._stop.clear()
+        self._fold_once()
+        self._thread = threading.Thread(target=self._run, name="sketch-flusher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._flush_once()
@@ -0,0 +1,460 @@
+"""
+Lightweight request tracing with local span export.
+
+With TRACING=1 every HTTP request becomes a trace. It contains these spans:
+
+- ``http.request``: the root, covering middleware, routing and sending.
+- ``http.validate``: body parsing, dependency and parameter validation.
+- ``http.handler``: the route function itself.
+- ``http.serialize``: response-model validation and JSON encoding.
+- ``db.query``: one per SQL statement, from SQLAlchemy cursor events.
+- Anything wrapped with ``span``/``traced``, such as password hashing and
+  ``compute_result``.
+
+An incoming W3C ``traceparent`` header is continued, and each response
+carries a ``traceparent`` header of its own. Finished traces go to the
+exporters named in TRACE_EXPORT:
+
+- ``memory``: a ring buffer of the last TRACE_BUFFER_SIZE traces, served by
+  ``/admin/traces``.
+- ``file``: JSON lines at TRACE_FILE, rotated at TRACE_FILE_MAX_BYTES. Each
+  line is an OTLP/JSON ``ExportTraceServiceRequest``, so the OpenTelemetry
+  collector's ``otlpjsonfile`` receiver and similar tools can ingest it.
+
+When no trace is active, ``span`` costs one ContextVar lookup.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+TRACING = os.getenv("TRACING", "0") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_EXPORT = {e.strip() for e in os.getenv("TRACE_EXPORT", "memory").split(",") if e.strip()}
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.getenv("TRACE_FILE_BACKUPS", "5"))
+# Spans beyond this per trace are counted but not kept
+MAX_SPANS_PER_TRACE = int(os.getenv("TRACE_MAX_SPANS", "500"))
+MAX_STATEMENT_LENGTH = 500
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "calculator")
+
+# OTLP enum values
+SPAN_KIND = {"INTERNAL": 1, "SERVER": 2, "CLIENT": 3}
+STATUS_UNSET, STATUS_ERROR = 0, 2
+
+
+class Trace:
+    """Spans of one trace, collected until the root span ends."""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List["Span"] = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def record(self, span: "Span") -> None:
+        with self.lock:
+            if len(self.spans) < MAX_SPANS_PER_TRACE:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes",
+                 "status", "message")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str] = None, kind: str = "INTERNAL",
+                 start_ns: Optional[int] = None, attributes: Optional[dict] = None):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.message = ""
+
+    def set(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def error(self, message: str) -> None:
+        self.status = STATUS_ERROR
+        self.message = message
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        self.end_ns = end_ns if end_ns is not None else time.time_ns()
+        self.trace.record(self)
+
+    def child(self, name: str, **kwargs) -> "Span":
+        return Span(self.trace, name, parent_id=self.span_id, **kwargs)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KIND[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": self.status, "message": self.message} if self.status else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header, or None if malformed."""
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes) -> Optional[Span]:
+    """Root span for a new (or continued) trace; None when tracing is off or the trace isn't sampled."""
+    if not TRACING:
+        return None
+    incoming = parse_traceparent(traceparent)
+    if incoming is not None:
+        trace_id, parent_id, sampled = incoming
+    else:
+        trace_id, parent_id, sampled = f"{random.getrandbits(128):032x}", None, random.random() < TRACE_SAMPLE_RATE
+    if not sampled:
+        return None
+    return Span(Trace(trace_id), name, parent_id=parent_id, kind="SERVER", attributes=attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current span; a no-op outside a trace."""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.child(name, attributes=attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current_span.reset(token)
+        child.end()
+
+
+def traced(name: str):
+    """Decorator form of `span` for plain functions."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current_span.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ---------- Exporters ----------
+
+class RingBufferExporter:
+    """Most recent traces, oldest evicted first."""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self.traces: "deque[Trace]" = deque(maxlen=size)
+
+    def export(self, trace: Trace) -> None:
+        self.traces.append(trace)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        for trace in reversed(self.traces):
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+    def clear(self) -> None:
+        self.traces.clear()
+
+
+class FileExporter:
+    """One OTLP/JSON ExportTraceServiceRequest per line, in size-rotated files."""
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_FILE_MAX_BYTES,
+                 backups: int = TRACE_FILE_BACKUPS):
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def export(self, trace: Trace) -> None:
+        line = json.dumps(otlp_request(trace), separators=(",", ":"))
+        self.handler.emit(logging.LogRecord(__name__, logging.INFO, "", 0, line, None, None))
+
+    def close(self) -> None:
+        self.handler.close()
+
+
+def otlp_request(trace: Trace) -> dict:
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [s.to_otlp() for s in trace.spans]}],
+    }]}
+
+
+recent = RingBufferExporter()
+exporters: list = []
+if "memory" in TRACE_EXPORT:
+    exporters.append(recent)
+if "file" in TRACE_EXPORT:
+    exporters.append(FileExporter())
+
+
+def shutdown() -> None:
+    for exporter in exporters:
+        close = getattr(exporter, "close", None)
+        if close is not None:
+            close()
+
+
+def export(trace: Trace) -> None:
+    for exporter in exporters:
+        try:
+            exporter.export(trace)
+        except Exception:
+            logger.exception("Trace export failed")
+
+
+# ---------- Views for the admin endpoint ----------
+
+def breakdown(trace: Trace) -> Dict[str, float]:
+    """Milliseconds of self time per span name: each span's duration minus its children's."""
+    children = defaultdict(float)
+    for s in trace.spans:
+        if s.parent_id:
+            children[s.parent_id] += s.duration_ms
+    totals = defaultdict(float)
+    for s in trace.spans:
+        totals[s.name] += max(s.duration_ms - children[s.span_id], 0.0)
+    return {name: round(ms, 3) for name, ms in sorted(totals.items(), key=lambda item: -item[1])}
+
+
+def _root(trace: Trace) -> Optional[Span]:
+    ids = {s.span_id for s in trace.spans}
+    return next((s for s in trace.spans if s.parent_id not in ids), None)
+
+
+def summary(trace: Trace) -> dict:
+    root = _root(trace)
+    attributes = root.attributes if root else {}
+    return {
+        "trace_id": trace.trace_id,
+        "method": attributes.get("http.request.method"),
+        "route": attributes.get("http.route", attributes.get("url.path")),
+        "status_code": attributes.get("http.response.status_code"),
+        "duration_ms": round(root.duration_ms, 3) if root else None,
+        "spans": len(trace.spans),
+        "dropped_spans": trace.dropped,
+        "breakdown_ms": breakdown(trace),
+    }
+
+
+def detail(trace: Trace) -> dict:
+    start = min(s.start_ns for s in trace.spans)
+    spans = [{
+        "span_id": s.span_id,
+        "parent_id": s.parent_id,
+        "name": s.name,
+        "start_ms": round((s.start_ns - start) / 1e6, 3),
+        "duration_ms": round(s.duration_ms, 3),
+        "attributes": s.attributes,
+        "error": s.message or None,
+    } for s in sorted(trace.spans, key=lambda s: s.start_ns)]
+    return {**summary(trace), "span_list": spans}
+
+
+# ---------- Instrumentation ----------
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = current_span.get()
+    if parent is not None:
+        conn.info.setdefault("trace_spans", []).append(parent.child(
+            "db.query", kind="CLIENT",
+            attributes={"db.system": conn.dialect.name, "db.statement": statement[:MAX_STATEMENT_LENGTH]},
+        ))
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_span.get() is None:
+        return
+    spans = conn.info.get("trace_spans")
+    if spans:
+        query_span = spans.pop()
+        if executemany:
+            query_span.set("db.executemany", True)
+        query_span.end()
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+    if spans and current_span.get() is not None:
+        failed = spans.pop()
+        failed.error(str(context.original_exception))
+        failed.end()
+
+
+# Start/end of the route function for the request in flight, shared with the threadpool copy of the context
+_handler_window: ContextVar[Optional[list]] = ContextVar("handler_window", default=None)
+
+
+def _traced_endpoint(call):
+    if getattr(call, "__traced__", False):
+        return call
+
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def endpoint(**values):
+            window = _handler_window.get()
+            if window is None:
+                return await call(**values)
+            with span("http.handler") as handler:
+                window.append(handler)
+                return await call(**values)
+    else:
+        @functools.wraps(call)
+        def endpoint(**values):
+            window = _handler_window.get()
+            if window is None:
+                return call(**values)
+            with span("http.handler") as handler:
+                window.append(handler)
+                return call(**values)
+    endpoint.__traced__ = True
+    return endpoint
+
+
+class TracedRoute(APIRoute):
+    """APIRoute that splits each request into validate, handler and serialize spans."""
+
+    def get_route_handler(self):
+        self.dependant.call = _traced_endpoint(self.dependant.call)
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            root = current_span.get()
+            if root is None:
+                return await handler(request)
+            window: list = []
+            token = _handler_window.set(window)
+            start = time.time_ns()
+            try:
+                response = await handler(request)
+            finally:
+                end = time.time_ns()
+                _handler_window.reset(token)
+                # Without a handler span the request was rejected before the route function ran
+                root.child("http.validate", start_ns=start).end(window[0].start_ns if window else end)
+            if window and window[0].end_ns is not None:
+                root.child("http.serialize", start_ns=window[0].end_ns).end(end)
+            return response
+
+        return traced_handler
+
+
+class TracingMiddleware:
+    """ASGI middleware opening the root span of each HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        root = start_trace(
+            "http.request",
+            traceparent=headers.get(b"traceparent", b"").decode("latin-1"),
+            **{"http.request.method": scope["method"], "url.path": scope["path"]},
+        )
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+        token = current_span.set(root)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.set("http.response.status_code", message["status"])
+                if message["status"] >= 500:
+                    root.error(f"HTTP {message['status']}")
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceparent", root.traceparent.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                root.set("http.route", route.path)
+            root.end()
+            export(root.trace)
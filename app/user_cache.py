@@ -0,0 +1,176 @@
+"""
+In-memory helpers that keep user registration and login off the database.
+
+- ``BloomFilter`` of every known username and email. Registration checks it
+  before paying for a pbkdf2 hash. "Definitely new" skips straight to the
+  INSERT. "Maybe taken" runs one exact lookup first. A filter that misses
+  another worker's inserts only costs a wasted hash, because the unique
+  constraints remain the final check.
+- ``TTLCache`` of user records for auth lookups. Entries expire after
+  USER_CACHE_TTL seconds. Any user change bumps a generation counter in shared
+  state, which drops cached entries in every worker.
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.shared_state import get_backend
+
+USER_BLOOM_CAPACITY = int(os.getenv("USER_BLOOM_CAPACITY", "100000"))
+USER_BLOOM_ERROR_RATE = float(os.getenv("USER_BLOOM_ERROR_RATE", "0.01"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # 0 disables the cache
+
+GENERATION_KEY = "users:generation"
+
+
+class BloomFilter:
+    """Fixed-size bloom filter sized for `capacity` items at `error_rate` false positives."""
+
+    def __init__(self, capacity: int = USER_BLOOM_CAPACITY, error_rate: float = USER_BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.lock = threading.Lock()
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str) -> None:
+        with self.lock:
+            for pos in self._positions(key):
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def clear(self) -> None:
+        with self.lock:
+            self.bits = bytearray(len(self.bits))
+
+
+class TTLCache:
+    """Small LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value) -> None:
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _username_key(username: str) -> str:
+    return "u:" + username
+
+
+def _email_key(email: str) -> str:
+    # Emails are compared case-insensitively for the filter; the DB check stays exact
+    return "e:" + email.lower()
+
+
+known_users = BloomFilter()
+user_records = TTLCache()
+_generation = 0
+
+
+def remember(username: str, email: str) -> None:
+    known_users.add(_username_key(username))
+    known_users.add(_email_key(email))
+
+
+def might_exist(username: str, email: str) -> bool:
+    return _username_key(username) in known_users or _email_key(email) in known_users
+
+
+def rebuild(db: Session) -> int:
+    """Reload the filter from every stored username and email. Returns the number of users."""
+    rows = db.execute(select(models.User.username, models.User.email).execution_options(yield_per=1000))
+    known_users.clear()
+    count = 0
+    for username, email in rows:
+        remember(username, email)
+        count += 1
+    return count
+
+
+def _sync_generation() -> None:
+    global _generation
+    generation = get_backend().get_int(GENERATION_KEY)
+    if generation != _generation:
+        user_records.clear()
+        _generation = generation
+
+
+def cached_user(username: str) -> Optional[models.User]:
+    """A detached copy of the cached user, or None on a miss."""
+    if user_records.ttl <= 0:
+        return None
+    _sync_generation()
+    fields = user_records.get(username)
+    return models.User(**fields) if fields is not None else None
+
+
+def cache_user(user: models.User) -> None:
+    # Store plain values, never the session-bound instance
+    user_records.set(user.username, {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "password_hash": user.password_hash,
+        "created_at": user.created_at,
+    })
+
+
+def user_changed() -> None:
+    """
+    Call after a user is updated or deleted so no worker serves a stale record.
+
+    Inserts don't need it; misses are never cached.
+    """
+    global _generation
+    _generation = get_backend().incr(GENERATION_KEY)
+    user_records.clear()
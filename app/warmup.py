@@ -0,0 +1,106 @@
+"""
+Startup warmup and readiness state.
+
+The lifespan runs each warmup step through ``Warmup.run``, which records how
+long the step took and whether it failed. ``/ready`` reports 503 until
+``mark_ready()`` is called, so a load balancer or the Docker healthcheck only
+routes traffic to a worker after its pool is open, templates are rendered and
+caches are primed.
+"""
+
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Connections opened per engine during warmup; capped by the pool size
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "5"))
+
+
+class Warmup:
+    """Tracks warmup steps and whether the process is ready for traffic."""
+
+    def __init__(self):
+        self.ready = False
+        self.steps: Dict[str, float] = {}  # step name -> milliseconds
+        self.errors: Dict[str, str] = {}
+
+    def run(self, name: str, step: Callable[[], object], required: bool = False) -> None:
+        """Run one step. Failures are logged and recorded; `required` steps re-raise and abort startup."""
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            self.errors[name] = str(e)
+            logger.warning("Warmup step %s failed", name, exc_info=True)
+            if required:
+                raise
+        finally:
+            self.steps[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    def mark_ready(self) -> None:
+        self.ready = True
+        logger.info("Warmup finished: %s", ", ".join(f"{k} {v} ms" for k, v in self.steps.items()))
+
+    def reset(self) -> None:
+        self.ready = False
+        self.steps.clear()
+        self.errors.clear()
+
+
+state = Warmup()
+
+
+def open_pool(engine: Engine, connections: int = WARMUP_CONNECTIONS) -> int:
+    """Open up to `connections` pooled connections at once, then return them to the pool."""
+    size = getattr(engine.pool, "size", None)
+    n = max(1, min(connections, size() if callable(size) else 1))
+    opened = []
+    try:
+        for _ in range(n):
+            conn = engine.connect()
+            opened.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()
+    return n
+
+
+def ping(engine: Engine) -> bool:
+    """Cheap readiness probe: one round trip on a pooled connection."""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
+
+
+def warm_models(samples: Iterable[Tuple[type, dict]]) -> None:
+    """Validate and serialize one sample per model so first-request setup costs are paid now."""
+    for model, sample in samples:
+        if isinstance(model, type) and issubclass(model, BaseModel):
+            model.model_validate(sample).model_dump_json()
+        else:  # a TypeAdapter
+            model.validate_python(sample)
+
+
+def status(engine: Optional[Engine] = None) -> Tuple[bool, dict]:
+    """Readiness verdict and body for the /ready endpoint."""
+    database = ping(engine) if engine is not None else True
+    ready = state.ready and database
+    body = {
+        "status": "ready" if ready else "starting" if not state.ready else "unavailable",
+        "database": database,
+        "warmup_ms": state.steps,
+    }
+    if state.errors:
+        body["warmup_errors"] = state.errors
+    return ready, body
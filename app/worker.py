@@ -0,0 +1,147 @@
+"""
+Worker pool draining the persistent job queue (`app.operations.jobs`).
+
+Workers normally run as their own service (the `worker` service in
+docker-compose.yml), on this host or another one sharing the database:
+
+    uvicorn main:app --workers 4        # API only
+    JOB_WORKERS=4 python -m app.worker  # dedicated worker process
+
+Setting JOB_WORKERS in the API's environment also starts that many threads in
+every uvicorn process; it defaults to 0 so the API doesn't poll the queue.
+
+Running jobs whose worker died are requeued at start and then every
+JOB_REQUEUE_SECONDS, so they resume without waiting for a restart.
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Callable, List, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.db import SessionLocal
+from app.operations import jobs as job_ops
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+JOB_REQUEUE_SECONDS = float(os.getenv("JOB_REQUEUE_SECONDS", "60"))
+
+
+class JobWorkerPool:
+    """Threads that claim queued jobs and run them; `notify()` wakes an idle worker early."""
+
+    def __init__(self, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_SECONDS,
+                 session_factory: Callable[[], Session] = SessionLocal,
+                 requeue_interval: float = JOB_REQUEUE_SECONDS, stale_seconds: float = job_ops.JOB_STALE_SECONDS):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.session_factory = session_factory
+        self.requeue_interval = requeue_interval
+        self.stale_seconds = stale_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._requeue_lock = threading.Lock()
+        self._next_requeue = 0.0
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self) -> "JobWorkerPool":
+        if self.running:
+            return self
+        self._stop.clear()
+        self._next_requeue = 0.0
+        self.requeue_if_due()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop after the current chunk; unfinished jobs resume on the next start."""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def requeue_if_due(self) -> None:
+        """Requeue stale jobs if requeue_interval has passed; one thread does it while the others work."""
+        with self._requeue_lock:
+            now = time.monotonic()
+            if now < self._next_requeue:
+                return
+            self._next_requeue = now + self.requeue_interval
+        db = self.session_factory()
+        try:
+            requeued = job_ops.requeue_stale_jobs(db, self.stale_seconds)
+            if requeued:
+                logger.warning("Requeued %d stale jobs", requeued)
+        except SQLAlchemyError:
+            logger.warning("Could not requeue stale jobs", exc_info=True)
+        finally:
+            db.close()
+
+    def run_once(self) -> bool:
+        """Claim and run one job. Returns False when the queue was empty."""
+        db = self.session_factory()
+        try:
+            job_id = job_ops.claim_next_job(db)
+            if job_id is None:
+                return False
+            try:
+                job_ops.run_job(db, job_id)
+            except Exception:
+                logger.exception("Job %s failed", job_id)
+            return True
+        finally:
+            db.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.requeue_if_due()
+                if self.run_once():
+                    continue
+            except Exception:
+                logger.exception("Job worker error")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+pool = JobWorkerPool()
+
+
+def main() -> None:
+    from app.db import init_db
+    from app.logging_config import configure_logging
+
+    configure_logging()
+    init_db()
+    worker_pool = JobWorkerPool(workers=max(JOB_WORKERS, 1))
+    done = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: done.set())
+    signal.signal(signal.SIGINT, lambda *_: done.set())
+    worker_pool.start()
+    logger.info("Job worker running with %d threads", worker_pool.workers)
+    done.wait()
+    worker_pool.stop()
+
+
+if __name__ == "__main__":
+    main()
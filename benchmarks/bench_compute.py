@@ -0,0 +1,58 @@
+"""
+Compare throughput of the single-operation routes against the batch `/compute` endpoint.
+
+Usage:
+    python -m benchmarks.bench_compute [--items 4000] [--batch 100]
+
+Requests go through FastAPI's in-process TestClient, so the numbers measure
+framework and handler overhead per operation rather than network latency.
+"""
+
+import argparse
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+from main import app
+
+OPS = ("add", "subtract", "multiply", "divide")
+
+
+def make_items(n: int):
+    rng = random.Random(42)
+    return [{"op": rng.choice(OPS), "a": rng.uniform(1, 100), "b": rng.uniform(1, 100)} for _ in range(n)]
+
+
+def bench_single(client: TestClient, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        client.post("/" + item["op"], json={"a": item["a"], "b": item["b"]})
+    return time.perf_counter() - start
+
+
+def bench_batch(client: TestClient, items, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(items), batch_size):
+        client.post("/compute", json={"items": items[i:i + batch_size]})
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=4000)
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    with TestClient(app) as client:
+        single = bench_single(client, items)
+        batch = bench_batch(client, items, args.batch)
+
+    print(f"single-op routes : {args.items / single:10.0f} ops/s ({single:.2f}s)")
+    print(f"/compute x{args.batch:<5} : {args.items / batch:10.0f} ops/s ({batch:.2f}s)")
+    print(f"speedup          : {single / batch:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
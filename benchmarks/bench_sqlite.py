@@ -0,0 +1,80 @@
+"""
+Compare concurrent SQLite throughput with the default engine and the tuned mode (SQLITE_TUNED=1).
+
+Usage:
+    python -m benchmarks.bench_sqlite [--threads 16] [--ops 200] [--write-ratio 0.3]
+
+Each thread runs its own sessions, mixing calculation inserts with reads of
+the latest rows, against a fresh database file per mode. "locked" counts
+operations that failed with "database is locked".
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app import schemas
+from app.db import Base, RoutingSession, WriteQueue, make_engine
+from app.operations import calculations as calc_ops
+
+
+def run(tuned: bool, threads: int, ops: int, write_ratio: float, directory: str):
+    path = os.path.join(directory, f"bench_{'tuned' if tuned else 'default'}.sqlite")
+    engine = make_engine(f"sqlite:///{path}", tuned=tuned)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autoflush=False, expire_on_commit=False, bind=engine, class_=RoutingSession,
+                           write_queue=WriteQueue() if tuned else None)
+    counts = {"writes": 0, "reads": 0, "locked": 0}
+    lock = threading.Lock()
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        for _ in range(ops):
+            write = rng.random() < write_ratio
+            try:
+                with factory() as db:
+                    if write:
+                        calc_ops.create_calculation(db, schemas.CalculationCreate(
+                            a=rng.uniform(1, 100), b=rng.uniform(1, 100), type="Multiply"))
+                    else:
+                        calc_ops.get_all_calculations(db, limit=20)
+                key = "writes" if write else "reads"
+            except OperationalError:
+                key = "locked"
+            with lock:
+                counts[key] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+    return elapsed, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200, help="operations per thread")
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for tuned in (False, True):
+            elapsed, counts = run(tuned, args.threads, args.ops, args.write_ratio, directory)
+            done = counts["writes"] + counts["reads"]
+            print(f"{'tuned' if tuned else 'default':8}: {done / elapsed:8.0f} ops/s  "
+                  f"({counts['writes']} writes, {counts['reads']} reads, {counts['locked']} locked, {elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
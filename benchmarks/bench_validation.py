@@ -0,0 +1,109 @@
+"""
+Measure request-model validation cost per item, before and after the validator consolidation.
+
+Usage:
+    python -m benchmarks.bench_validation [--items 20000] [--repeat 5]
+
+"legacy" models reproduce the previous validators (a field validator on `type`,
+one on `b` reading `info.data`, and a model validator repeating the division
+check; plus an `isinstance` re-check on OperationRequest). The current models
+are validated one at a time, and in bulk through their TypeAdapter.
+"""
+
+import argparse
+import json
+import random
+import time
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from app.models import CalculationType
+from app.schemas import CalculationCreate, CalculationCreateList
+from main import OperationRequest
+
+
+class LegacyCalculationCreate(BaseModel):
+    a: float = Field(...)
+    b: float = Field(...)
+    type: CalculationType = Field(...)
+
+    @field_validator("type")
+    def validate_type(cls, v):
+        if not isinstance(v, CalculationType):
+            return CalculationType(v)
+        return v
+
+    @field_validator("b")
+    def validate_divisor(cls, v, info):
+        values = info.data if hasattr(info, "data") else {}
+        if values.get("type") == CalculationType.DIVIDE and v == 0:
+            raise ValueError("Division by zero is not allowed")
+        return v
+
+    @model_validator(mode="after")
+    def check_division(cls, model):
+        if model.type == CalculationType.DIVIDE and model.b == 0:
+            raise ValueError("Division by zero is not allowed")
+        return model
+
+
+class LegacyOperationRequest(BaseModel):
+    a: float = Field(...)
+    b: float = Field(...)
+
+    @field_validator("a", "b")
+    def validate_numbers(cls, value):
+        if not isinstance(value, (int, float)):
+            raise ValueError("Both a and b must be numbers.")
+        return value
+
+
+# Two-operand types: unary and aggregate types need other payloads (and the legacy model predates them)
+BINARY_TYPES = [CalculationType.ADD, CalculationType.SUBTRACT, CalculationType.MULTIPLY,
+                CalculationType.DIVIDE, CalculationType.POWER, CalculationType.MODULUS]
+
+
+def make_items(n: int):
+    rng = random.Random(7)
+    types = [t.value for t in BINARY_TYPES]
+    return [{"a": rng.uniform(-100, 100), "b": rng.uniform(1, 100), "type": rng.choice(types)} for _ in range(n)]
+
+
+def per_item_us(fn, n: int, repeat: int) -> float:
+    best = min(_timed(fn) for _ in range(repeat))
+    return best / n * 1e6
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    operands = [{"a": item["a"], "b": item["b"]} for item in items]
+    raw = json.dumps(items).encode()
+    n, repeat = args.items, args.repeat
+
+    results = [
+        ("OperationRequest legacy", per_item_us(lambda: [LegacyOperationRequest(**o) for o in operands], n, repeat)),
+        ("OperationRequest current", per_item_us(lambda: [OperationRequest(**o) for o in operands], n, repeat)),
+        ("CalculationCreate legacy", per_item_us(lambda: [LegacyCalculationCreate(**i) for i in items], n, repeat)),
+        ("CalculationCreate current", per_item_us(lambda: [CalculationCreate(**i) for i in items], n, repeat)),
+        ("TypeAdapter list (python)", per_item_us(lambda: CalculationCreateList.validate_python(items), n, repeat)),
+        ("TypeAdapter list (json)", per_item_us(lambda: CalculationCreateList.validate_json(raw), n, repeat)),
+    ]
+    baseline = results[2][1]
+    for name, us in results:
+        note = f"  ({baseline / us:.1f}x vs legacy CalculationCreate)" if name.startswith(("Calc", "Type")) else ""
+        print(f"{name:<27}: {us:6.2f} us/item{note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,132 @@
 # main.py
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel, Field, field_validator  # Use @validator for Pydantic 1.x
+from pydantic import BaseModel, Field
+from typing import List, Optional, Union
+from datetime import datetime
 from fastapi.exceptions import RequestValidationError
-from app.operations import add, subtract, multiply, divide  # Ensure correct import path
-from app.db import init_db, SessionLocal
+from sqlalchemy.exc import SQLAlchemyError
+from app.operations import evaluate  # Ensure correct import path
+from app.db import init_db, engine, read_engines, CALCULATIONS_PARTITIONED, ReadYourWritesMiddleware, SessionLocal
 from app.operations import users as user_ops
 from app.operations import calculations as calc_ops
-from app import schemas
-from app.security import create_access_token
+from app.operations import revisions
+from app import columnar, dedup, models, partitions, schemas, sharding, sketches
+from app.security import Overloaded, create_access_token, create_refresh_token, verify_token
+from app.pages import PageCache
+from app.logging_config import configure_logging, route_logger, stop_logging
+from app import profiling
+from app import tracing
+from app import shared_state
+from app import warmup
+from app import user_cache
+from app import worker
+from app.operations import jobs as job_ops
 import uvicorn
+import json
 import logging
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging: records are queued and written by a background listener
+configure_logging()
 logger = logging.getLogger(__name__)
-
-app = FastAPI()
+route_log = route_logger(__name__)
 
 # Setup templates directory
 templates = Jinja2Templates(directory="templates")
+pages = PageCache(templates)
+
+STATIC_PAGES = ("index.html", "register.html", "login.html")
+
+
+def _load_user_filter():
+    db = SessionLocal()
+    try:
+        count = user_cache.rebuild(db)
+        logger.info("Loaded %d users into the registration filter", count)
+    except SQLAlchemyError:
+        # Tables not created yet; the filter fills as users register
+        logger.warning("Could not load users into the registration filter", exc_info=True)
+    finally:
+        db.close()
+
+
+def _prune_sessions():
+    db = SessionLocal()
+    try:
+        logger.info("Pruned %d expired refresh sessions", user_ops.prune_sessions(db))
+    except SQLAlchemyError:
+        logger.warning("Could not prune refresh sessions", exc_info=True)
+    finally:
+        db.close()
+
+
+def _warm_up():
+    """Pay cold-start costs before the worker reports ready."""
+    warmup.state.run("database_pool", lambda: [warmup.open_pool(e) for e in (engine, *read_engines)])
+    # The frontend templates have no per-request context, so render them once
+    warmup.state.run("templates", partial(pages.prerender, *STATIC_PAGES), required=True)
+    warmup.state.run("user_filter", _load_user_filter)
+    warmup.state.run("refresh_sessions", _prune_sessions)
+    if CALCULATIONS_PARTITIONED:
+        # Inserts into a month without a partition land in the default one; make sure they don't have to
+        warmup.state.run("partitions", partitions.ensure_partitions)
+    if columnar.COLUMNAR_CACHE:
+        warmup.state.run("columnar_snapshot", _load_columnar)
+    warmup.state.run("validation", partial(warmup.warm_models, VALIDATION_SAMPLES))
+    warmup.state.run("openapi", app.openapi)
+
+
+def _load_columnar():
+    db = SessionLocal()
+    try:
+        columnar.sync(db)
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    _warm_up()
+    if worker.JOB_WORKERS > 0:
+        worker.pool.start()
+    flusher = sketches.SketchFlusher(SessionLocal).start() if sketches.ANALYTICS_SKETCHES else None
+    warmup.state.mark_ready()
+    yield
+    warmup.state.reset()
+    if flusher is not None:
+        flusher.stop()
+    worker.pool.stop()
+    if sharding.lease is not None:
+        sharding.lease.release()
+    shared_state.close_backend()
+    stop_logging()
+    tracing.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+# Per-route validate/handler/serialize spans; must be set before routes are declared
+app.router.route_class = tracing.TracedRoute
+
+# Compress large JSON bodies such as browse results; pre-compressed pages pass through
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Slow-request capture and X-Profile per-request profiling
+app.add_middleware(profiling.ProfilingMiddleware)
+# Root span per request when TRACING=1
+app.add_middleware(tracing.TracingMiddleware)
+# Per-client read-your-writes window when read replicas are configured
+app.add_middleware(ReadYourWritesMiddleware)
 
 # Pydantic model for request data
 class OperationRequest(BaseModel):
     a: float = Field(..., description="The first number")
     b: float = Field(..., description="The second number")
-
-    @field_validator('a', 'b')  # Correct decorator for Pydantic 1.x
-    def validate_numbers(cls, value):
-        if not isinstance(value, (int, float)):
-            raise ValueError('Both a and b must be numbers.')
-        return value
+    # The float annotations already reject non-numeric input; no extra validator pass
 
 # Pydantic model for successful response
 class OperationResponse(BaseModel):
@@ -42,20 +136,57 @@ class OperationResponse(BaseModel):
 class ErrorResponse(BaseModel):
     error: str = Field(..., description="Error message")
 
+# Maximum number of items accepted by a single /compute request
+MAX_COMPUTE_ITEMS = 1000
+
+# Pydantic models for the batch compute endpoint
+class ComputeRequest(BaseModel):
+    items: List[schemas.ComputeItem] = Field(..., max_length=MAX_COMPUTE_ITEMS)
+
+class ComputeResult(BaseModel):
+    result: Optional[float] = None
+    error: Optional[str] = None
+
+class ComputeResponse(BaseModel):
+    results: List[ComputeResult]
+
+# One representative payload per request model, validated during warmup
+VALIDATION_SAMPLES = (
+    (OperationRequest, {"a": 1, "b": 2}),
+    (ComputeRequest, {"items": [{"op": "add", "a": 1, "b": 2}]}),
+    (schemas.CalculationCreate, {"a": 1, "b": 2, "type": "Divide"}),
+    (schemas.CalculationCreateList, [{"a": 1, "b": 2, "type": "Add"}]),
+    (schemas.UserCreate, {"username": "warmup", "email": "warmup@example.com", "password": "warmup-password"}),
+    (schemas.UserLogin, {"username": "warmup", "password": "warmup-password"}),
+    (schemas.JobCreate, {"expressions": ["1 + 2"]}),
+)
+
 # Custom Exception Handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    logger.error(f"HTTPException on {request.url.path}: {exc.detail}")
+    route_log.log(request.url.path, logging.ERROR, "HTTPException on %s: %s",
+                  request.url.path, exc.detail, status=exc.status_code)
     return JSONResponse(
         status_code=exc.status_code,
         content={"error": exc.detail},
     )
 
+@app.exception_handler(Overloaded)
+async def overloaded_exception_handler(request: Request, exc: Overloaded):
+    route_log.log(request.url.path, logging.WARNING, "Shedding %s: %s",
+                  request.url.path, exc, status=503)
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     # Extracting error messages
     error_messages = "; ".join([f"{err['loc'][-1]}: {err['msg']}" for err in exc.errors()])
-    logger.error(f"ValidationError on {request.url.path}: {error_messages}")
+    route_log.log(request.url.path, logging.ERROR, "ValidationError on %s: %s",
+                  request.url.path, error_messages, status=400)
     return JSONResponse(
         status_code=400,
         content={"error": error_messages},
@@ -66,7 +197,7 @@ async def read_root(request: Request):
     """
     Serve the index.html template.
     """
-    return templates.TemplateResponse("index.html", {"request": request})
+    return pages.response(request, "index.html")
 
 
 @app.get("/register")
@@ -74,7 +205,7 @@ async def register_page(request: Request):
     """
     Serve the registration page.
     """
-    return templates.TemplateResponse("register.html", {"request": request})
+    return pages.response(request, "register.html")
 
 
 @app.get("/login")
@@ -82,7 +213,7 @@ async def login_page(request: Request):
     """
     Serve the login page.
     """
-    return templates.TemplateResponse("login.html", {"request": request})
+    return pages.response(request, "login.html")
 
 @app.post("/add", response_model=OperationResponse, responses={400: {"model": ErrorResponse}})
 async def add_route(operation: OperationRequest):
@@ -90,10 +221,10 @@ async def add_route(operation: OperationRequest):
     Add two numbers.
     """
     try:
-        result = add(operation.a, operation.b)
+        result = evaluate("add", operation.a, operation.b)
         return OperationResponse(result=result)
     except Exception as e:
-        logger.error(f"Add Operation Error: {str(e)}")
+        # Logged once, by the HTTPException handler
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/subtract", response_model=OperationResponse, responses={400: {"model": ErrorResponse}})
@@ -102,10 +233,10 @@ async def subtract_route(operation: OperationRequest):
     Subtract two numbers.
     """
     try:
-        result = subtract(operation.a, operation.b)
+        result = evaluate("subtract", operation.a, operation.b)
         return OperationResponse(result=result)
     except Exception as e:
-        logger.error(f"Subtract Operation Error: {str(e)}")
+        # Logged once, by the HTTPException handler
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/multiply", response_model=OperationResponse, responses={400: {"model": ErrorResponse}})
@@ -114,10 +245,10 @@ async def multiply_route(operation: OperationRequest):
     Multiply two numbers.
     """
     try:
-        result = multiply(operation.a, operation.b)
+        result = evaluate("multiply", operation.a, operation.b)
         return OperationResponse(result=result)
     except Exception as e:
-        logger.error(f"Multiply Operation Error: {str(e)}")
+        # Logged once, by the HTTPException handler
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/divide", response_model=OperationResponse, responses={400: {"model": ErrorResponse}})
@@ -126,29 +257,63 @@ async def divide_route(operation: OperationRequest):
     Divide two numbers.
     """
     try:
-        result = divide(operation.a, operation.b)
+        result = evaluate("divide", operation.a, operation.b)
         return OperationResponse(result=result)
     except ValueError as e:
-        logger.error(f"Divide Operation Error: {str(e)}")
+        # Logged once, by the HTTPException handler
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Divide Operation Internal Error: {str(e)}")
+        logger.exception("Divide Operation Internal Error: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@app.post("/compute", response_model=ComputeResponse, responses={400: {"model": ErrorResponse}})
+async def compute_route(batch: ComputeRequest):
+    """
+    Evaluate a batch of operations in one request.
+
+    Results are returned in request order; a failing item reports its error
+    without affecting the rest of the batch.
+    """
+    results = []
+    for item in batch.items:
+        try:
+            results.append(ComputeResult(result=evaluate(item.op, item.a, item.b)))
+        except ValueError as e:
+            results.append(ComputeResult(error=str(e)))
+    return ComputeResponse(results=results)
+
 
 # ========== User Endpoints ==========
 
+def _issue_tokens(identity: dict, session: dict) -> schemas.Token:
+    """Access token plus a refresh token carrying the same identity claims and the refresh session's."""
+    return schemas.Token(
+        access_token=create_access_token(data=identity),
+        refresh_token=create_refresh_token(data={**identity, **session}),
+        token_type="bearer",
+    )
+
+
+def _login(db, user: models.User) -> schemas.Token:
+    identity = {"sub": user.username, "user_id": user.id, "email": user.email}
+    return _issue_tokens(identity, user_ops.start_session(db, user.id))
+
+
+def _refresh_claims(token: str) -> dict:
+    payload = verify_token(token, token_type="refresh")
+    # Tokens from before refresh sessions carry no sid and can't be rotated or revoked
+    if payload is None or not all(k in payload for k in ("sid", "jti", "auth_time")):
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+    return payload
+
+
 @app.post("/users/register", response_model=schemas.Token)
 def register_user(user_in: schemas.UserCreate):
     """Register a new user. Returns a JWT access token."""
     db = SessionLocal()
     try:
         user = user_ops.create_user(db, user_in)
-        # Create JWT token with user information
-        access_token = create_access_token(
-            data={"sub": user.username, "user_id": user.id, "email": user.email}
-        )
-        return schemas.Token(access_token=access_token, token_type="bearer")
+        return _login(db, user)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     finally:
@@ -163,13 +328,39 @@ def login_user(user_login: schemas.UserLogin):
         user = user_ops.authenticate_user(db, user_login.username, user_login.password)
         if not user:
             raise HTTPException(status_code=401, detail="Invalid username or password")
-        # Create JWT token with user information
-        access_token = create_access_token(
-            data={"sub": user.username, "user_id": user.id, "email": user.email}
-        )
-        return schemas.Token(access_token=access_token, token_type="bearer")
+        return _login(db, user)
+    finally:
+        db.close()
+
+
+@app.post("/users/refresh", response_model=schemas.Token)
+def refresh_tokens(body: schemas.RefreshRequest):
+    """Exchange a refresh token for a new access/refresh pair, without a password check.
+
+    Each refresh token works once. Reusing an old one revokes the whole session.
+    """
+    payload = _refresh_claims(body.refresh_token)
+    db = SessionLocal()
+    try:
+        jti = user_ops.rotate_session(db, payload["sid"], payload["jti"])
+    finally:
+        db.close()
+    if jti is None:
+        raise HTTPException(status_code=401, detail="Refresh token was revoked or already used")
+    session = {"sid": payload["sid"], "jti": jti, "auth_time": payload["auth_time"]}
+    return _issue_tokens({k: payload.get(k) for k in ("sub", "user_id", "email")}, session)
+
+
+@app.post("/users/logout")
+def logout_user(body: schemas.RefreshRequest):
+    """Revoke the refresh session; access tokens already issued run out on their own."""
+    payload = _refresh_claims(body.refresh_token)
+    db = SessionLocal()
+    try:
+        user_ops.revoke_session(db, payload["sid"])
     finally:
         db.close()
+    return {"message": "Logged out"}
 
 
 # ========== Calculation Endpoints (BREAD) ==========
@@ -177,7 +368,7 @@ def login_user(user_login: schemas.UserLogin):
 @app.post("/calculations", response_model=schemas.CalculationRead)
 def create_calculation(calc_in: schemas.CalculationCreate):
     """Add a new calculation."""
-    db = SessionLocal()
+    db = sharding.session_for_user(calc_in.user_id)
     try:
         calc = calc_ops.create_calculation(db, calc_in, store_result=True)
         return calc
@@ -187,13 +378,128 @@ def create_calculation(calc_in: schemas.CalculationCreate):
         db.close()
 
 
+@app.post("/calculations/bulk", response_model=Union[List[schemas.CalculationRead], schemas.BulkInserted])
+def bulk_create_calculations(body: schemas.CalculationBulkCreate, returning: bool = True):
+    """Add many calculations in one transaction (per shard); `returning=false` skips the rows (COPY on Postgres)."""
+    try:
+        if sharding.SHARDED:
+            created = _bulk_create_sharded(body.items, returning)
+        else:
+            db = SessionLocal()
+            try:
+                created = calc_ops.create_calculations(db, body.items, returning=returning)
+            finally:
+                db.close()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not returning:
+        return schemas.BulkInserted(inserted=created)
+    return created
+
+
+def _bulk_create_sharded(items, returning: bool):
+    """Insert each shard's share of `items`; rows come back in input order."""
+    created = [None] * len(items)
+    inserted = 0
+    for shard, group in sharding.group_by_shard(items, lambda item: item.user_id).items():
+        db = sharding.shards.session(shard)
+        try:
+            result = calc_ops.create_calculations(db, [item for _, item in group], returning=returning)
+        finally:
+            db.close()
+        if returning:
+            for (position, _), calc in zip(group, result):
+                created[position] = calc
+        else:
+            inserted += result
+    return created if returning else inserted
+
+
+def _stream_rows(rows_factory, ndjson: bool = False, skip: int = 0, limit: Optional[int] = None):
+    """
+    Serialize calculation rows chunk by chunk while the session stays open.
+
+    When sharded, `rows_factory` runs on every shard and the streams are
+    merged by id; `skip`/`limit` then apply to the merged stream.
+    """
+    db = None if sharding.SHARDED else SessionLocal()
+    try:
+        rows = rows_factory(db) if db is not None else sharding.gather_rows(rows_factory, skip, limit)
+        if ndjson:
+            for row in rows:
+                yield json.dumps(calc_ops.calculation_row_to_dict(row)) + "\n"
+            return
+        yield "["
+        first = True
+        for row in rows:
+            yield ("" if first else ",") + json.dumps(calc_ops.calculation_row_to_dict(row))
+            first = False
+        yield "]"
+    finally:
+        if db is not None:
+            db.close()
+
+
 @app.get("/calculations", response_model=list[schemas.CalculationRead])
-def browse_calculations(skip: int = 0, limit: int = 100):
-    """Browse all calculations with pagination."""
+def browse_calculations(skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=calc_ops.MAX_PAGE_SIZE),
+                        since: Optional[datetime] = None, until: Optional[datetime] = None,
+                        after_id: Optional[int] = None):
+    """Browse all calculations in id order with pagination, optionally bounded by created_at.
+
+    Pass the last id of a page as `after_id` to fetch the next one without an offset.
+    """
+    if sharding.SHARDED:
+        # Every shard supplies its first skip + limit rows; the offset applies after the merge
+        rows = partial(calc_ops.iter_calculation_rows, limit=skip + limit, since=since, until=until,
+                       after_id=after_id)
+        return StreamingResponse(_stream_rows(rows, skip=skip, limit=limit), media_type="application/json")
+    rows = partial(calc_ops.iter_calculation_rows, skip=skip, limit=limit, since=since, until=until,
+                   after_id=after_id)
+    return StreamingResponse(_stream_rows(rows), media_type="application/json")
+
+
+@app.get("/calculations/export")
+def export_calculations(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Stream every matching calculation as NDJSON with flat memory use."""
+    rows = partial(calc_ops.iter_calculation_rows, since=since, until=until)
+    return StreamingResponse(_stream_rows(rows, ndjson=True), media_type="application/x-ndjson")
+
+
+@app.get("/calculations/stats", response_model=schemas.CalculationStats)
+def calculation_stats(type: Optional[models.CalculationType] = None, user_id: Optional[int] = None,
+                      since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """
+    Aggregate results, from the columnar snapshot when enabled and it holds the whole table,
+    else from the database (or every shard).
+    """
+    if sharding.SHARDED:
+        parts = sharding.shards.scatter(
+            lambda db: calc_ops.get_calculation_stats(db, type, user_id, since, until))
+        return schemas.CalculationStats(**calc_ops.merge_stats(parts))
+    db = SessionLocal()
+    try:
+        if columnar.COLUMNAR_CACHE:
+            snapshot = columnar.sync(db)
+            if snapshot.complete:
+                return schemas.CalculationStats(**snapshot.stats(type, user_id, since, until), source="snapshot")
+        return schemas.CalculationStats(**calc_ops.get_calculation_stats(db, type, user_id, since, until))
+    finally:
+        db.close()
+
+
+@app.get("/calculations/hot", response_model=List[schemas.HotTuple])
+def hot_calculations(type: Optional[models.CalculationType] = None, limit: int = Query(10, ge=1, le=100)):
+    """Top-N most repeated (type, a, b) inputs; exact unless sharded, where each shard's top-N are merged."""
+    if sharding.SHARDED:
+        counts = {}
+        for part in sharding.shards.scatter(lambda db: dedup.hot_tuples(db, limit, type)):
+            for row in part:
+                key = (row["type"], row["a"], row["b"])
+                counts.setdefault(key, {**row, "count": 0})["count"] += row["count"]
+        return sorted(counts.values(), key=lambda row: row["count"], reverse=True)[:limit]
     db = SessionLocal()
     try:
-        calcs = calc_ops.get_all_calculations(db, skip=skip, limit=limit)
-        return calcs
+        return dedup.hot_tuples(db, limit, type)
     finally:
         db.close()
 
@@ -201,7 +507,7 @@ def browse_calculations(skip: int = 0, limit: int = 100):
 @app.get("/calculations/{calc_id}", response_model=schemas.CalculationRead)
 def read_calculation(calc_id: int):
     """Read a specific calculation by ID."""
-    db = SessionLocal()
+    db = sharding.session_for_id(calc_id)
     try:
         calc = calc_ops.get_calculation_by_id(db, calc_id)
         if not calc:
@@ -213,8 +519,8 @@ def read_calculation(calc_id: int):
 
 @app.put("/calculations/{calc_id}", response_model=schemas.CalculationRead)
 def update_calculation(calc_id: int, calc_in: schemas.CalculationCreate):
-    """Edit an existing calculation."""
-    db = SessionLocal()
+    """Edit an existing calculation; the previous inputs are kept in its revision history."""
+    db = sharding.session_for_id(calc_id)
     try:
         calc = calc_ops.update_calculation(db, calc_id, calc_in)
         if not calc:
@@ -222,6 +528,38 @@ def update_calculation(calc_id: int, calc_in: schemas.CalculationCreate):
         return calc
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except revisions.RevisionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    finally:
+        db.close()
+
+
+@app.get("/calculations/{calc_id}/revisions", response_model=List[schemas.CalculationRevisionRead])
+def calculation_revisions(calc_id: int, limit: Optional[int] = Query(None, ge=1)):
+    """States of a calculation, newest first."""
+    db = sharding.session_for_id(calc_id)
+    try:
+        calc = calc_ops.get_calculation_by_id(db, calc_id)
+        if not calc:
+            raise HTTPException(status_code=404, detail="Calculation not found")
+        return revisions.history(db, calc, limit)
+    finally:
+        db.close()
+
+
+@app.post("/calculations/{calc_id}/revert", response_model=schemas.CalculationRead)
+def revert_calculation(calc_id: int, revision: int = Query(..., ge=1)):
+    """Restore the inputs of an earlier revision. This adds a new revision, so it can be undone the same way."""
+    db = sharding.session_for_id(calc_id)
+    try:
+        calc = calc_ops.revert_calculation(db, calc_id, revision)
+        if not calc:
+            raise HTTPException(status_code=404, detail="Calculation not found")
+        return calc
+    except revisions.RevisionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except revisions.RevisionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     finally:
         db.close()
 
@@ -229,7 +567,7 @@ def update_calculation(calc_id: int, calc_in: schemas.CalculationCreate):
 @app.delete("/calculations/{calc_id}")
 def delete_calculation(calc_id: int):
     """Delete a calculation by ID."""
-    db = SessionLocal()
+    db = sharding.session_for_id(calc_id)
     try:
         deleted = calc_ops.delete_calculation(db, calc_id)
         if not deleted:
@@ -239,6 +577,199 @@ def delete_calculation(calc_id: int):
         db.close()
 
 
+@app.delete("/calculations")
+def bulk_delete_calculations(ids: Optional[List[int]] = Query(None), type: Optional[models.CalculationType] = None,
+                             since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Delete calculations by id list and/or filter in a single statement."""
+    if ids is None and type is None and since is None and until is None:
+        raise HTTPException(status_code=400, detail="Provide ids or at least one filter")
+    if sharding.SHARDED:
+        parts = sharding.shards.scatter(lambda db: calc_ops.delete_calculations(
+            db, ids=None if ids is None else [i for i in ids if sharding.shard_of(i) == db.info["shard"]],
+            calc_type=type, since=since, until=until))
+        return {"deleted": sum(parts)}
+    db = SessionLocal()
+    try:
+        deleted = calc_ops.delete_calculations(db, ids=ids, calc_type=type, since=since, until=until)
+        return {"deleted": deleted}
+    finally:
+        db.close()
+
+
+# ========== Approximate Analytics Endpoints ==========
+
+def _merged_sketches() -> sketches.SketchSet:
+    if not sketches.ANALYTICS_SKETCHES:
+        raise HTTPException(status_code=503, detail="Approximate analytics are disabled")
+    db = SessionLocal()
+    try:
+        return sketches.merged(db)
+    finally:
+        db.close()
+
+
+@app.get("/analytics/distinct-users", response_model=schemas.ApproxDistinct)
+def approx_distinct_users(type: Optional[models.CalculationType] = None):
+    """Estimated number of distinct users, per calculation type or overall (HyperLogLog)."""
+    merged = _merged_sketches()
+    hll = sketches.HyperLogLog()
+    for calc_type, type_hll in merged.users.items():
+        if type is None or calc_type == type.value:
+            hll.merge(type_hll)
+    return schemas.ApproxDistinct(type=type, estimate=round(hll.count(), 1), relative_error=hll.relative_error)
+
+
+@app.get("/analytics/hot-operands", response_model=schemas.ApproxHotPairs)
+def approx_hot_operands(type: Optional[models.CalculationType] = None, limit: int = Query(10, ge=1, le=100)):
+    """Most frequent (type, a, b) inputs with count-min estimates."""
+    merged = _merged_sketches()
+    items = [
+        schemas.HotPair(type=calc_type, a=a, b=b, count_estimate=n)
+        for (calc_type, a, b), n in merged.hot_pairs(type.value if type else None, limit)
+    ]
+    return schemas.ApproxHotPairs(items=items, total=merged.pairs.total,
+                                  error_bound=merged.pairs.error_bound, confidence=merged.pairs.confidence)
+
+
+@app.get("/analytics/result-quantiles", response_model=schemas.ApproxQuantiles)
+def approx_result_quantiles(type: Optional[models.CalculationType] = None,
+                            q: List[float] = Query([0.5, 0.9, 0.99])):
+    """Estimated quantiles of stored results (t-digest)."""
+    if any(not 0 <= value <= 1 for value in q):
+        raise HTTPException(status_code=400, detail="Quantiles must be between 0 and 1")
+    merged = _merged_sketches()
+    digest = sketches.TDigest()
+    for calc_type, type_digest in merged.results.items():
+        if type is None or calc_type == type.value:
+            digest.merge(type_digest)
+    if not digest.count:
+        return schemas.ApproxQuantiles(type=type, count=0, quantiles=[])
+    quantiles = [
+        schemas.ApproxQuantile(q=value, value=digest.quantile(value),
+                               rank_error=sketches.quantile_rank_error(digest, value))
+        for value in q
+    ]
+    return schemas.ApproxQuantiles(type=type, count=digest.count, quantiles=quantiles)
+
+
+# ========== Health Endpoints ==========
+
+@app.get("/health")
+def health():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: warmup finished and the primary database answers."""
+    is_ready, body = warmup.status(engine)
+    return JSONResponse(status_code=200 if is_ready else 503, content=body)
+
+
+# ========== Job Endpoints ==========
+
+@app.post("/jobs", response_model=schemas.JobRead, status_code=202)
+def create_job(job_in: schemas.JobCreate):
+    """Queue a large batch or expression workload for the background workers."""
+    db = SessionLocal()
+    try:
+        job = job_ops.create_job(db, job_in)
+    finally:
+        db.close()
+    worker.pool.notify()
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=schemas.JobRead)
+def read_job(job_id: int):
+    """Report a job's status and progress."""
+    db = SessionLocal()
+    try:
+        job = job_ops.get_job(db, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+    finally:
+        db.close()
+
+
+def _stream_job_results(job_id: int):
+    db = SessionLocal()
+    try:
+        yield from job_ops.iter_job_results(db, job_id)
+    finally:
+        db.close()
+
+
+@app.get("/jobs/{job_id}/result")
+def read_job_result(job_id: int):
+    """Stream a finished job's output as NDJSON, one line per input in order."""
+    db = SessionLocal()
+    try:
+        job = job_ops.get_job(db, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job.status != models.JobStatus.DONE:
+            raise HTTPException(status_code=409, detail=f"Job is {job.status.value}")
+    finally:
+        db.close()
+    return StreamingResponse(_stream_job_results(job_id), media_type="application/x-ndjson")
+
+
+# ========== Admin Endpoints ==========
+
+@app.post("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(profiling.require_admin)])
+def profile_process(seconds: float = Query(5.0, gt=0, le=profiling.MAX_PROFILE_SECONDS)):
+    """Sample all threads for `seconds` and return folded stacks for flamegraph tools."""
+    counts = profiling.StackSampler().run_for(seconds)
+    return profiling.format_folded(counts)
+
+
+@app.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse,
+         dependencies=[Depends(profiling.require_admin)])
+def read_profile(profile_id: str):
+    """Fetch a per-request profile recorded via the X-Profile header."""
+    folded = profiling.get_profile(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return folded
+
+
+@app.get("/admin/traces", dependencies=[Depends(profiling.require_admin)])
+def list_traces(limit: int = Query(50, ge=1, le=tracing.TRACE_BUFFER_SIZE), route: Optional[str] = None):
+    """Most recent traces, newest first, with self time per span name."""
+    traces = [tracing.summary(t) for t in reversed(tracing.recent.traces)]
+    if route is not None:
+        traces = [t for t in traces if t["route"] == route]
+    return traces[:limit]
+
+
+@app.get("/admin/traces/{trace_id}", dependencies=[Depends(profiling.require_admin)])
+def read_trace(trace_id: str):
+    """Every span of one recorded trace."""
+    trace = tracing.recent.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return tracing.detail(trace)
+
+
+@app.post("/admin/analytics/rebuild", dependencies=[Depends(profiling.require_admin)])
+def rebuild_sketches():
+    """Recompute the approximate-analytics sketches from a full table scan."""
+    db = SessionLocal()
+    try:
+        return {"rows": sketches.rebuild(db)}
+    finally:
+        db.close()
+
+
+@app.get("/admin/metrics", dependencies=[Depends(profiling.require_admin)])
+def read_metrics():
+    """Counters aggregated across all worker processes via shared state."""
+    return shared_state.metrics()
+
+
 if __name__ == "__main__":
     # Initialize DB tables for local runs
     init_db()
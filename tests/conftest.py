@@ -2,6 +2,7 @@
 
 import subprocess
 import time
+from contextlib import contextmanager
 import pytest
 
 @pytest.fixture(scope='session')
@@ -12,8 +13,8 @@ def fastapi_server():
     # Start FastAPI app
     fastapi_process = subprocess.Popen(['python', 'main.py'])
     
-    # Define the URL to check if the server is up
-    server_url = 'http://127.0.0.1:8000/'
+    # Poll readiness, which flips once startup warmup has finished
+    server_url = 'http://127.0.0.1:8000/ready'
 
     # Import requests lazily so tests that don't need it won't fail collection
     try:
@@ -83,3 +84,33 @@ def page(browser):
     page = browser.new_page()
     yield page
     page.close()
+
+
+@pytest.fixture
+def max_queries():
+    """
+    Fixture returning a guard that fails the test if the wrapped block issues more
+    than `limit` SQL statements, or repeats any statement `n_plus_one` times.
+
+    Usage:
+        with max_queries(1):
+            client.get("/calculations")
+    """
+    from app.query_counter import QueryCounter, assert_max_queries
+
+    @contextmanager
+    def guard(limit, n_plus_one=2):
+        with QueryCounter() as counter:
+            yield counter
+        assert_max_queries(counter, limit, n_plus_one)
+
+    return guard
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    """Enable admin endpoints for the test and return the headers that authenticate."""
+    from app import profiling
+
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "test-admin")
+    return {"X-Admin-Token": "test-admin"}
@@ -0,0 +1,105 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from main import app
+from app import sketches
+from app.db import init_db, SessionLocal
+from app.operations import calculations as calc_ops
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    init_db()
+    monkeypatch.setattr(sketches, "ANALYTICS_SKETCHES", True)
+    monkeypatch.setattr(sketches, "local", sketches.SketchSet())
+    db = SessionLocal()
+    try:
+        db.query(sketches.models.AnalyticsSketch).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_analytics_disabled_returns_503(monkeypatch):
+    """Test approximate endpoints are unavailable unless sketches are enabled."""
+    monkeypatch.setattr(sketches, "ANALYTICS_SKETCHES", False)
+    assert TestClient(app).get("/analytics/distinct-users").status_code == 503
+
+
+def test_write_path_feeds_sketches(enabled):
+    """Test inserts update hot-operand counts and result quantiles with error bounds."""
+    client = TestClient(app)
+    for i in range(20):
+        client.post("/calculations", json={"a": 2, "b": 3, "type": "Add"})
+        client.post("/calculations", json={"a": i, "b": 1, "type": "Multiply"})
+
+    hot = client.get("/analytics/hot-operands", params={"limit": 1}).json()
+    assert hot["items"][0] == {"type": "Add", "a": 2.0, "b": 3.0, "count_estimate": 20}
+    assert hot["total"] == 40 and 0 < hot["confidence"] < 1 and hot["error_bound"] >= 0
+
+    quantiles = client.get("/analytics/result-quantiles", params={"type": "Multiply", "q": [0, 1]}).json()
+    assert quantiles["count"] == 20
+    assert [item["value"] for item in quantiles["quantiles"]] == [0, 19]
+
+    assert client.get("/analytics/result-quantiles", params={"q": 2}).status_code == 400
+
+
+def test_sketches_merge_across_workers(enabled):
+    """Test readers merge other workers' flushed shards with local state."""
+    db = SessionLocal()
+    try:
+        other = sketches.SketchSet()
+        for user_id in range(1000):
+            other.observe("Add", 1.0, 1.0, 2.0, user_id)
+        db.add(sketches.models.AnalyticsSketch(shard="other-worker", data=other.to_bytes()))
+        db.commit()
+        sketches.local.observe("Add", 1.0, 1.0, 2.0, 5000)
+    finally:
+        db.close()
+
+    body = TestClient(app).get("/analytics/distinct-users", params={"type": "Add"}).json()
+    assert abs(body["estimate"] - 1001) <= 3 * body["relative_error"] * 1001
+
+
+def test_flush_and_rebuild(enabled, admin):
+    """Test flushing persists local sketches and rebuild rescans the table."""
+    client = TestClient(app)
+    client.post("/calculations", json={"a": 7, "b": 7, "type": "Sub"})
+    db = SessionLocal()
+    try:
+        assert sketches.flush(db) is True
+        assert sketches.flush(db) is False  # nothing new
+        assert db.get(sketches.models.AnalyticsSketch, sketches.SHARD) is not None
+        total_rows = calc_ops.get_calculation_stats(db)["count"]
+    finally:
+        db.close()
+
+    r = client.post("/admin/analytics/rebuild", headers=admin)
+    assert r.status_code == 200 and r.json()["rows"] == total_rows
+    hot = client.get("/analytics/hot-operands", params={"type": "Sub"}).json()
+    assert hot["items"] and hot["total"] == total_rows
+
+
+def test_stale_worker_rows_are_folded(enabled):
+    """Test rows of stopped workers merge into one folded row, so restarts don't grow the table."""
+    S = sketches.models.AnalyticsSketch
+    db = SessionLocal()
+    try:
+        for worker in range(3):
+            dead = sketches.SketchSet()
+            dead.observe("Add", 1.0, 1.0, 2.0, worker)
+            db.add(S(shard=f"dead-{worker}", data=dead.to_bytes(), updated_at=datetime(2000, 1, 1, tzinfo=timezone.utc)))
+        db.commit()
+        sketches.local.observe("Add", 1.0, 1.0, 2.0, 99)
+        sketches.flush(db)
+        assert sketches.merged(db).hot_pairs("Add", 1)[0][1] == 4
+
+        assert sketches.fold_stale(db) == 3
+        assert sorted(db.scalars(select(S.shard))) == sorted([sketches.FOLDED_SHARD, sketches.SHARD])
+        assert sketches.fold_stale(db) == 0
+        assert sketches.merged(db).hot_pairs("Add", 1)[0][1] == 4
+    finally:
+        db.close()
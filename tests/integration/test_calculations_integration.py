@@ -1,11 +1,13 @@
 import os
 import pytest
 from fastapi.testclient import TestClient
-from app.db import init_db, SessionLocal
+from app.db import engine, init_db, SessionLocal
 from app import schemas, models
 from app.operations import calculations as calc_ops
 from main import app
 
+POSTGRES = engine.dialect.name == "postgresql"
+
 
 @pytest.fixture(autouse=True)
 def setup_db():
@@ -51,11 +53,12 @@ def test_create_calculation_invalid_type_raises():
 
 # ========== API Integration Tests (BREAD) ==========
 
-def test_add_calculation_via_api():
+def test_add_calculation_via_api(max_queries):
     """Test Add (POST /calculations) endpoint."""
     client = TestClient(app)
     payload = {"a": 10, "b": 5, "type": "Add"}
-    r = client.post("/calculations", json=payload)
+    with max_queries(1):
+        r = client.post("/calculations", json=payload)
     assert r.status_code == 200
     data = r.json()
     assert data["a"] == 10
@@ -65,21 +68,22 @@ def test_add_calculation_via_api():
     assert "id" in data
 
 
-def test_browse_calculations_via_api():
+def test_browse_calculations_via_api(max_queries):
     """Test Browse (GET /calculations) endpoint."""
     client = TestClient(app)
     # Create some calculations first
     client.post("/calculations", json={"a": 5, "b": 3, "type": "Add"})
     client.post("/calculations", json={"a": 10, "b": 2, "type": "Multiply"})
     
-    r = client.get("/calculations")
+    with max_queries(1):
+        r = client.get("/calculations")
     assert r.status_code == 200
     data = r.json()
     assert isinstance(data, list)
     assert len(data) >= 2
 
 
-def test_read_calculation_via_api():
+def test_read_calculation_via_api(max_queries):
     """Test Read (GET /calculations/{id}) endpoint."""
     client = TestClient(app)
     # Create a calculation
@@ -87,7 +91,8 @@ def test_read_calculation_via_api():
     calc_id = create_resp.json()["id"]
     
     # Read it back
-    r = client.get(f"/calculations/{calc_id}")
+    with max_queries(1):
+        r = client.get(f"/calculations/{calc_id}")
     assert r.status_code == 200
     data = r.json()
     assert data["id"] == calc_id
@@ -96,14 +101,15 @@ def test_read_calculation_via_api():
     assert data["result"] == 4
 
 
-def test_read_nonexistent_calculation():
+def test_read_nonexistent_calculation(max_queries):
     """Test Read returns 404 for non-existent calculation."""
     client = TestClient(app)
-    r = client.get("/calculations/99999")
+    with max_queries(1):
+        r = client.get("/calculations/99999")
     assert r.status_code == 404
 
 
-def test_edit_calculation_via_api():
+def test_edit_calculation_via_api(max_queries):
     """Test Edit (PUT /calculations/{id}) endpoint."""
     client = TestClient(app)
     # Create a calculation
@@ -112,7 +118,10 @@ def test_edit_calculation_via_api():
     
     # Update it
     update_payload = {"a": 10, "b": 2, "type": "Sub"}
-    r = client.put(f"/calculations/{calc_id}", json=update_payload)
+    # Postgres updates the row and appends the old values to the history in one statement;
+    # elsewhere the row is read first and the history row is a separate INSERT
+    with max_queries(1 if POSTGRES else 3):
+        r = client.put(f"/calculations/{calc_id}", json=update_payload)
     assert r.status_code == 200
     data = r.json()
     assert data["id"] == calc_id
@@ -122,22 +131,24 @@ def test_edit_calculation_via_api():
     assert data["result"] == 8
 
 
-def test_edit_nonexistent_calculation():
+def test_edit_nonexistent_calculation(max_queries):
     """Test Edit returns 404 for non-existent calculation."""
     client = TestClient(app)
-    r = client.put("/calculations/99999", json={"a": 1, "b": 1, "type": "Add"})
+    with max_queries(1):
+        r = client.put("/calculations/99999", json={"a": 1, "b": 1, "type": "Add"})
     assert r.status_code == 404
 
 
-def test_delete_calculation_via_api():
+def test_delete_calculation_via_api(max_queries):
     """Test Delete (DELETE /calculations/{id}) endpoint."""
     client = TestClient(app)
     # Create a calculation
     create_resp = client.post("/calculations", json={"a": 7, "b": 3, "type": "Multiply"})
     calc_id = create_resp.json()["id"]
     
-    # Delete it
-    r = client.delete(f"/calculations/{calc_id}")
+    # Delete it (and its revision history)
+    with max_queries(2):
+        r = client.delete(f"/calculations/{calc_id}")
     assert r.status_code == 200
     assert "deleted" in r.json()["message"].lower()
     
@@ -146,27 +157,247 @@ def test_delete_calculation_via_api():
     assert get_resp.status_code == 404
 
 
-def test_delete_nonexistent_calculation():
+def test_delete_nonexistent_calculation(max_queries):
     """Test Delete returns 404 for non-existent calculation."""
     client = TestClient(app)
-    r = client.delete("/calculations/99999")
+    with max_queries(2):
+        r = client.delete("/calculations/99999")
     assert r.status_code == 404
 
 
-def test_create_calculation_division_by_zero():
+def test_create_calculation_division_by_zero(max_queries):
     """Test that division by zero returns 400 error."""
     client = TestClient(app)
     payload = {"a": 10, "b": 0, "type": "Divide"}
-    r = client.post("/calculations", json=payload)
+    with max_queries(0):
+        r = client.post("/calculations", json=payload)
     assert r.status_code == 400
     response_data = r.json()
     # Check for error indication - may be in different formats
     assert "division" in str(response_data).lower() or "zero" in str(response_data).lower() or "error" in str(response_data).lower()
 
 
-def test_create_calculation_invalid_type():
+def test_create_calculation_overflow(max_queries):
+    """Test that a result overflowing to inf returns 400 and stores nothing."""
+    client = TestClient(app)
+    with max_queries(0):
+        r = client.post("/calculations", json={"a": 1e308, "b": 10, "type": "Multiply"})
+    assert r.status_code == 400
+    assert "not a finite number" in r.json()["error"]
+
+
+def test_create_calculation_invalid_type(max_queries):
     """Test that invalid calculation type returns 400 error."""
     client = TestClient(app)
     payload = {"a": 5, "b": 3, "type": "InvalidType"}
+    with max_queries(0):
+        r = client.post("/calculations", json=payload)
+    assert r.status_code == 400
+
+
+def test_browse_calculations_time_window(max_queries):
+    """Test Browse filters on created_at when since/until are given."""
+    client = TestClient(app)
+    client.post("/calculations", json={"a": 1, "b": 1, "type": "Add"})
+
+    with max_queries(1):
+        r = client.get("/calculations", params={"since": "2000-01-01T00:00:00Z"})
+    assert r.status_code == 200
+    assert len(r.json()) >= 1
+    assert r.json()[0]["created_at"] is not None
+
+    r = client.get("/calculations", params={"until": "2000-01-01T00:00:00Z"})
+    assert r.status_code == 200
+    assert r.json() == []
+
+
+def test_bulk_delete_calculations_via_api(max_queries):
+    """Test bulk Delete (DELETE /calculations) by id list and by filter."""
+    client = TestClient(app)
+    ids = [client.post("/calculations", json={"a": i, "b": 1, "type": "Add"}).json()["id"] for i in range(3)]
+    client.post("/calculations", json={"a": 9, "b": 3, "type": "Divide"})
+
+    with max_queries(2):
+        r = client.delete("/calculations", params={"ids": ids[:2]})
+    assert r.status_code == 200
+    assert r.json()["deleted"] == 2
+    assert client.get(f"/calculations/{ids[0]}").status_code == 404
+    assert client.get(f"/calculations/{ids[2]}").status_code == 200
+
+    r = client.delete("/calculations", params={"type": "Divide"})
+    assert r.status_code == 200
+    assert r.json()["deleted"] >= 1
+
+
+def test_bulk_delete_requires_filter():
+    """Test bulk Delete refuses to run without ids or a filter."""
+    client = TestClient(app)
+    r = client.delete("/calculations")
+    assert r.status_code == 400
+
+
+def test_update_calculation_existing_and_missing():
+    """Test updating a stored calculation, and that a missing id returns None."""
+    db = SessionLocal()
+    try:
+        calc = calc_ops.create_calculation(db, schemas.CalculationCreate(a=2, b=3, type=models.CalculationType.ADD))
+        updated = calc_ops.update_calculation(
+            db, calc.id, schemas.CalculationCreate(a=2, b=3, type=models.CalculationType.MULTIPLY)
+        )
+        assert updated.result == 6
+        missing = calc_ops.update_calculation(
+            db, 99999, schemas.CalculationCreate(a=1, b=1, type=models.CalculationType.ADD)
+        )
+        assert missing is None
+    finally:
+        db.close()
+
+
+def test_update_calculation_returns_next_revision():
+    """Test an edit returns the new inputs and result as the next revision, and stores them."""
+    db = SessionLocal()
+    try:
+        calc = calc_ops.create_calculation(db, schemas.CalculationCreate(a=2, b=3, type=models.CalculationType.ADD))
+        updated = calc_ops.update_calculation(
+            db, calc.id, schemas.CalculationCreate(a=4, b=3, type=models.CalculationType.SUBTRACT)
+        )
+        assert (updated.a, updated.result, updated.revision) == (4, 1, 2)
+        assert updated.type == models.CalculationType.SUBTRACT
+    finally:
+        db.close()
+    db = SessionLocal()
+    try:
+        stored = calc_ops.get_calculation_by_id(db, calc.id)
+        assert (stored.type, stored.a, stored.result, stored.revision) == (models.CalculationType.SUBTRACT, 4, 1, 2)
+    finally:
+        db.close()
+
+
+def test_calculation_stats_database_and_snapshot_agree(monkeypatch, max_queries):
+    """Test stats from the columnar snapshot match the database aggregate."""
+    from app import columnar
+
+    client = TestClient(app)
+    client.post("/calculations", json={"a": 6, "b": 3, "type": "Divide"})
+    client.post("/calculations", json={"a": 6, "b": 3, "type": "Multiply"})
+
+    r = client.get("/calculations/stats")
+    assert r.status_code == 200
+    from_db = r.json()
+    assert from_db["source"] == "database"
+
+    monkeypatch.setattr(columnar, "COLUMNAR_CACHE", True)
+    monkeypatch.setattr(columnar, "snapshot", columnar.CalculationColumns(capacity=100_000))
+    r = client.get("/calculations/stats")
+    assert r.json() == {**from_db, "source": "snapshot"}
+
+    # Writes keep the snapshot current without reloading it
+    calc_id = client.post("/calculations", json={"a": 1, "b": 1, "type": "Add"}).json()["id"]
+    client.put(f"/calculations/{calc_id}", json={"a": 5, "b": 1, "type": "Add"})
+    with max_queries(0):
+        r = client.get("/calculations/stats", params={"type": "Add"})
+    assert r.json()["sum"] >= 6
+
+    client.delete(f"/calculations/{calc_id}")
+    with max_queries(0):
+        after = client.get("/calculations/stats").json()
+    assert after["count"] == from_db["count"]
+
+
+def test_calculation_stats_fall_back_when_table_exceeds_snapshot(monkeypatch):
+    """Test a table larger than the snapshot is aggregated by the database, not just its newest rows."""
+    from app import columnar
+
+    client = TestClient(app)
+    for a in (1, 2, 3):
+        client.post("/calculations", json={"a": a, "b": 1, "type": "Add"})
+    from_db = client.get("/calculations/stats").json()
+
+    monkeypatch.setattr(columnar, "COLUMNAR_CACHE", True)
+    monkeypatch.setattr(columnar, "snapshot", columnar.CalculationColumns(capacity=2))
+    assert client.get("/calculations/stats").json() == from_db
+    assert not columnar.snapshot.complete
+
+
+def test_browse_enforces_max_page_size():
+    """Test Browse rejects limits above the configured maximum."""
+    client = TestClient(app)
+    r = client.get("/calculations", params={"limit": calc_ops.MAX_PAGE_SIZE + 1})
+    assert r.status_code == 400
+    r = client.get("/calculations", params={"limit": calc_ops.MAX_PAGE_SIZE})
+    assert r.status_code == 200
+
+
+def test_export_calculations_ndjson():
+    """Test Export streams one JSON object per line."""
+    import json
+
+    client = TestClient(app)
+    created = client.post("/calculations", json={"a": 3, "b": 4, "type": "Multiply"}).json()
+    r = client.get("/calculations/export")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    exported = next(row for row in rows if row["id"] == created["id"])
+    assert exported["result"] == 12
+    assert exported["type"] == "Multiply"
+
+
+def test_chunked_iterators_match_browse():
+    """Test the yield_per ORM iterator and the row-tuple path return the same rows."""
+    db = SessionLocal()
+    try:
+        for i in range(5):
+            calc_ops.create_calculation(db, schemas.CalculationCreate(a=i, b=1, type=models.CalculationType.ADD))
+        orm_ids = [c.id for c in calc_ops.iter_calculations(db, chunk_size=2)]
+        rows = list(calc_ops.iter_calculation_rows(db, chunk_size=2))
+        assert [r.id for r in rows] == orm_ids
+        as_dict = calc_ops.calculation_row_to_dict(rows[0])
+        assert set(as_dict) == set(schemas.CalculationRead.model_fields)
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize(
+    "payload, expected",
+    [
+        ({"a": 2, "b": 8, "type": "Power"}, 256.0),
+        ({"a": 10, "b": 4, "type": "Modulus"}, 2.0),
+        ({"a": 81, "type": "Sqrt"}, 9.0),
+        ({"a": 1000, "b": 10, "type": "Log"}, 3.0),
+        ({"operands": [1, 2, 3, 4], "type": "Sum"}, 10.0),
+        ({"operands": [1, 2, 3, 4], "type": "Mean"}, 2.5),
+        ({"operands": [2, 4, 4, 4, 5, 5, 7, 9], "type": "StdDev"}, 2.138089935299395),
+        ({"operands": [10, 20, 30, 40, 50], "b": 75, "type": "Percentile"}, 40.0),
+    ],
+)
+def test_scientific_and_aggregate_calculations(payload, expected):
+    """Test new calculation types compute and persist their result and operands."""
+    client = TestClient(app)
     r = client.post("/calculations", json=payload)
+    assert r.status_code == 200, r.text
+    data = r.json()
+    assert data["result"] == pytest.approx(expected)
+    assert data["operands"] == payload.get("operands")
+    stored = client.get(f"/calculations/{data['id']}").json()
+    assert stored["result"] == pytest.approx(expected)
+    assert stored["operands"] == payload.get("operands")
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"a": 1, "type": "Add"},
+        {"a": 1, "b": 0, "type": "Modulus"},
+        {"a": -4, "type": "Sqrt"},
+        {"operands": [], "type": "Mean"},
+        {"operands": [1, 2], "type": "Percentile"},
+        {"a": 1, "b": 2, "operands": [1], "type": "Add"},
+        {"operands": [1.0], "type": "StdDev"},
+    ],
+)
+def test_invalid_scientific_and_aggregate_calculations(payload):
+    """Test missing or out-of-domain operands return 400."""
+    r = TestClient(app).post("/calculations", json=payload)
     assert r.status_code == 400
+    assert "error" in r.json()
@@ -0,0 +1,82 @@
+import csv
+import json
+import random
+
+import pytest
+from sqlalchemy import func, select
+
+from app import cli, models
+from app.db import init_db, SessionLocal
+
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    init_db()
+    yield
+
+
+def _ndjson(path, records):
+    path.write_text("".join((r if isinstance(r, str) else json.dumps(r)) + "\n" for r in records))
+    return str(path)
+
+
+def _rows(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_ndjson_results_and_errors_in_order(tmp_path):
+    """Test each line gets a result or an error, in input order, whichever way it fails."""
+    src = _ndjson(tmp_path / "in.ndjson", [
+        {"type": "Add", "a": 1, "b": 2},
+        "not json",
+        {"type": "Divide", "a": 1, "b": 0},
+        {"type": "Sqrt", "a": -4},
+        {"type": "Mean", "operands": [1, 2, 3]},
+    ])
+    out = tmp_path / "out.ndjson"
+    assert cli.main([src, "-o", str(out), "--workers", "0", "--chunk-size", "2"]) == 1
+    rows = _rows(out)
+    assert [row["line"] for row in rows] == [1, 2, 3, 4, 5]
+    assert rows[0]["result"] == 3 and rows[4]["result"] == 2
+    assert all("error" in row for row in rows[1:4])
+    assert "Division by zero" in rows[2]["error"]
+
+
+def test_process_pool_matches_in_process(tmp_path):
+    """Test chunks evaluated in worker processes come back complete and in order."""
+    src = _ndjson(tmp_path / "in.ndjson", [{"type": "Multiply", "a": i, "b": 2} for i in range(500)])
+    serial, pooled = tmp_path / "serial.ndjson", tmp_path / "pooled.ndjson"
+    assert cli.main([src, "-o", str(serial), "--workers", "0", "--chunk-size", "64"]) == 0
+    assert cli.main([src, "-o", str(pooled), "--workers", "2", "--chunk-size", "64"]) == 0
+    assert _rows(pooled) == _rows(serial)
+    assert [row["result"] for row in _rows(pooled)] == [2.0 * i for i in range(500)]
+
+
+def test_csv_in_csv_out(tmp_path):
+    """Test CSV input with empty cells and ;-separated operands, written back as CSV."""
+    src = tmp_path / "in.csv"
+    src.write_text("type,a,b,operands\nPower,2,10,\nSum,,,1;2;3.5\nLog,,,\n")
+    out = tmp_path / "out.csv"
+    assert cli.main([str(src), "-o", str(out), "--workers", "0"]) == 1
+    with open(out, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [(row["line"], row["result"]) for row in rows[:2]] == [("2", "1024.0"), ("3", "6.5")]
+    assert rows[1]["operands"] == "1.0;2.0;3.5"
+    assert "requires a" in rows[2]["error"]
+
+
+def test_push_to_database(tmp_path):
+    """Test --db inserts the valid results in bulk and skips the failed records."""
+    marker = random.randint(10**6, 10**9) + 0.5  # unique inputs, in case the database persists between runs
+    src = _ndjson(tmp_path / "in.ndjson", [{"type": "Add", "a": marker, "b": i} for i in range(30)]
+                  + [{"type": "Sqrt", "a": -1}])
+    assert cli.main([src, "--db", "--workers", "0", "--chunk-size", "8"]) == 1
+
+    db = SessionLocal()
+    try:
+        c = models.Calculation
+        count, total = db.execute(select(func.count(), func.sum(c.result)).where(c.a == marker)).one()
+    finally:
+        db.close()
+    assert count == 30
+    assert total == sum(marker + i for i in range(30))
@@ -0,0 +1,130 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import models, pg, schemas
+from app.db import (LAST_WRITE_COOKIE, Base, ReadYourWritesMiddleware, ReplicaRouter, RoutingSession,
+                    client_writes, make_engine)
+from app.operations import calculations as calc_ops
+
+
+@pytest.fixture
+def routed(tmp_path):
+    """A primary and a replica backed by two separate SQLite files."""
+    primary = make_engine(f"sqlite:///{tmp_path / 'primary.sqlite'}")
+    replica = make_engine(f"sqlite:///{tmp_path / 'replica.sqlite'}")
+    Base.metadata.create_all(bind=primary)
+    Base.metadata.create_all(bind=replica)
+    router = ReplicaRouter([replica], sticky_seconds=0)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=primary, class_=RoutingSession, router=router)
+    yield factory, router
+    primary.dispose()
+    replica.dispose()
+
+
+def _create(factory):
+    db = factory()
+    try:
+        calc = calc_ops.create_calculation(db, schemas.CalculationCreate(a=1, b=2, type=models.CalculationType.ADD))
+        # Same session re-reads from the primary after writing
+        assert calc_ops.get_calculation_by_id(db, calc.id) is not None
+        return calc.id
+    finally:
+        db.close()
+
+
+def test_reads_go_to_replica_and_writes_to_primary(routed):
+    """Test that a fresh session reads from the (unreplicated) replica."""
+    factory, _ = routed
+    calc_id = _create(factory)
+
+    db = factory()
+    try:
+        # The replica file never received the row
+        assert calc_ops.get_calculation_by_id(db, calc_id) is None
+        assert calc_ops.get_all_calculations(db) == []
+    finally:
+        db.close()
+
+
+def _read(factory, calc_id):
+    db = factory()
+    try:
+        return calc_ops.get_calculation_by_id(db, calc_id)
+    finally:
+        db.close()
+
+
+def test_read_your_writes_window(routed):
+    """Test that a client's reads stick to the primary after its commit, and other clients' don't."""
+    factory, router = routed
+    router.sticky_seconds = 60
+    with client_writes() as writer:
+        calc_id = _create(factory)
+        assert writer["last_write"] is not None
+        assert _read(factory, calc_id) is not None
+
+    with client_writes(writer["last_write"]):
+        assert _read(factory, calc_id) is not None
+    with client_writes():
+        assert _read(factory, calc_id) is None
+    assert _read(factory, calc_id) is None
+
+
+def test_read_your_writes_cookie(routed):
+    """Test the middleware hands the last write time to the client and honours it on the next request."""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    factory, router = routed
+    router.sticky_seconds = 60
+    app = FastAPI()
+    app.add_middleware(ReadYourWritesMiddleware, router=router)
+
+    @app.post("/calc")
+    def create():
+        return {"id": _create(factory)}
+
+    @app.get("/calc/{calc_id}")
+    def read(calc_id: int):
+        return {"found": _read(factory, calc_id) is not None}
+
+    client = TestClient(app)
+    r = client.post("/calc")
+    assert LAST_WRITE_COOKIE in r.cookies
+    calc_id = r.json()["id"]
+    assert client.get(f"/calc/{calc_id}").json() == {"found": True}
+    # A different client without the cookie reads the (lagging) replica
+    assert TestClient(app).get(f"/calc/{calc_id}").json() == {"found": False}
+
+
+def test_update_and_delete_use_primary(routed):
+    """Test that read-modify-write paths see primary data even with no sticky window."""
+    factory, _ = routed
+    calc_id = _create(factory)
+
+    db = factory()
+    try:
+        updated = calc_ops.update_calculation(
+            db, calc_id, schemas.CalculationCreate(a=3, b=4, type=models.CalculationType.MULTIPLY)
+        )
+        assert updated is not None and updated.result == 12
+    finally:
+        db.close()
+
+    db = factory()
+    try:
+        assert calc_ops.delete_calculation(db, calc_id) is True
+    finally:
+        db.close()
+
+
+def test_copy_connection_is_the_primary(routed):
+    """Test COPY's raw connection comes from the primary even in a fresh session."""
+    factory, router = routed
+    db = factory()
+    try:
+        conn = pg.write_connection(db, models.Calculation.__table__)
+        assert conn.engine is db.bind
+        assert conn.engine is not router.replicas[0]
+    finally:
+        db.close()
@@ -0,0 +1,96 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+from main import app
+from app import dedup, models, schemas
+from app.db import init_db, SessionLocal
+from app.operations import calculations as calc_ops
+
+
+@pytest.fixture
+def db():
+    init_db()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def dedup_on(monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_STORAGE", True)
+    dedup.known.clear()
+
+
+def _canonical_count(db, a, b):
+    O = models.CalculationOperands
+    return db.scalar(select(func.count()).select_from(O).where(O.a == a, O.b == b))
+
+
+def test_duplicates_share_one_canonical_row(db, dedup_on, monkeypatch, max_queries):
+    """Test duplicate inputs are stored once and known tuples skip compute_result."""
+    computed = []
+    real = calc_ops.compute_result
+    monkeypatch.setattr(calc_ops, "compute_result", lambda calc_in: computed.append(1) or real(calc_in))
+    client = TestClient(app)
+    ids = [client.post("/calculations", json={"a": 123.5, "b": 4, "type": "Multiply"}).json()["id"]
+           for _ in range(3)]
+    with max_queries(1):
+        r = client.post("/calculations", json={"a": 123.5, "b": 4, "type": "Multiply"})
+    assert r.json()["result"] == 494.0
+    assert len(computed) == 1
+    assert _canonical_count(db, 123.5, 4) == 1
+
+    raw = db.get(models.Calculation, ids[0])
+    assert raw.a is None and raw.result is None and raw.operand_id is not None
+    db.expire_all()
+
+    read = client.get(f"/calculations/{ids[1]}").json()
+    assert (read["a"], read["b"], read["result"]) == (123.5, 4.0, 494.0)
+    browsed = [row for row in client.get("/calculations", params={"limit": 1000}).json() if row["id"] in ids]
+    assert [row["result"] for row in browsed] == [494.0] * 3
+
+
+def test_dedup_update_and_stats(db, dedup_on):
+    """Test edits repoint the reference and stats resolve results through the join."""
+    client = TestClient(app)
+    calc_id = client.post("/calculations", json={"a": 1, "b": 1, "type": "Add"}).json()["id"]
+    r = client.put(f"/calculations/{calc_id}", json={"a": 9, "b": 3, "type": "Divide"})
+    assert r.status_code == 200 and r.json()["result"] == 3.0
+    assert client.get(f"/calculations/{calc_id}").json()["type"] == "Divide"
+
+    stats = calc_ops.get_calculation_stats(db)
+    expected = db.execute(dedup.calculation_select(func.sum(dedup.result_column(True)), dedup=True)).scalar()
+    assert stats["sum"] == pytest.approx(expected)
+
+
+def test_convert_existing_and_prune(db, monkeypatch):
+    """Test inline rows convert in place, reads are unchanged and orphans are pruned."""
+    calcs = [calc_ops.create_calculation(db, schemas.CalculationCreate(a=77.25, b=2, type="Sub")) for _ in range(4)]
+    monkeypatch.setattr(dedup, "DEDUP_STORAGE", True)
+    before = [calc_ops.calculation_row_to_dict(row) for row in calc_ops.iter_calculation_rows(db)]
+    assert dedup.convert_existing(db, chunk_size=3) >= 4
+    assert _canonical_count(db, 77.25, 2) == 1
+    after = [calc_ops.calculation_row_to_dict(row) for row in calc_ops.iter_calculation_rows(db)]
+    assert after == before
+
+    for calc in calcs:
+        calc_ops.delete_calculation(db, calc.id)
+    assert dedup.prune(db) >= 1
+    assert _canonical_count(db, 77.25, 2) == 0
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_hot_tuples_report(db, monkeypatch, enabled):
+    """Test the exact hot-tuple report in both storage layouts."""
+    monkeypatch.setattr(dedup, "DEDUP_STORAGE", enabled)
+    client = TestClient(app)
+    for _ in range(30):
+        client.post("/calculations", json={"a": 31337, "b": 7, "type": "Modulus"})
+    r = client.get("/calculations/hot", params={"type": "Modulus", "limit": 1})
+    assert r.status_code == 200
+    top = r.json()[0]
+    assert (top["a"], top["b"], top["result"]) == (31337.0, 7.0, 31337 % 7)
+    assert top["count"] >= 30
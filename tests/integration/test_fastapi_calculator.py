@@ -152,3 +152,78 @@ def test_divide_by_zero_api(client):
     # Assert that the 'error' field contains the correct error message
     assert "Cannot divide by zero!" in response.json()['error'], \
         f"Expected error message 'Cannot divide by zero!', got '{response.json()['error']}'"
+
+def test_single_operation_rejects_non_finite_result(client):
+    """
+    Test the single-operation routes share `evaluate`, so an overflow to inf is a 400 like in `/compute`.
+    """
+    response = client.post('/multiply', json={'a': 1e308, 'b': 10})
+    assert response.status_code == 400
+    assert "not a finite number" in response.json()['error']
+
+# ---------------------------------------------
+# Test Function: test_compute_batch_api
+# ---------------------------------------------
+
+def test_compute_batch_api(client):
+    """
+    Test the Batch Compute API Endpoint.
+
+    This test verifies that the `/compute` endpoint evaluates a list of mixed
+    operations and returns results and per-item errors in request order.
+
+    Steps:
+    1. Send a POST request to `/compute` with four valid items, one division by zero
+       and one unknown operation.
+    2. Assert that the response status code is `200 OK`.
+    3. Assert that each result lines up with its item.
+    """
+    items = [
+        {'op': 'add', 'a': 10, 'b': 5},
+        {'op': 'subtract', 'a': 10, 'b': 5},
+        {'op': 'multiply', 'a': 10, 'b': 5},
+        {'op': 'divide', 'a': 10, 'b': 5},
+        {'op': 'divide', 'a': 10, 'b': 0},
+        {'op': 'cube', 'a': 2, 'b': 3},
+    ]
+    response = client.post('/compute', json={'items': items})
+    assert response.status_code == 200, f"Expected status code 200, got {response.status_code}"
+
+    results = response.json()['results']
+    assert [r['result'] for r in results[:4]] == [15, 5, 50, 2]
+    assert results[4]['result'] is None
+    assert "Cannot divide by zero!" in results[4]['error']
+    assert "Unsupported operation" in results[5]['error']
+
+# ---------------------------------------------
+# Test Function: test_compute_batch_non_finite_results
+# ---------------------------------------------
+
+def test_compute_batch_non_finite_results(client):
+    """
+    Test that an item overflowing to inf (or NaN) reports its own error instead of failing the batch.
+    """
+    items = [
+        {'op': 'multiply', 'a': 1e308, 'b': 10},
+        {'op': 'subtract', 'a': -1e308, 'b': 1e308},
+        {'op': 'add', 'a': 1, 'b': 2},
+    ]
+    response = client.post('/compute', json={'items': items})
+    assert response.status_code == 200, f"Expected status code 200, got {response.status_code}"
+
+    results = response.json()['results']
+    assert results[0]['result'] is None and "not a finite number" in results[0]['error']
+    assert results[1]['result'] is None and "not a finite number" in results[1]['error']
+    assert results[2]['result'] == 3
+
+# ---------------------------------------------
+# Test Function: test_compute_batch_invalid_input
+# ---------------------------------------------
+
+def test_compute_batch_invalid_input(client):
+    """
+    Test that a malformed batch is rejected as a whole with `400 Bad Request`.
+    """
+    response = client.post('/compute', json={'items': [{'op': 'add', 'a': 'x', 'b': 1}]})
+    assert response.status_code == 400, f"Expected status code 400, got {response.status_code}"
+    assert 'error' in response.json()
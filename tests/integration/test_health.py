@@ -0,0 +1,50 @@
+from fastapi.testclient import TestClient
+
+from main import app
+from app import warmup
+
+
+def test_health_is_always_ok():
+    """Test liveness does not depend on warmup."""
+    client = TestClient(app)
+    r = client.get("/health")
+    assert r.status_code == 200
+    assert r.json() == {"status": "ok"}
+
+
+def test_not_ready_before_warmup():
+    """Test readiness reports 503 until the lifespan warmup has run."""
+    warmup.state.reset()
+    client = TestClient(app)
+    r = client.get("/ready")
+    assert r.status_code == 503
+    assert r.json()["status"] == "starting"
+
+
+def test_ready_after_warmup():
+    """Test startup warmup runs every step and flips readiness."""
+    with TestClient(app) as client:
+        r = client.get("/ready")
+        assert r.status_code == 200
+        body = r.json()
+        assert body["status"] == "ready" and body["database"] is True
+        assert {"database_pool", "templates", "validation"} <= set(body["warmup_ms"])
+        assert "warmup_errors" not in body
+    assert warmup.state.ready is False
+
+
+def test_ready_reports_database_outage(monkeypatch):
+    """Test readiness fails when the database stops answering."""
+    monkeypatch.setattr(warmup.state, "ready", True)
+    monkeypatch.setattr(warmup, "ping", lambda engine: False)
+    r = TestClient(app).get("/ready")
+    assert r.status_code == 503
+    assert r.json()["status"] == "unavailable"
+
+
+def test_failed_optional_step_is_recorded():
+    """Test a failing optional step is recorded without aborting warmup."""
+    state = warmup.Warmup()
+    state.run("broken", lambda: 1 / 0)
+    state.run("fine", lambda: None)
+    assert "broken" in state.errors and set(state.steps) == {"broken", "fine"}
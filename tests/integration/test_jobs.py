@@ -0,0 +1,145 @@
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import models, worker
+from app.db import init_db, SessionLocal
+from app.operations import jobs as job_ops
+from app.worker import JobWorkerPool
+from main import app
+
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    init_db()
+    yield
+
+
+def _drain():
+    pool = JobWorkerPool(workers=0)
+    while pool.run_once():
+        pass
+
+
+def test_job_lifecycle_items():
+    """Test a queued item job reports progress and streams results in order."""
+    client = TestClient(app)
+    items = [{"op": "add", "a": i, "b": 1} for i in range(25)] + [{"op": "divide", "a": 1, "b": 0}]
+    r = client.post("/jobs", json={"items": items})
+    assert r.status_code == 202
+    job = r.json()
+    assert job["status"] == "queued" and job["total"] == 26 and job["completed"] == 0
+
+    assert client.get(f"/jobs/{job['id']}/result").status_code == 409
+
+    _drain()
+    status = client.get(f"/jobs/{job['id']}").json()
+    assert status["status"] == "done" and status["completed"] == 26
+
+    r = client.get(f"/jobs/{job['id']}/result")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert [line["result"] for line in lines[:25]] == [i + 1 for i in range(25)]
+    assert lines[25]["result"] is None and "zero" in lines[25]["error"]
+
+
+def test_job_expressions():
+    """Test expression jobs evaluate each expression and report per-line errors."""
+    client = TestClient(app)
+    expressions = ["2 * (3 + 4)", "import os", "-" * 999 + "1", "1e308 * 10"]
+    job = client.post("/jobs", json={"expressions": expressions}).json()
+    _drain()
+    assert client.get(f"/jobs/{job['id']}").json()["status"] == "done"
+    lines = [json.loads(line) for line in client.get(f"/jobs/{job['id']}/result").text.splitlines()]
+    assert lines[0] == {"result": 14}
+    for line in lines[1:]:
+        assert line["result"] is None and line["error"]
+
+
+def test_job_validation_and_missing():
+    """Test a job needs exactly one workload, and unknown ids return 404."""
+    client = TestClient(app)
+    assert client.post("/jobs", json={}).status_code == 400
+    assert client.post("/jobs", json={"items": [], "expressions": []}).status_code == 400
+    assert client.get("/jobs/999999").status_code == 404
+    assert client.get("/jobs/999999/result").status_code == 404
+
+
+def test_job_resumes_from_last_chunk():
+    """Test an interrupted job continues after its last committed chunk."""
+    db = SessionLocal()
+    try:
+        from app import schemas
+
+        job = job_ops.create_job(db, schemas.JobCreate(expressions=[f"{i} + 0" for i in range(10)]))
+        assert job_ops.claim_next_job(db) == job.id
+        # Simulate a worker that died after committing the first chunk of 4
+        db.add(models.JobResult(job_id=job.id, seq=0, data=job_ops.evaluate_chunk("expressions", ["0", "1", "2", "3"])))
+        job.completed = 4
+        db.commit()
+
+        job_ops.run_job(db, job.id, chunk_size=3)
+        output = "".join(job_ops.iter_job_results(db, job.id))
+        assert [json.loads(line)["result"] for line in output.splitlines()] == list(range(10))
+    finally:
+        db.close()
+
+
+def test_claim_is_exclusive():
+    """Test a job can only be claimed once."""
+    db = SessionLocal()
+    try:
+        from app import schemas
+
+        _drain()
+        job = job_ops.create_job(db, schemas.JobCreate(expressions=["1"]))
+        assert job_ops.claim_next_job(db) == job.id
+        assert job_ops.claim_next_job(db) is None
+        assert job_ops.requeue_stale_jobs(db, stale_seconds=-60) == 1
+        assert job_ops.claim_next_job(db) == job.id
+    finally:
+        db.close()
+
+
+def test_api_starts_no_workers_by_default():
+    """Test the API leaves the queue to the worker service unless JOB_WORKERS is set."""
+    with TestClient(app):
+        assert worker.JOB_WORKERS == 0
+        assert not worker.pool.running
+
+
+def test_in_app_workers_process_jobs(monkeypatch):
+    """Test the worker pool started with the app finishes a job in the background."""
+    monkeypatch.setattr(worker, "JOB_WORKERS", 2)
+    monkeypatch.setattr(worker.pool, "workers", 2)
+    with TestClient(app) as client:
+        job = client.post("/jobs", json={"items": [{"op": "multiply", "a": 6, "b": 7}]}).json()
+        deadline = time.time() + 5
+        while client.get(f"/jobs/{job['id']}").json()["status"] != "done":
+            assert time.time() < deadline, "job did not finish"
+            time.sleep(0.05)
+        assert json.loads(client.get(f"/jobs/{job['id']}/result").text) == {"result": 42.0}
+
+
+def test_running_pool_requeues_stale_jobs():
+    """Test a job orphaned while the pool is running is picked up again without a restart."""
+    _drain()
+    pool = JobWorkerPool(workers=1, poll_interval=0.01, requeue_interval=0.05, stale_seconds=-60).start()
+    db = SessionLocal()
+    try:
+        # Claimed by a worker that then died
+        job = models.Job(kind=job_ops.KIND_EXPRESSIONS, payload=json.dumps(["2 * 21"]), total=1, completed=0,
+                         status=models.JobStatus.RUNNING)
+        db.add(job)
+        db.commit()
+        deadline = time.time() + 5
+        while db.get(models.Job, job.id, populate_existing=True).status != models.JobStatus.DONE:
+            assert time.time() < deadline, "stale job was not requeued"
+            db.rollback()
+            time.sleep(0.05)
+    finally:
+        db.close()
+        pool.stop()
@@ -0,0 +1,76 @@
+import uuid
+
+import pytest
+from sqlalchemy import BigInteger, Column, Float, ForeignKey, Integer, MetaData, Table, create_engine, insert, inspect, select, text
+from sqlalchemy import Enum as SQLEnum
+
+from app import migrations, models
+from app.db import DATABASE_URL, Base, make_engine
+
+POSTGRES = DATABASE_URL.startswith("postgresql")
+
+
+def _legacy_tables(metadata: MetaData) -> Table:
+    """The calculations table as the first release created it."""
+    Table("users", metadata, Column("id", Integer, primary_key=True))
+    return Table(
+        "calculations", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("a", Float, nullable=False),
+        Column("b", Float, nullable=False),
+        Column("type", SQLEnum("ADD", "SUBTRACT", "MULTIPLY", "DIVIDE", name="calculation_type"), nullable=False),
+        Column("result", Float, nullable=True),
+        Column("user_id", Integer, ForeignKey("users.id"), nullable=True),
+    )
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def legacy(request, tmp_path):
+    """An engine on a database holding one row in the legacy calculations table."""
+    if request.param == "sqlite":
+        bind = make_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+        schema = None
+    else:
+        if not POSTGRES:
+            pytest.skip("needs DATABASE_URL pointing at Postgres")
+        schema = f"legacy_{uuid.uuid4().hex[:8]}"
+        with create_engine(DATABASE_URL).begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {schema}"))
+        bind = create_engine(DATABASE_URL, connect_args={"options": f"-csearch_path={schema}"})
+    metadata = MetaData()
+    legacy_calculations = _legacy_tables(metadata)
+    metadata.create_all(bind)
+    with bind.begin() as conn:
+        conn.execute(insert(legacy_calculations), {"a": 2, "b": 3, "type": "ADD", "result": 5})
+    yield bind
+    bind.dispose()
+    if schema:
+        with create_engine(DATABASE_URL).begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+
+
+def _upgrade(bind):
+    Base.metadata.create_all(bind=bind)
+    migrations.upgrade(bind)
+
+
+def test_upgrade_brings_legacy_calculations_up_to_date(legacy):
+    """Test an old calculations table gains the current columns and keeps its rows."""
+    _upgrade(legacy)
+    _upgrade(legacy)  # a second run finds nothing to do
+
+    calc = models.Calculation.__table__
+    assert {column["name"] for column in inspect(legacy).get_columns("calculations")} == set(calc.c.keys())
+    with legacy.begin() as conn:
+        row = conn.execute(select(calc).where(calc.c.id == 1)).one()
+        assert (row.a, row.b, row.result, row.revision) == (2, 3, 5, 1)
+        assert row.created_at is not None
+        conn.execute(text("INSERT INTO calculations (a, b, type, operands, result) "
+                          "VALUES (NULL, NULL, 'PERCENTILE', '[1, 2]', 1.5)"))
+        operand_id = conn.execute(insert(models.CalculationOperands.__table__).values(
+            key_hash="0" * 32, type=models.CalculationType.ADD, a=1, b=1, result=2)).inserted_primary_key[0]
+        conn.execute(text("INSERT INTO calculations (type, operand_id) VALUES ('ADD', :id)"), {"id": operand_id})
+    assert "ix_calculations_operand_id" in {index["name"] for index in inspect(legacy).get_indexes("calculations")}
+    if legacy.dialect.name == "postgresql":
+        id_type = next(c["type"] for c in inspect(legacy).get_columns("calculations") if c["name"] == "id")
+        assert isinstance(id_type, BigInteger)
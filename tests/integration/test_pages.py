@@ -0,0 +1,53 @@
+from fastapi.testclient import TestClient
+
+from main import app
+from app.pages import choose_encoding
+
+
+def test_index_served_with_etag_and_cache_control():
+    """Test the index page is served from memory with caching headers."""
+    client = TestClient(app)
+    r = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert r.status_code == 200
+    assert "Hello World" in r.text
+    assert r.headers["etag"].startswith('"')
+    assert "max-age" in r.headers["cache-control"]
+    assert "content-encoding" not in r.headers
+
+
+def test_page_gzip_variant():
+    """Test that a gzip-capable client receives the pre-compressed variant."""
+    client = TestClient(app)
+    r = client.get("/login", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.headers["etag"].endswith('-gzip"')
+    # httpx transparently decodes the body
+    assert "<html" in r.text
+
+
+def test_page_not_modified_on_matching_etag():
+    """Test that a matching If-None-Match returns 304 without a body."""
+    client = TestClient(app)
+    first = client.get("/register", headers={"Accept-Encoding": "identity"})
+    etag = first.headers["etag"]
+    r = client.get("/register", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["etag"] == etag
+
+
+def test_large_json_is_gzipped():
+    """Test that large JSON responses are compressed by the middleware."""
+    client = TestClient(app)
+    r = client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+
+
+def test_choose_encoding():
+    available = {"identity": b"", "gzip": b""}
+    assert choose_encoding("gzip, deflate, br", available) == "gzip"
+    assert choose_encoding("gzip;q=0", available) == "identity"
+    assert choose_encoding("", available) == "identity"
+    assert choose_encoding("*", available) == "gzip"
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+from main import app
+from app import models, pg
+from app.db import Base, SessionLocal, engine
+
+POSTGRES = engine.dialect.name == "postgresql"
+# CI sets REQUIRE_POSTGRES so these fail loudly instead of skipping if the database isn't Postgres
+requires_postgres = pytest.mark.skipif(
+    not POSTGRES and not os.getenv("REQUIRE_POSTGRES"), reason="needs DATABASE_URL pointing at Postgres (docker-compose.postgres.yml)")
+
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    Base.metadata.create_all(bind=engine)
+    yield
+
+
+def _rows(n, offset=0):
+    return [{"a": float(i), "b": 2.0, "type": models.CalculationType.MULTIPLY, "operands": None,
+             "result": i * 2.0} for i in range(offset, offset + n)]
+
+
+def test_engine_options_only_for_postgres():
+    assert pg.engine_options("sqlite:///x.sqlite") == {}
+    options = pg.engine_options("postgresql://u:p@localhost/db")
+    assert options["insertmanyvalues_page_size"] == pg.PG_INSERT_PAGE_SIZE
+    assert "connect_args" not in options  # psycopg2 can't prepare server-side
+    assert pg.engine_options("postgresql+psycopg://u:p@localhost/db")["connect_args"] == {
+        "prepare_threshold": pg.PG_PREPARE_THRESHOLD}
+
+
+def test_copy_csv_encoding():
+    table = models.AnalyticsSketch.__table__
+    buffer = pg._copy_buffer(table, ["shard", "data"], [{"shard": 'a"b', "data": b"\x00\xff"}],
+                             engine.dialect)
+    assert buffer.getvalue() == '"a""b","\\x00ff"\n'
+    assert pg._csv_field(None) == ""
+
+
+def test_copy_rows_and_insert_returning():
+    """Test both helpers on the current database (portable fallbacks on SQLite)."""
+    table = models.Calculation.__table__
+    db = SessionLocal()
+    try:
+        before = db.scalar(select(func.count()).select_from(table))
+        assert pg.copy_rows(db, table, _rows(50)) == 50
+        keys = pg.insert_returning(db, table, _rows(20, offset=100), table.c.id, table.c.a)
+        db.commit()
+        assert [a for _, a in keys] == [float(i) for i in range(100, 120)]
+        assert len({calc_id for calc_id, _ in keys}) == 20
+        assert db.scalar(select(func.count()).select_from(table)) == before + 70
+    finally:
+        db.close()
+
+
+def test_bulk_create_endpoint():
+    """Test /calculations/bulk returns stored rows, or just a count without RETURNING."""
+    client = TestClient(app)
+    items = [{"a": i, "b": 3, "type": "Add"} for i in range(5)] + [{"type": "Sum", "operands": [1, 2, 3]}]
+    r = client.post("/calculations/bulk", json={"items": items})
+    assert r.status_code == 200
+    body = r.json()
+    assert [c["result"] for c in body] == [3, 4, 5, 6, 7, 6]
+    assert client.get(f"/calculations/{body[-1]['id']}").json()["operands"] == [1, 2, 3]
+
+    r = client.post("/calculations/bulk", params={"returning": "false"}, json={"items": items})
+    assert r.json() == {"inserted": 6}
+
+    r = client.post("/calculations/bulk", json={"items": [{"a": 1, "b": 0, "type": "Modulus"}]})
+    assert r.status_code == 400
+
+
+@requires_postgres
+def test_export_uses_server_side_cursor():
+    """Test yield_per streams through a named cursor on Postgres."""
+    db = SessionLocal()
+    try:
+        result = db.execute(select(models.Calculation.id).execution_options(yield_per=10))
+        assert result.raw.cursor.name  # psycopg2 names server-side cursors
+        result.close()
+    finally:
+        db.close()
+
+
+@requires_postgres
+def test_copy_uses_copy_protocol(monkeypatch):
+    """Test the Postgres path never falls back to executemany INSERT."""
+    monkeypatch.setattr(pg, "insert", None)
+    table = models.Calculation.__table__
+    db = SessionLocal()
+    try:
+        assert pg.copy_rows(db, table, _rows(10)) == 10
+        db.commit()
+    finally:
+        db.close()
+
+
+@pytest.mark.skipif(engine.dialect.driver != "psycopg", reason="needs a postgresql+psycopg:// DATABASE_URL")
+def test_repeated_queries_are_prepared_server_side():
+    """Test psycopg 3 prepares a statement once it has run PG_PREPARE_THRESHOLD times."""
+    stmt = select(models.Calculation.id).where(models.Calculation.id == -1)
+    with engine.connect() as conn:
+        assert conn.connection.driver_connection.prepare_threshold == pg.PG_PREPARE_THRESHOLD
+        for _ in range(pg.PG_PREPARE_THRESHOLD + 2):
+            conn.execute(stmt).all()
+        prepared = conn.exec_driver_sql("SELECT statement FROM pg_prepared_statements").scalars().all()
+    assert any("calculations.id" in statement for statement in prepared)
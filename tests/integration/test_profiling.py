@@ -0,0 +1,81 @@
+import logging
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from main import app
+from app import profiling
+from app.db import engine
+
+
+def test_admin_endpoints_require_token(admin):
+    """Test admin profiling endpoints reject missing or wrong tokens."""
+    client = TestClient(app)
+    assert client.post("/admin/profile", params={"seconds": 0.05}).status_code == 403
+    r = client.post("/admin/profile", params={"seconds": 0.05}, headers={"X-Admin-Token": "nope"})
+    assert r.status_code == 403
+
+
+def test_admin_profile_returns_folded_stacks(admin):
+    """Test a timed profile returns text in folded 'stack count' format."""
+    client = TestClient(app)
+    r = client.post("/admin/profile", params={"seconds": 0.1}, headers=admin)
+    assert r.status_code == 200
+    line = r.text.splitlines()[0]
+    stack, count = line.rsplit(" ", 1)
+    assert ";" in stack and int(count) > 0
+
+
+def test_per_request_profile_header(admin):
+    """Test X-Profile stores a profile retrievable by the returned id."""
+    client = TestClient(app)
+    r = client.get("/calculations", headers={**admin, "X-Profile": "1"})
+    assert r.status_code == 200
+    profile_id = r.headers["x-profile-id"]
+    assert client.get(f"/admin/profiles/{profile_id}", headers=admin).status_code == 200
+    assert client.get("/admin/profiles/missing", headers=admin).status_code == 404
+
+
+def test_sampler_captures_busy_thread():
+    sampler = profiling.StackSampler(interval=0.001).start()
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    counts = sampler.stop()
+    assert any("test_sampler_captures_busy_thread" in stack for stack in counts)
+
+
+def test_slow_request_logs_sql_and_stack(caplog, monkeypatch):
+    """Test requests over the threshold log their SQL statements."""
+    monkeypatch.setattr(profiling, "SLOW_REQUEST_MS", 0.001)
+    client = TestClient(app)
+    with caplog.at_level(logging.WARNING, logger="app.profiling"):
+        r = client.get("/calculations")
+    assert r.status_code == 200
+    messages = [rec.getMessage() for rec in caplog.records if rec.name == "app.profiling"]
+    assert any("Slow request GET /calculations" in m and "SELECT" in m for m in messages)
+
+
+def test_admin_metrics(admin, monkeypatch):
+    """Test shared counters are exposed to admins."""
+    monkeypatch.setattr(profiling, "SLOW_REQUEST_MS", 0.001)
+    client = TestClient(app)
+    client.get("/calculations")
+    r = client.get("/admin/metrics", headers=admin)
+    assert r.status_code == 200
+    assert r.json()["slow_requests"] >= 1
+
+
+def test_failed_statement_does_not_leak_timer():
+    """Test a statement that errors doesn't leave its start time on the connection."""
+    token = profiling.current_request.set(profiling.RequestRecord("GET", "/", {}))
+    try:
+        with engine.connect() as conn:
+            try:
+                conn.execute(text("SELECT * FROM no_such_table"))
+            except Exception:
+                pass
+            assert not conn.info.get("query_start")
+    finally:
+        profiling.current_request.reset(token)
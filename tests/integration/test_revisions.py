@@ -0,0 +1,116 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from main import app
+from app import dedup, models
+from app.db import engine, init_db, SessionLocal
+from app.operations import calculations as calc_ops
+from app.operations import revisions
+
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    init_db()
+    yield
+
+
+def _edit(client, calc_id, payload):
+    r = client.put(f"/calculations/{calc_id}", json=payload)
+    assert r.status_code == 200
+    return r.json()
+
+
+def test_edits_keep_history_as_deltas():
+    """Test each edit appends a revision holding only the changed fields' old values."""
+    client = TestClient(app)
+    calc_id = client.post("/calculations", json={"a": 5, "b": 3, "type": "Add"}).json()["id"]
+    assert _edit(client, calc_id, {"a": 10, "b": 3, "type": "Add"})["revision"] == 2
+    assert _edit(client, calc_id, {"a": 10, "b": 3, "type": "Multiply"})["revision"] == 3
+
+    db = SessionLocal()
+    try:
+        R = models.CalculationRevision
+        deltas = db.scalars(select(R.delta).where(R.calculation_id == calc_id).order_by(R.revision)).all()
+    finally:
+        db.close()
+    assert deltas == [{"a": 5.0, "result": 8.0}, {"type": "Add", "result": 13.0}]
+
+    r = client.get(f"/calculations/{calc_id}/revisions")
+    assert r.status_code == 200
+    history = [(h["revision"], h["type"], h["a"], h["result"]) for h in r.json()]
+    assert history == [(3, "Multiply", 10, 30), (2, "Add", 10, 13), (1, "Add", 5, 8)]
+    assert [h["revision"] for h in client.get(f"/calculations/{calc_id}/revisions?limit=2").json()] == [3, 2]
+
+
+def test_unchanged_edit_adds_no_revision(max_queries):
+    """Test re-submitting the current inputs is a no-op."""
+    client = TestClient(app)
+    calc_id = client.post("/calculations", json={"a": 2, "b": 2, "type": "Power"}).json()["id"]
+    with max_queries(1):
+        assert _edit(client, calc_id, {"a": 2, "b": 2, "type": "Power"})["revision"] == 1
+    assert len(client.get(f"/calculations/{calc_id}/revisions").json()) == 1
+
+
+def test_revert_is_a_new_revision():
+    """Test reverting restores earlier inputs and can itself be undone."""
+    client = TestClient(app)
+    calc_id = client.post("/calculations", json={"operands": [1, 2, 3], "type": "Sum"}).json()["id"]
+    _edit(client, calc_id, {"a": 9, "type": "Sqrt"})
+
+    r = client.post(f"/calculations/{calc_id}/revert", params={"revision": 1})
+    assert r.status_code == 200
+    assert r.json()["type"] == "Sum" and r.json()["operands"] == [1, 2, 3] and r.json()["revision"] == 3
+
+    r = client.post(f"/calculations/{calc_id}/revert", params={"revision": 2})
+    assert r.json()["type"] == "Sqrt" and r.json()["result"] == 3 and r.json()["revision"] == 4
+
+    assert client.post(f"/calculations/{calc_id}/revert", params={"revision": 9}).status_code == 404
+    assert client.post("/calculations/99999999/revert", params={"revision": 1}).status_code == 404
+
+
+def test_stale_edit_conflicts():
+    """Test an edit based on an outdated revision is refused rather than applied."""
+    client = TestClient(app)
+    calc_id = client.post("/calculations", json={"a": 1, "b": 1, "type": "Add"}).json()["id"]
+    db = SessionLocal()
+    try:
+        stale = calc_ops.get_calculation_by_id(db, calc_id)
+        db.commit()
+        _edit(client, calc_id, {"a": 2, "b": 1, "type": "Add"})
+        calc_in = calc_ops.schemas.CalculationCreate(a=3, b=1, type="Add")
+        with pytest.raises(revisions.RevisionConflict):
+            calc_ops._revise(db, stale, calc_in)
+        if engine.dialect.name == "postgresql":
+            with pytest.raises(revisions.RevisionConflict):
+                calc_ops._revise_in_one_statement(db, calc_id, calc_in, expected_revision=1)
+    finally:
+        db.close()
+    assert client.get(f"/calculations/{calc_id}").json()["a"] == 2
+
+
+def test_delete_removes_history():
+    """Test deleting a calculation drops its revisions too."""
+    client = TestClient(app)
+    calc_id = client.post("/calculations", json={"a": 4, "b": 2, "type": "Divide"}).json()["id"]
+    _edit(client, calc_id, {"a": 8, "b": 2, "type": "Divide"})
+    assert client.delete(f"/calculations/{calc_id}").status_code == 200
+    db = SessionLocal()
+    try:
+        R = models.CalculationRevision
+        assert db.scalars(select(R).where(R.calculation_id == calc_id)).first() is None
+    finally:
+        db.close()
+
+
+def test_history_with_deduplicated_storage(monkeypatch):
+    """Test revisions record resolved inputs when rows reference canonical operands."""
+    monkeypatch.setattr(dedup, "DEDUP_STORAGE", True)
+    dedup.known.clear()
+    client = TestClient(app)
+    calc_id = client.post("/calculations", json={"a": 6, "b": 4, "type": "Sub"}).json()["id"]
+    _edit(client, calc_id, {"a": 6, "b": 5, "type": "Sub"})
+    history = client.get(f"/calculations/{calc_id}/revisions").json()
+    assert [(h["b"], h["result"]) for h in history] == [(5, 1), (4, 2)]
+    r = client.post(f"/calculations/{calc_id}/revert", params={"revision": 1})
+    assert r.json()["b"] == 4 and r.json()["result"] == 2
@@ -0,0 +1,146 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+from main import app
+from app import models, sharding
+from app.db import SessionLocal, init_db
+from app.sharding import ShardSet, Snowflake, WorkerLease, shard_of
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    """Three calculation shards backed by separate SQLite files."""
+    shard_set = ShardSet([f"sqlite:///{tmp_path / f'shard{i}.sqlite'}" for i in range(3)])
+    shard_set.create_all()
+    monkeypatch.setattr(sharding, "shards", shard_set)
+    monkeypatch.setattr(sharding, "SHARDED", True)
+    yield shard_set
+    shard_set.dispose()
+
+
+def _count(shard_set, shard):
+    with shard_set.session(shard) as db:
+        return db.scalar(select(func.count()).select_from(models.Calculation))
+
+
+def test_snowflake_ids_are_unique_ordered_and_carry_the_shard():
+    gen = Snowflake(worker_id=5)
+    ids = [gen.next_id(i % 4) for i in range(5000)]
+    assert len(set(ids)) == len(ids)
+    for shard in range(4):
+        own = ids[shard::4]
+        assert own == sorted(own)  # increasing per shard, so each shard's id index is append-only
+    assert [shard_of(i) for i in ids[:8]] == [0, 1, 2, 3, 0, 1, 2, 3]
+    assert ids[-1] < 2 ** 63
+    with pytest.raises(ValueError):
+        gen.next_id(sharding.MAX_SHARDS)
+
+
+def test_worker_id_leases_are_exclusive_until_they_expire():
+    """Test processes never lease the same worker id while it's live, and a stalled one moves on."""
+    init_db()
+    with SessionLocal() as db:
+        db.execute(models.SnowflakeLease.__table__.delete())
+        db.commit()
+    live = WorkerLease(owner="live")
+    stalled = WorkerLease(owner="stalled", ttl=-60)  # its lease is expired as soon as it's taken
+    live_id = live.worker_id()
+    stalled_id = stalled.acquire()
+    assert stalled_id != live_id  # same host and pid, so the same first candidate
+
+    newcomer = WorkerLease(owner="newcomer")
+    assert newcomer.acquire() == stalled_id  # the expired lease is reused, the live one isn't
+    stalled._worker_id = stalled_id
+    stalled.renew()
+    assert stalled._worker_id not in (live_id, stalled_id)
+
+    live.release()
+    assert WorkerLease(owner="next").acquire() == live_id
+
+
+def test_shard_tables_have_no_users_foreign_key():
+    table = sharding._shard_metadata().tables["calculations"]
+    assert not table.c.user_id.foreign_keys
+    assert table.c.operand_id.foreign_keys  # calculation_operands lives in the shard too
+
+
+def test_calculations_route_by_user_and_are_found_by_id(shards):
+    """Test each user's rows land on one shard and reads locate them from the id alone."""
+    client = TestClient(app)
+    created = [client.post("/calculations", json={"a": i, "b": 1, "type": "Add", "user_id": i % 6}).json()
+               for i in range(30)]
+    for calc in created:
+        expected = shards.shard_for_user(calc["user_id"])
+        assert shard_of(calc["id"]) == expected
+        assert client.get(f"/calculations/{calc['id']}").json()["result"] == calc["result"]
+    assert sum(_count(shards, s) for s in range(3)) == 30
+    assert sum(_count(shards, s) > 0 for s in range(3)) >= 2
+
+    target = created[7]
+    r = client.put(f"/calculations/{target['id']}", json={"a": 10, "b": 5, "type": "Divide"})
+    assert r.json()["result"] == 2
+    assert client.delete(f"/calculations/{target['id']}").status_code == 200
+    assert client.get(f"/calculations/{target['id']}").status_code == 404
+
+
+def test_browse_merges_shards_in_id_order(shards):
+    """Test offset and keyset pages over the merged shards match one global id ordering."""
+    client = TestClient(app)
+    for i in range(25):
+        client.post("/calculations", json={"a": i, "b": 2, "type": "Multiply", "user_id": i})
+    everything = client.get("/calculations", params={"limit": 100}).json()
+    ids = [c["id"] for c in everything]
+    assert len(ids) == 25 and ids == sorted(ids)
+
+    assert [c["id"] for c in client.get("/calculations", params={"skip": 10, "limit": 5}).json()] == ids[10:15]
+    page, keyset = None, []
+    while page != []:
+        params = {"limit": 7} if not keyset else {"limit": 7, "after_id": keyset[-1]}
+        page = [c["id"] for c in client.get("/calculations", params=params).json()]
+        keyset += page
+    assert keyset == ids
+
+    exported = client.get("/calculations/export").text.splitlines()
+    assert len(exported) == 25
+
+
+def test_stats_delete_and_bulk_create_span_shards(shards):
+    client = TestClient(app)
+    items = [{"a": i, "b": 1, "type": "Add", "user_id": i} for i in range(12)]
+    created = client.post("/calculations/bulk", json={"items": items}).json()
+    assert [c["result"] for c in created] == [i + 1 for i in range(12)]
+    assert all(shard_of(c["id"]) == shards.shard_for_user(c["user_id"]) for c in created)
+    assert client.post("/calculations/bulk", params={"returning": "false"},
+                       json={"items": items}).json() == {"inserted": 12}
+
+    stats = client.get("/calculations/stats").json()
+    assert stats["count"] == 24 and stats["sum"] == 2 * sum(range(1, 13))
+    assert stats["min"] == 1 and stats["max"] == 12 and stats["mean"] == pytest.approx(6.5)
+
+    hot = client.get("/calculations/hot", params={"limit": 3}).json()
+    assert all(row["count"] == 2 for row in hot)
+
+    ids = [c["id"] for c in created[:4]]
+    assert client.delete("/calculations", params={"ids": ids}).json() == {"deleted": 4}
+    assert client.delete("/calculations", params={"type": "Add"}).json() == {"deleted": 20}
+
+
+def test_dedup_canonical_rows_stay_per_shard(shards, monkeypatch):
+    """Test the same inputs on two shards each reference their own shard's canonical row."""
+    from app import dedup
+
+    monkeypatch.setattr(dedup, "DEDUP_STORAGE", True)
+    dedup.known.clear()
+    client = TestClient(app)
+    users = {}
+    for user_id in range(20):
+        users.setdefault(shards.shard_for_user(user_id), user_id)
+    # Offset the first shard's canonical ids so a shared cache entry would point at the wrong row
+    client.post("/calculations", json={"a": 1, "b": 1, "type": "Add", "user_id": next(iter(users.values()))})
+    created = [client.post("/calculations", json={"a": 6, "b": 7, "type": "Multiply", "user_id": u}).json()
+               for u in users.values()]
+    assert len({shard_of(c["id"]) for c in created}) == len(users) > 1
+    for calc in created:
+        assert client.get(f"/calculations/{calc['id']}").json()["result"] == 42
+    dedup.known.clear()
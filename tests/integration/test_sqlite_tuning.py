@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app import models, schemas
+from app.db import Base, RoutingSession, WriteQueue, make_engine
+from app.operations import calculations as calc_ops
+
+
+@pytest.fixture
+def tuned(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'tuned.sqlite'}", tuned=True)
+    Base.metadata.create_all(bind=engine)
+    queue = WriteQueue(wait_seconds=5)
+    factory = sessionmaker(autoflush=False, expire_on_commit=False, bind=engine,
+                           class_=RoutingSession, write_queue=queue)
+    yield factory, queue
+    engine.dispose()
+
+
+def test_pragmas_applied_on_connect(tuned):
+    """Test every pooled connection runs in WAL with the tuned pragmas."""
+    factory, _ = tuned
+    with factory() as db:
+        assert db.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert db.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert db.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+def test_write_turn_held_until_transaction_ends(tuned):
+    """Test a session holds the write queue from its first flush until commit, and reads don't take it."""
+    factory, queue = tuned
+    db = factory()
+    try:
+        calc_ops.get_all_calculations(db)
+        assert not queue._held
+        db.add(models.Calculation(a=1, b=2, type=models.CalculationType.ADD, result=3))
+        db.flush()
+        assert queue._held
+        db.commit()
+        assert not queue._held
+    finally:
+        db.close()
+
+
+def test_concurrent_writers_do_not_lock(tuned):
+    """Test many threads writing at once all succeed."""
+    factory, _ = tuned
+    errors = []
+
+    def write(n):
+        try:
+            with factory() as db:
+                for i in range(n):
+                    calc_ops.create_calculation(db, schemas.CalculationCreate(a=i, b=1, type="Add"))
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(25,)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    with factory() as db:
+        assert db.scalar(select(func.count()).select_from(models.Calculation)) == 200
+
+
+def test_write_queue_is_fifo_and_times_out():
+    queue = WriteQueue(wait_seconds=0.05)
+    assert queue.acquire()
+    order = []
+
+    def waiter(name):
+        queue.wait_seconds = 5
+        if queue.acquire():
+            order.append(name)
+            queue.release()
+
+    first = threading.Thread(target=waiter, args=("first",))
+    first.start()
+    while not queue._waiters:
+        time.sleep(0.001)
+    second = threading.Thread(target=waiter, args=("second",))
+    second.start()
+    while len(queue._waiters) < 2:
+        time.sleep(0.001)
+    queue.release()
+    first.join()
+    second.join()
+    assert order == ["first", "second"]
+    assert not queue._held
+
+    queue.wait_seconds = 0.01
+    assert queue.acquire()
+    assert queue.acquire() is False  # times out rather than deadlocking
+    queue.release()
+    assert not queue._held
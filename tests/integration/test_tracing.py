@@ -0,0 +1,105 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from app import tracing
+
+
+@pytest.fixture
+def traced(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACING", True)
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    tracing.recent.clear()
+    yield tracing.recent
+    tracing.recent.clear()
+
+
+def _spans(trace):
+    return {s.name: s for s in trace.spans}
+
+
+def test_request_spans_cover_validation_handler_db_and_serialization(traced):
+    """Test a calculation request records each phase under one trace."""
+    client = TestClient(app)
+    r = client.post("/calculations", json={"a": 2, "b": 3, "type": "Multiply"})
+    assert r.status_code == 200
+    trace = traced.traces[-1]
+    spans = _spans(trace)
+    assert {"http.request", "http.validate", "http.handler", "calculation.compute", "db.query",
+            "http.serialize"} <= set(spans)
+    root = spans["http.request"]
+    assert root.attributes["http.route"] == "/calculations"
+    assert root.attributes["http.response.status_code"] == 200
+    assert spans["db.query"].attributes["db.statement"].startswith("INSERT INTO calculations")
+    # SQL and compute nest under the handler, the phases under the root
+    assert spans["calculation.compute"].parent_id == spans["http.handler"].span_id
+    assert spans["http.validate"].parent_id == root.span_id
+    assert r.headers["traceparent"] == f"00-{trace.trace_id}-{root.span_id}-01"
+
+
+def test_password_hashing_span_and_breakdown(traced):
+    """Test registration shows hashing time separately in the breakdown."""
+    client = TestClient(app)
+    client.post("/users/register", json={"username": "tracer1", "email": "tracer1@example.com", "password": "pass123"})
+    summary = tracing.summary(traced.traces[-1])
+    assert summary["route"] == "/users/register"
+    assert "security.hash_password" in summary["breakdown_ms"]
+    assert sum(summary["breakdown_ms"].values()) == pytest.approx(summary["duration_ms"], rel=0.05)
+
+
+def test_validation_failure_has_no_handler_span(traced):
+    client = TestClient(app)
+    assert client.post("/calculations", json={"a": 1}).status_code == 400
+    spans = _spans(traced.traces[-1])
+    assert "http.validate" in spans and "http.handler" not in spans
+
+
+def test_incoming_traceparent_is_continued(traced):
+    client = TestClient(app)
+    parent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    client.get("/health", headers={"traceparent": parent})
+    root = _spans(traced.traces[-1])["http.request"]
+    assert root.trace.trace_id == "0af7651916cd43dd8448eb211c80319c"
+    assert root.parent_id == "b7ad6b7169203331"
+
+    # Unsampled upstream traces are not recorded
+    before = len(traced.traces)
+    client.get("/health", headers={"traceparent": parent[:-2] + "00"})
+    assert len(traced.traces) == before
+
+
+def test_tracing_disabled_records_nothing():
+    tracing.recent.clear()
+    client = TestClient(app)
+    r = client.get("/health")
+    assert "traceparent" not in r.headers
+    assert len(tracing.recent.traces) == 0
+
+
+def test_admin_trace_endpoints(traced, admin):
+    """Test recorded traces are listed and fetchable by admins only."""
+    client = TestClient(app)
+    client.post("/add", json={"a": 1, "b": 2})
+    assert client.get("/admin/traces").status_code == 403
+    listing = client.get("/admin/traces", params={"route": "/add"}, headers=admin).json()
+    assert listing and listing[0]["route"] == "/add" and listing[0]["status_code"] == 200
+    detail = client.get(f"/admin/traces/{listing[0]['trace_id']}", headers=admin).json()
+    assert {s["name"] for s in detail["span_list"]} >= {"http.request", "http.handler"}
+    assert client.get("/admin/traces/missing", headers=admin).status_code == 404
+
+
+def test_file_exporter_writes_otlp_json(traced, tmp_path):
+    exporter = tracing.FileExporter(str(tmp_path / "traces.jsonl"), max_bytes=10_000, backups=1)
+    client = TestClient(app)
+    for _ in range(30):
+        client.post("/add", json={"a": 1, "b": 2})
+        exporter.export(traced.traces[-1])
+    exporter.close()
+    line = json.loads((tmp_path / "traces.jsonl").read_text().splitlines()[0])
+    spans = line["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root = next(s for s in spans if s["name"] == "http.request")
+    assert len(root["traceId"]) == 32 and root["kind"] == 2
+    assert {"key": "http.route", "value": {"stringValue": "/add"}} in root["attributes"]
+    assert (tmp_path / "traces.jsonl.1").exists()  # rotated
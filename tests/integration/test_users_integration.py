@@ -2,9 +2,12 @@ import os
 import time
 import pytest
 from fastapi.testclient import TestClient
+from jose import jwt
 
 from main import app
 from app.db import init_db
+from app.operations import users as user_ops
+from app.security import Overloaded, verify_token
 
 
 @pytest.fixture(autouse=True)
@@ -24,11 +27,13 @@ def setup_db():
     yield
 
 
-def test_register_user_success():
+def test_register_user_success(max_queries):
     """Test successful user registration."""
     client = TestClient(app)
     payload = {"username": "testuser1", "email": "testuser1@example.com", "password": "password123"}
-    r = client.post("/users/register", json=payload)
+    # The user and its refresh session
+    with max_queries(2):
+        r = client.post("/users/register", json=payload)
     assert r.status_code == 200
     data = r.json()
     # Now returns JWT token instead of user data
@@ -38,7 +43,7 @@ def test_register_user_success():
     assert len(data["access_token"]) > 0
 
 
-def test_register_duplicate_user():
+def test_register_duplicate_user(max_queries):
     """Test registration with duplicate username/email returns 400."""
     client = TestClient(app)
     payload = {"username": "testuser2", "email": "testuser2@example.com", "password": "password123"}
@@ -46,21 +51,23 @@ def test_register_duplicate_user():
     assert r1.status_code == 200
     
     # Attempt duplicate
-    r2 = client.post("/users/register", json=payload)
+    with max_queries(1):
+        r2 = client.post("/users/register", json=payload)
     assert r2.status_code == 400
     response_data = r2.json()
     assert "error" in response_data and "already exists" in response_data["error"].lower()
 
 
-def test_register_invalid_email():
+def test_register_invalid_email(max_queries):
     """Test registration with invalid email format returns 400."""
     client = TestClient(app)
     payload = {"username": "testuser3", "email": "not-an-email", "password": "password123"}
-    r = client.post("/users/register", json=payload)
+    with max_queries(0):
+        r = client.post("/users/register", json=payload)
     assert r.status_code == 400
 
 
-def test_login_user_success():
+def test_login_user_success(max_queries):
     """Test successful user login."""
     client = TestClient(app)
     # First register a user
@@ -69,7 +76,9 @@ def test_login_user_success():
     
     # Now login
     login_payload = {"username": "loginuser1", "password": "mypassword"}
-    r = client.post("/users/login", json=login_payload)
+    # User lookup, then the new refresh session
+    with max_queries(2):
+        r = client.post("/users/login", json=login_payload)
     assert r.status_code == 200
     data = r.json()
     # Now returns JWT token instead of user data
@@ -79,18 +88,19 @@ def test_login_user_success():
     assert len(data["access_token"]) > 0
 
 
-def test_login_invalid_username():
+def test_login_invalid_username(max_queries):
     """Test login with non-existent username returns 401."""
     client = TestClient(app)
     login_payload = {"username": "nonexistent", "password": "anypassword"}
-    r = client.post("/users/login", json=login_payload)
+    with max_queries(1):
+        r = client.post("/users/login", json=login_payload)
     assert r.status_code == 401
     response_data = r.json()
     # May return error as string or in detail field depending on exception handler
     assert "invalid" in str(response_data).lower() or "detail" in response_data
 
 
-def test_login_invalid_password():
+def test_login_invalid_password(max_queries):
     """Test login with wrong password returns 401."""
     client = TestClient(app)
     # Register a user
@@ -99,17 +109,19 @@ def test_login_invalid_password():
     
     # Try to login with wrong password
     login_payload = {"username": "loginuser2", "password": "wrongpassword"}
-    r = client.post("/users/login", json=login_payload)
+    with max_queries(1):
+        r = client.post("/users/login", json=login_payload)
     assert r.status_code == 401
     response_data = r.json()
     assert "error" in response_data and "invalid" in response_data["error"].lower()
 
 
-def test_register_and_uniqueness():
+def test_register_and_uniqueness(max_queries):
     """Legacy test for backward compatibility."""
     client = TestClient(app)
     payload = {"username": "tester1", "email": "tester1@example.com", "password": "pass123"}
-    r = client.post("/users/register", json=payload)
+    with max_queries(2):
+        r = client.post("/users/register", json=payload)
     assert r.status_code == 200
     data = r.json()
     # Now returns JWT token instead of user data
@@ -122,10 +134,129 @@ def test_register_and_uniqueness():
     assert r2.status_code == 400
 
 
-def test_invalid_email_via_endpoint():
+def test_invalid_email_via_endpoint(max_queries):
     """Legacy test for backward compatibility."""
     client = TestClient(app)
     payload = {"username": "tester2", "email": "not-an-email", "password": "pass123"}
-    r = client.post("/users/register", json=payload)
+    with max_queries(0):
+        r = client.post("/users/register", json=payload)
     # This application maps validation errors to HTTP 400 in the handler
     assert r.status_code == 400
+
+
+def test_duplicate_registration_skips_password_hash(monkeypatch):
+    """Test a known duplicate is rejected before the password is hashed."""
+    from app.operations import users as user_ops
+
+    client = TestClient(app)
+    payload = {"username": "bloomuser", "email": "bloomuser@example.com", "password": "password123"}
+    assert client.post("/users/register", json=payload).status_code == 200
+
+    calls = []
+    monkeypatch.setattr(user_ops, "hash_password", lambda p: calls.append(p) or "unused")
+    r = client.post("/users/register", json={**payload, "username": "bloomuser-2"})
+    assert r.status_code == 400 and "already exists" in r.json()["error"]
+    assert calls == []
+
+
+def test_repeat_login_served_from_cache(max_queries):
+    """Test a second login for the same user only writes its refresh session."""
+    client = TestClient(app)
+    client.post("/users/register", json={"username": "cacheduser", "email": "cacheduser@example.com",
+                                         "password": "mypassword"})
+    assert client.post("/users/login", json={"username": "cacheduser", "password": "mypassword"}).status_code == 200
+    with max_queries(1):
+        r = client.post("/users/login", json={"username": "cacheduser", "password": "mypassword"})
+    assert r.status_code == 200
+
+
+def test_refresh_issues_new_tokens_in_one_query(max_queries):
+    """Test /users/refresh rotates the session's token with a single conditional UPDATE."""
+    client = TestClient(app)
+    payload = {"username": "refresher1", "email": "refresher1@example.com", "password": "pass123"}
+    tokens = client.post("/users/register", json=payload).json()
+    assert tokens["refresh_token"]
+    with max_queries(1):
+        r = client.post("/users/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert r.status_code == 200
+    claims = verify_token(r.json()["access_token"])
+    assert claims["sub"] == "refresher1" and claims["email"] == "refresher1@example.com"
+    # Access tokens are not refresh tokens
+    r = client.post("/users/refresh", json={"refresh_token": tokens["access_token"]})
+    assert r.status_code == 401
+    # A malformed key id in the (unverified) header is a bad token, not a server error
+    forged = jwt.encode({"sub": "refresher1", "type": "refresh"}, "x", headers={"kid": ["x"]})
+    assert client.post("/users/refresh", json={"refresh_token": forged}).status_code == 401
+
+
+def test_login_sheds_load_with_retry_after(monkeypatch):
+    """Test saturated password hashing returns 503 with Retry-After instead of queueing."""
+    def overloaded(*args):
+        raise Overloaded(retry_after=3)
+
+    monkeypatch.setattr(user_ops, "verify_password", overloaded)
+    client = TestClient(app)
+    client.post("/users/register", json={"username": "shed1", "email": "shed1@example.com", "password": "pass123"})
+    r = client.post("/users/login", json={"username": "shed1", "password": "pass123"})
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "3"
+
+
+def _register(client, name):
+    payload = {"username": name, "email": f"{name}@example.com", "password": "pass123"}
+    return client.post("/users/register", json=payload).json()
+
+
+def _refresh(client, token):
+    return client.post("/users/refresh", json={"refresh_token": token})
+
+
+def test_refresh_token_reuse_revokes_session():
+    """Test a refresh token works once; replaying it revokes the newer tokens too."""
+    client = TestClient(app)
+    first = _register(client, "rotator1")["refresh_token"]
+    second = _refresh(client, first).json()["refresh_token"]
+    claims = [verify_token(token, token_type="refresh") for token in (first, second)]
+    assert claims[0]["auth_time"] == claims[1]["auth_time"]
+
+    assert _refresh(client, first).status_code == 401
+    assert _refresh(client, second).status_code == 401
+
+
+def test_logout_revokes_refresh_token():
+    """Test logout ends the refresh session."""
+    client = TestClient(app)
+    token = _register(client, "leaver1")["refresh_token"]
+    assert client.post("/users/logout", json={"refresh_token": token}).status_code == 200
+    assert _refresh(client, token).status_code == 401
+
+
+def test_refresh_requires_existing_user_and_live_session(monkeypatch):
+    """Test refresh fails for a deleted user and once the login is older than SESSION_MAX_DAYS."""
+    from sqlalchemy import delete
+    from app import models, user_cache
+    from app.db import SessionLocal
+
+    client = TestClient(app)
+    tokens = _register(client, "ghost1")
+    db = SessionLocal()
+    try:
+        db.execute(delete(models.User).where(models.User.username == "ghost1"))
+        db.commit()
+    finally:
+        db.close()
+    user_cache.user_changed()
+    assert _refresh(client, tokens["refresh_token"]).status_code == 401
+
+    token = _register(client, "elder1")["refresh_token"]
+    monkeypatch.setattr(user_ops, "SESSION_MAX_DAYS", 0)
+    assert _refresh(client, token).status_code == 401
+
+
+def test_refresh_token_expiry_capped_at_session_lifetime():
+    """Test a refresh token never outlives auth_time + SESSION_MAX_DAYS."""
+    from app import security
+
+    auth_time = int(time.time()) - (security.SESSION_MAX_DAYS - 1) * 86400
+    token = security.create_refresh_token({"sub": "x", "sid": "s", "jti": "j", "auth_time": auth_time})
+    assert verify_token(token, token_type="refresh")["exp"] <= auth_time + security.SESSION_MAX_DAYS * 86400
@@ -2,7 +2,8 @@
 
 import pytest  # Import the pytest framework for writing and running tests
 from typing import Union  # Import Union for type hinting multiple possible types
-from app.operations import add, subtract, multiply, divide  # Import the calculator functions from the operations module
+import math
+from app.operations import add, subtract, multiply, divide, power, modulus, sqrt, log  # Import the calculator functions from the operations module
 
 # Define a type alias for numbers that can be either int or float
 Number = Union[int, float]
@@ -232,3 +233,36 @@ def test_divide_by_zero() -> None:
     # Assert that the exception message contains the expected error message
     assert "Cannot divide by zero!" in str(excinfo.value), \
         f"Expected error message 'Cannot divide by zero!', but got '{excinfo.value}'"
+
+
+# ---------------------------------------------
+# Scientific Operations
+# ---------------------------------------------
+
+@pytest.mark.parametrize(
+    "func, args, expected",
+    [
+        (power, (2, 10), 1024.0),
+        (power, (9, 0.5), 3.0),
+        (modulus, (7, 3), 1),
+        (modulus, (-7, 3), 2),
+        (sqrt, (16,), 4.0),
+        (log, (8, 2), 3.0),
+        (log, (math.e,), 1.0),
+    ],
+    ids=["power_int", "power_fraction", "modulus", "modulus_negative", "sqrt", "log_base", "log_natural"],
+)
+def test_scientific_operations(func, args, expected) -> None:
+    """Test power, modulus, sqrt and log on valid input."""
+    assert func(*args) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "func, args",
+    [(power, (-8, 0.5)), (power, (10, 400)), (modulus, (1, 0)), (sqrt, (-1,)), (log, (0,)), (log, (8, 1))],
+    ids=["power_complex", "power_overflow", "modulus_zero", "sqrt_negative", "log_zero", "log_base_one"],
+)
+def test_scientific_operations_domain_errors(func, args) -> None:
+    """Test out-of-domain input raises ValueError instead of returning nan/inf."""
+    with pytest.raises(ValueError):
+        func(*args)
@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app import columnar
+from app.columnar import CalculationColumns
+from app.models import CalculationType
+
+T0 = datetime(2026, 10, 1, tzinfo=timezone.utc)
+T1 = datetime(2026, 10, 2, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True, params=["numpy", "pure"])
+def kernels(request, monkeypatch):
+    """Run each test with the NumPy scans and with the pure-Python fallback."""
+    if request.param == "numpy":
+        if columnar.np is None:
+            pytest.skip("numpy not installed")
+    else:
+        monkeypatch.setattr(columnar, "np", None)
+
+
+def test_upsert_update_and_remove():
+    cols = CalculationColumns(capacity=8)
+    cols.upsert(1, 2, 3, CalculationType.ADD, 5, None, T0)
+    cols.upsert(2, 6, 3, CalculationType.DIVIDE, 2, 7, T1)
+    cols.upsert(1, 2, 3, CalculationType.MULTIPLY, 6, None, T0)
+    assert len(cols) == 2
+    assert cols.stats() == {"count": 2, "sum": 8, "mean": 4, "min": 2, "max": 6}
+
+    cols.remove([2])
+    assert cols.stats()["count"] == 1
+
+
+def test_ring_evicts_oldest():
+    cols = CalculationColumns(capacity=2)
+    cols.complete = True
+    for i in range(1, 4):
+        cols.upsert(i, i, 0, CalculationType.ADD, i, None, T0)
+    assert sorted(cols.index) == [2, 3]
+    assert cols.stats()["sum"] == 5
+    assert not cols.complete
+
+
+def test_update_outside_ring_is_a_no_op():
+    cols = CalculationColumns(capacity=2)
+    cols.upsert(2, 2, 0, CalculationType.ADD, 2, None, T0)
+    cols.upsert(3, 3, 0, CalculationType.ADD, 3, None, T0)
+    cols.update(1, 9, 0, CalculationType.ADD, 9, None, T0)
+    assert sorted(cols.index) == [2, 3]
+    cols.update(2, 4, 0, CalculationType.ADD, 4, None, T0)
+    assert cols.stats()["sum"] == 7
+
+
+def test_stats_filters():
+    cols = CalculationColumns(capacity=8)
+    cols.upsert(1, 1, 1, CalculationType.ADD, 2, 1, T0)
+    cols.upsert(2, 3, 1, CalculationType.ADD, 4, 2, T1)
+    cols.upsert(3, 3, 1, CalculationType.SUBTRACT, 2, 2, T1)
+    cols.upsert(4, 3, 1, CalculationType.ADD, None, 2, T1)
+
+    assert cols.stats(calc_type=CalculationType.ADD)["count"] == 3
+    assert cols.stats(calc_type="Add")["sum"] == 6
+    assert cols.stats(user_id=2)["count"] == 3
+    assert cols.stats(since=T1)["mean"] == 3
+    assert cols.stats(until=T1)["count"] == 1
+    assert cols.stats(calc_type=CalculationType.DIVIDE) == {
+        "count": 0, "sum": 0.0, "mean": None, "min": None, "max": None,
+    }
@@ -0,0 +1,36 @@
+import pytest
+
+from app.operations import evaluate
+from app.operations.expressions import evaluate_expression
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        ("1 + 2", 3),
+        ("2 * (3 + 4) / 7", 2.0),
+        ("-3 - -2", -1),
+        ("10 / 4", 2.5),
+    ],
+)
+def test_evaluate_expression(expression, expected):
+    """Test arithmetic expressions evaluate with normal precedence."""
+    assert evaluate_expression(expression) == expected
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["__import__('os')", "2 ** 8", "x + 1", "1 / 0", "1 +", "True + 1",
+     "-" * 999 + "1", "1e308 * 10", "9" * 400 + " / 3"],
+)
+def test_evaluate_expression_rejects_unsafe_or_invalid(expression):
+    """Test anything beyond plain arithmetic raises ValueError."""
+    with pytest.raises(ValueError):
+        evaluate_expression(expression)
+
+
+def test_evaluate_by_name():
+    """Test evaluate dispatches by operation name and rejects unknown names."""
+    assert evaluate("multiply", 3, 4) == 12
+    with pytest.raises(ValueError, match="Unsupported operation"):
+        evaluate("cube", 2, 3)
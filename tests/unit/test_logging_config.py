@@ -0,0 +1,58 @@
+import logging
+import queue
+
+import pytest
+
+from app.logging_config import (
+    NonBlockingQueueHandler,
+    RouteLogger,
+    RoutePolicy,
+    StructuredFormatter,
+    parse_route_config,
+)
+
+
+def test_parse_route_config():
+    policies = parse_route_config("/add=WARNING:0.5, /divide=ERROR")
+    assert policies["/add"] == RoutePolicy(logging.WARNING, 0.5)
+    assert policies["/divide"] == RoutePolicy(logging.ERROR, 1.0)
+    assert parse_route_config("") == {}
+
+
+def test_parse_route_config_invalid_level():
+    with pytest.raises(ValueError):
+        parse_route_config("/add=LOUD")
+
+
+def test_route_logger_levels_and_sampling(caplog):
+    logger = logging.getLogger("tests.route_logger")
+    route_log = RouteLogger(
+        logger,
+        RoutePolicy(logging.INFO, 1.0),
+        {"/quiet": RoutePolicy(logging.ERROR, 1.0), "/muted": RoutePolicy(logging.INFO, 0.0)},
+    )
+    with caplog.at_level(logging.INFO, logger="tests.route_logger"):
+        assert route_log.log("/add", logging.ERROR, "failed %s", "x", status=400) is True
+        assert route_log.log("/quiet", logging.WARNING, "dropped by level") is False
+        assert route_log.log("/muted", logging.ERROR, "dropped by sampling") is False
+
+    assert [r.getMessage() for r in caplog.records] == ["failed x"]
+    assert caplog.records[0].fields == {"status": 400, "route": "/add"}
+
+
+def test_queue_handler_defers_formatting_and_drops_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord("t", logging.ERROR, __file__, 1, "value %s", ("a",), None)
+    handler.handle(record)
+    handler.handle(record)
+    queued = handler.queue.get_nowait()
+    # Arguments are still unformatted when the record reaches the queue
+    assert queued.args == ("a",)
+    assert handler.dropped == 1
+
+
+def test_structured_formatter_appends_fields():
+    record = logging.LogRecord("t", logging.ERROR, __file__, 1, "boom", (), None)
+    record.fields = {"route": "/add", "status": 400}
+    line = StructuredFormatter("%(levelname)s:%(message)s").format(record)
+    assert line == "ERROR:boom route=/add status=400"
@@ -0,0 +1,29 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.query_counter import QueryCounter, assert_max_queries
+
+
+def test_counts_statements_and_flags_repeats():
+    engine = create_engine("sqlite://")
+    with QueryCounter(engine) as counter:
+        with engine.connect() as conn:
+            for i in range(3):
+                conn.execute(text("SELECT :i"), {"i": i})
+    assert counter.count == 3
+    assert counter.repeated() == {"SELECT ?": 3}
+
+    assert_max_queries(counter, 3)
+    with pytest.raises(AssertionError, match="at most 2"):
+        assert_max_queries(counter, 2)
+    with pytest.raises(AssertionError, match="N\\+1"):
+        assert_max_queries(counter, 3, n_plus_one=2)
+
+
+def test_stops_counting_after_exit():
+    engine = create_engine("sqlite://")
+    with QueryCounter(engine) as counter:
+        pass
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert counter.count == 0
@@ -6,3 +6,31 @@ from app.schemas import UserCreate
 def test_invalid_email_raises():
     with pytest.raises(ValidationError):
         UserCreate(username="user1", email="not-an-email", password="abcdef")
+
+
+def test_calculation_create_coerces_type_and_rejects_zero_divisor():
+    from app.models import CalculationType
+    from app.schemas import CalculationCreate
+
+    assert CalculationCreate(a=1, b=2, type="Add").type is CalculationType.ADD
+    assert CalculationCreate(a=1, b=0, type="Multiply").b == 0
+    with pytest.raises(ValidationError, match="Division by zero"):
+        CalculationCreate(a=1, b=0, type="Divide")
+    with pytest.raises(ValidationError):
+        CalculationCreate(a=1, b=2, type="Cube")
+
+
+def test_bulk_validators_accept_json_and_python():
+    from app.schemas import validate_calculations, validate_compute_items
+
+    raw = b'[{"a": 1, "b": 2, "type": "Add"}, {"a": 3, "b": 4, "type": "Sub"}]'
+    assert [c.b for c in validate_calculations(raw)] == [2, 4]
+    assert validate_compute_items([{"op": "add", "a": 1, "b": 2}])[0].op == "add"
+
+
+def test_bulk_validator_reports_failing_index():
+    from app.schemas import validate_calculations
+
+    with pytest.raises(ValidationError) as exc:
+        validate_calculations([{"a": 1, "b": 2, "type": "Add"}, {"a": 1, "b": 0, "type": "Divide"}])
+    assert exc.value.errors()[0]["loc"][0] == 1
@@ -1,3 +1,11 @@
+import json
+import threading
+from datetime import timedelta
+
+import pytest
+from jose import jwt
+
+from app import security
 from app.security import hash_password, verify_password
 
 
@@ -6,3 +14,70 @@ def test_hash_and_verify():
     hashed = hash_password(raw)
     assert hashed != raw
     assert verify_password(raw, hashed) is True
+
+
+def test_tokens_carry_kid_and_type():
+    token = security.create_access_token({"sub": "alice"})
+    assert jwt.get_unverified_header(token)["kid"] == security.keyring.active_kid
+    assert security.verify_token(token)["sub"] == "alice"
+    # An access token is not accepted where a refresh token is expected, and vice versa
+    assert security.verify_token(token, token_type="refresh") is None
+    refresh = security.create_refresh_token({"sub": "alice"})
+    assert security.verify_token(refresh) is None
+    assert security.verify_token(refresh, token_type="refresh")["jti"]
+
+
+def test_legacy_token_without_kid_or_type_is_access():
+    token = jwt.encode({"sub": "bob"}, security.SECRET_KEY, algorithm=security.ALGORITHM)
+    assert security.verify_token(token)["sub"] == "bob"
+
+
+def test_token_with_non_string_kid_is_rejected():
+    for kid in (["x"], {"k": 1}, 7):
+        token = jwt.encode({"sub": "eve"}, security.SECRET_KEY, algorithm=security.ALGORITHM, headers={"kid": kid})
+        assert security.verify_token(token) is None
+
+
+def test_expiry_jitter_stays_in_bounds():
+    lifetime = timedelta(minutes=30)
+    samples = [security.jittered(lifetime, 0.1) for _ in range(200)]
+    assert all(timedelta(minutes=27) <= s <= timedelta(minutes=33) for s in samples)
+    assert len(set(samples)) > 1
+
+
+def test_key_rotation(tmp_path, monkeypatch):
+    keys = tmp_path / "keys.json"
+    keys.write_text(json.dumps({"k1": "first-secret"}))
+    ring = security.KeyRing(str(keys), active_kid="k1")
+    monkeypatch.setattr(security, "keyring", ring)
+    old = security.create_access_token({"sub": "carol"})
+
+    # The built-in secret is not trusted once a keys file is configured, with or without a kid
+    for headers in ({}, {"kid": "default"}):
+        forged = jwt.encode({"sub": "mallory", "type": "access"}, security.SECRET_KEY,
+                            algorithm=security.ALGORITHM, headers=headers)
+        assert security.verify_token(forged) is None
+
+    # Rotate: new active key, old key kept for verification
+    keys.write_text(json.dumps({"k1": "first-secret", "k2": "second-secret"}))
+    monkeypatch.setattr(security, "KEY_RELOAD_SECONDS", 0)
+    ring.active_kid = "k2"
+    new = security.create_access_token({"sub": "carol"})
+    assert jwt.get_unverified_header(new)["kid"] == "k2"
+    assert security.verify_token(old) and security.verify_token(new)
+
+    # Retiring k1 invalidates tokens it signed
+    keys.write_text(json.dumps({"k2": "second-secret"}))
+    ring.reload()
+    assert security.verify_token(old) is None
+    assert security.verify_token(new)
+
+
+def test_password_work_sheds_when_saturated(monkeypatch):
+    monkeypatch.setattr(security, "_password_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(security, "PASSWORD_QUEUE_SECONDS", 0.01)
+    with security.password_work():
+        with pytest.raises(security.Overloaded) as exc:
+            security.hash_password("x")
+    assert 1 <= exc.value.retry_after <= 5
+    assert security.verify_password("x", security.hash_password("x"))
@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from app.shared_state import LocalBackend, SharedMemoryBackend, StateBackend, decode_int
+
+
+@pytest.fixture(params=["local", "shm"])
+def backend(request):
+    if request.param == "local":
+        yield LocalBackend()
+        return
+    shm = SharedMemoryBackend(name=f"test_state_{os.getpid()}", slots=64, slot_size=64)
+    yield shm
+    shm.close()
+
+
+def test_get_set_delete(backend):
+    assert backend.get("missing") is None
+    backend.set("k", b"value")
+    assert backend.get("k") == b"value"
+    backend.set("k", b"other")
+    assert backend.get("k") == b"other"
+    backend.delete("k")
+    assert backend.get("k") is None
+
+
+def test_incr_and_items(backend):
+    assert backend.incr("metric:a") == 1
+    assert backend.incr("metric:a", 4) == 5
+    backend.incr("metric:b")
+    backend.set("other", b"x")
+    assert {k: decode_int(v) for k, v in backend.items("metric:")} == {"metric:a": 5, "metric:b": 1}
+
+
+def test_ttl_expiry(backend):
+    backend.set("short", b"1", ttl=0.01)
+    backend.set_float("float", 1.5)
+    time.sleep(0.02)
+    assert backend.get("short") is None
+    assert backend.get_float("float") == 1.5
+
+
+def test_shm_rejects_oversized_values():
+    shm = SharedMemoryBackend(name=f"test_state_big_{os.getpid()}", slots=4, slot_size=32)
+    try:
+        with pytest.raises(ValueError):
+            shm.set("key", b"x" * 64)
+    finally:
+        shm.close()
+
+
+def _hammer(name, n):
+    backend = SharedMemoryBackend(name=name, slots=64, slot_size=64)
+    for _ in range(n):
+        backend.incr("hits")
+    backend.close()
+
+
+def test_shm_counts_are_shared_across_processes():
+    name = f"test_state_mp_{os.getpid()}"
+    backend = SharedMemoryBackend(name=name, slots=64, slot_size=64)
+    try:
+        procs = [multiprocessing.Process(target=_hammer, args=(name, 200)) for _ in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        assert backend.get_int("hits") == 800
+    finally:
+        backend.close()
+
+
+def test_backend_interface_is_abstract():
+    class Partial(StateBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_shm_state_does_not_survive_a_restart():
+    """Test the last process out removes the segment, and a crashed run's segment is cleared on start."""
+    name = f"test_state_restart_{os.getpid()}"
+    first = SharedMemoryBackend(name=name, slots=16, slot_size=64)
+    second = SharedMemoryBackend(name=name, slots=16, slot_size=64)
+    first.set("k", b"v")
+    first.close()
+    assert second.get("k") == b"v"  # still attached
+    second.close()
+    assert not os.path.exists(f"/dev/shm/{name}")
+
+    crashed = SharedMemoryBackend(name=name, slots=16, slot_size=64)
+    crashed.set("k", b"v")
+    crashed._users_file.close()  # the process died without close(): its users lock is gone, the segment isn't
+    restarted = SharedMemoryBackend(name=name, slots=32, slot_size=64)
+    try:
+        assert restarted.get("k") is None
+        restarted.set("other", b"x")
+    finally:
+        restarted.close()
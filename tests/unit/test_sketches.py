@@ -0,0 +1,51 @@
+import pytest
+
+from app.sketches import CountMinSketch, HyperLogLog, SketchSet
+
+
+def test_hyperloglog_estimate_within_error():
+    hll = HyperLogLog(precision=12)
+    for i in range(20000):
+        hll.add(f"user-{i}")
+    assert abs(hll.count() - 20000) / 20000 < 3 * hll.relative_error
+
+
+def test_hyperloglog_small_counts_and_duplicates():
+    hll = HyperLogLog()
+    for _ in range(5):
+        for i in range(50):
+            hll.add(str(i))
+    assert hll.count() == pytest.approx(50, rel=0.05)
+
+
+def test_hyperloglog_merge_is_union():
+    left, right, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+        (left if i % 2 else right).add(str(i))
+        both.add(str(i))
+    assert left.merge(right).registers == both.registers
+
+
+def test_count_min_never_undercounts():
+    cms = CountMinSketch(width=256, depth=4)
+    truth = {}
+    for i in range(5000):
+        key = str(i % 700)
+        truth[key] = truth.get(key, 0) + 1
+        cms.add(key)
+    over = [cms.estimate(k) - n for k, n in truth.items()]
+    assert min(over) >= 0
+    assert sum(o <= cms.error_bound for o in over) / len(over) >= cms.confidence - 0.05
+
+
+def test_sketch_set_round_trip_and_merge():
+    first, second = SketchSet(), SketchSet()
+    for i in range(100):
+        first.observe("Add", 1.0, 2.0, 3.0, i)
+        second.observe("Add", 5.0, 5.0, 10.0, i + 50)
+    restored = SketchSet.from_bytes(first.to_bytes())
+    assert restored.hot_pairs("Add")[0] == (["Add", 1.0, 2.0], 100)
+    restored.merge(SketchSet.from_bytes(second.to_bytes()))
+    assert restored.users["Add"].count() == pytest.approx(150, rel=0.05)
+    assert restored.results["Add"].count == 200
+    assert [n for _, n in restored.hot_pairs()] == [100, 100]
@@ -0,0 +1,71 @@
+import random
+import statistics as reference
+
+import pytest
+
+from app.operations import statistics
+
+
+@pytest.fixture(params=["numpy", "pure"])
+def kernels(request, monkeypatch):
+    """Run each test with the vectorised kernels and with the pure-Python fallback."""
+    if request.param == "numpy":
+        if statistics.np is None:
+            pytest.skip("numpy not installed")
+    else:
+        monkeypatch.setattr(statistics, "np", None)
+    monkeypatch.setattr(statistics, "STATS_CHUNK_SIZE", 1000)
+    return statistics
+
+
+def _data(n=20000, seed=3):
+    rng = random.Random(seed)
+    return [rng.gauss(50, 10) for _ in range(n)]
+
+
+def test_running_stats_match_reference(kernels):
+    data = _data()
+    stats = kernels.RunningStats().update(iter(data))
+    assert stats.n == len(data)
+    assert stats.total == pytest.approx(sum(data))
+    assert stats.mean == pytest.approx(reference.fmean(data))
+    assert stats.stddev() == pytest.approx(reference.stdev(data))
+    assert (stats.min, stats.max) == (min(data), max(data))
+
+
+def test_running_stats_merge_equals_single_pass(kernels):
+    data = _data()
+    left = kernels.RunningStats().update(data[:7000])
+    right = kernels.RunningStats().update(data[7000:])
+    assert left.merge(right).stddev() == pytest.approx(reference.stdev(data))
+
+
+def test_tdigest_quantiles_are_close(kernels):
+    data = _data(50000)
+    ordered = sorted(data)
+    digest = kernels.TDigest().update(iter(data))
+    assert len(digest.means) <= digest.compression
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert digest.quantile(q) == pytest.approx(exact, abs=0.5)
+
+
+def test_percentile_exact_for_lists(kernels):
+    assert kernels.percentile([1, 2, 3, 4], 50) == 2.5
+    assert kernels.percentile([5], 90) == 5
+    assert kernels.percentile([1, 2, 3, 4], 100) == 4
+    data = _data(50001)
+    assert kernels.percentile(data, 50) == pytest.approx(reference.median(data))
+
+
+def test_percentile_streams_iterators(kernels):
+    assert kernels.percentile(iter(range(1001)), 50) == pytest.approx(500, abs=1)
+
+
+def test_aggregate_errors(kernels):
+    with pytest.raises(ValueError):
+        kernels.mean([])
+    with pytest.raises(ValueError):
+        kernels.stddev([1.0])
+    with pytest.raises(ValueError):
+        kernels.percentile([1.0], 101)
@@ -0,0 +1,34 @@
+import time
+
+from app import user_cache
+from app.user_cache import BloomFilter, TTLCache
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f"user{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300  # ~1% expected
+
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None  # least recently used
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+
+
+def test_user_changed_drops_cached_records():
+    user_cache.user_records.set("someone", {"id": 1, "username": "someone", "email": "s@example.com",
+                                            "password_hash": "x", "created_at": None})
+    assert user_cache.cached_user("someone").id == 1
+    user_cache.user_changed()
+    assert user_cache.cached_user("someone") is None